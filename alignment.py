@@ -1,10 +1,11 @@
 """The `alignment` module provides an implementation of the Needleman-Wunsch alignment algorithm."""
 
-from typing import Tuple, Literal, List
-from math import floor
+from typing import Tuple, Literal, List, Optional, Union
+from math import ceil, floor
 
 import numpy as np
 
+from scoring import CHEMICAL_CLASS, SubstitutionScheme, default_scheme
 from stats import variance
 
 
@@ -14,19 +15,13 @@ MOVE_DOWN = 2
 EditMove = Literal[MOVE_DIAGONAL, MOVE_RIGHT, MOVE_DOWN]
 
 
-CHEMICAL_CLASS = {
-    "A": "Purine",
-    "G": "Purine",
-    "T": "Pyrimidine",
-    "C": "Pyrimidine",
-}
-
-
 class AlignmentResult:
     """
     AlignmentResult represents the result of performing an alignment on two sequences.
     """
 
+    __slots__ = ("alignment_1", "alignment_2", "mismatch_mask", "mismatch_prefix")
+
     def __init__(self, alignment_1: str, alignment_2: str):
         """
         Produces a new AlignmentResult representing the result of performing an alignment on
@@ -36,6 +31,8 @@ class AlignmentResult:
             raise ValueError("input strings have differing lengths")
         self.alignment_1 = alignment_1
         self.alignment_2 = alignment_2
+        self.mismatch_mask = None
+        self.mismatch_prefix = None
 
     def get_alignment_length(self) -> int:
         """Returns the length of the alignment."""
@@ -49,13 +46,40 @@ class AlignmentResult:
         """Returns the second alignment string."""
         return self.alignment_2
 
+    def get_mismatch_mask(self) -> np.ndarray:
+        """
+        Returns a boolean array that is `True` wherever the two alignment strings
+        differ. This is computed on first use and cached, and should not be modified.
+        """
+        if self.mismatch_mask is None:
+            # UTF-32 keeps one array element per character
+            alignment_1 = np.frombuffer(
+                self.alignment_1.encode("utf-32-le"), dtype=np.uint32
+            )
+            alignment_2 = np.frombuffer(
+                self.alignment_2.encode("utf-32-le"), dtype=np.uint32
+            )
+            self.mismatch_mask = alignment_1 != alignment_2
+        return self.mismatch_mask
+
+    def get_mismatch_prefix(self) -> np.ndarray:
+        """
+        Returns the cumulative number of mismatches in the alignment, with a leading
+        zero, so that the mismatches between positions `i` and `j` are
+        `prefix[j] - prefix[i]`. This is computed on first use and cached.
+        """
+        if self.mismatch_prefix is None:
+            self.mismatch_prefix = np.zeros(len(self.alignment_1) + 1, dtype=np.int64)
+            np.cumsum(self.get_mismatch_mask(), out=self.mismatch_prefix[1:])
+        return self.mismatch_prefix
+
     def get_match_string(self) -> str:
         """Returns the match string for the alignment."""
-        return "".join(
-            [
-                "|" if self.alignment_1[i] == self.alignment_2[i] else " "
-                for i in range(len(self.alignment_1))
-            ]
+        return (
+            np.where(self.get_mismatch_mask(), ord(" "), ord("|"))
+            .astype(np.uint8)
+            .tobytes()
+            .decode("ascii")
         )
 
     def clustered_mismatches(self, cluster_count: int) -> List[int]:
@@ -69,14 +93,13 @@ class AlignmentResult:
         if cluster_count < 1:
             raise ValueError("cluster count must be greater than or equal to 1")
 
-        match_string = self.get_match_string()
+        prefix = self.get_mismatch_prefix()
 
-        cluster_size = floor(len(match_string) / cluster_count)
+        cluster_size = floor(len(self.alignment_1) / cluster_count)
+        n_clusters = len(self.alignment_1) // cluster_size
+        bounds = prefix[: n_clusters * cluster_size + 1 : cluster_size]
 
-        return [
-            match_string[i * cluster_size : i * cluster_size + cluster_size].count(" ")
-            for i in range(0, len(match_string) // cluster_size)
-        ]
+        return np.diff(bounds).tolist()
 
     def clustered_mismatch_variance(self, cluster_count: int) -> float:
         """
@@ -90,33 +113,70 @@ class AlignmentResult:
             sample=False,
         )
 
+    def clustered_mismatch_variances(self, cluster_counts: List[int]) -> List[float]:
+        """
+        Returns the variance between the mismatch clusters for each of the
+        provided `cluster_counts`, in the same order. This is equivalent to
+        calling `clustered_mismatch_variance` for each count, but the clusters
+        of every count are read from the mismatch prefix sums at once.
+        """
+        counts = np.asarray(cluster_counts, dtype=np.int64)
+        if (counts < 1).any():
+            raise ValueError("cluster count must be greater than or equal to 1")
+
+        length = len(self.alignment_1)
+        sizes = length // counts
+        if (sizes < 1).any():
+            raise ValueError("cluster count must not exceed the alignment length")
+        n_clusters = length // sizes
+
+        # Number each cluster within its count, and find where it starts
+        owners = np.repeat(np.arange(len(counts)), n_clusters)
+        firsts = np.cumsum(n_clusters) - n_clusters
+        starts = (np.arange(n_clusters.sum()) - firsts[owners]) * sizes[owners]
+
+        prefix = self.get_mismatch_prefix()
+        mismatches = prefix[starts + sizes[owners]] - prefix[starts]
+        sums = np.bincount(owners, weights=mismatches, minlength=len(counts))
+        squares = np.bincount(owners, weights=mismatches**2, minlength=len(counts))
+        return ((squares - np.square(sums) / n_clusters) / n_clusters).tolist()
+
+    def mismatch_density(
+        self, window_size: int, step: int = 1
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Slides a window of `window_size` elements over the alignment, moving
+        `step` elements at a time, and returns a tuple of the window starting
+        positions and the fraction of mismatches in each window.
+        """
+        if window_size < 1 or step < 1:
+            raise ValueError("window size and step must be greater than or equal to 1")
+
+        prefix = self.get_mismatch_prefix()
+        starts = np.arange(0, len(self.alignment_1) - window_size + 1, step)
+        return starts, (prefix[starts + window_size] - prefix[starts]) / window_size
+
     def matches(self) -> int:
         """Returns the number of matching elements for the alignment."""
-        return self.get_match_string().count("|")
+        return len(self.alignment_1) - self.hamming_distance()
 
     def hamming_distance(self) -> int:
         """Returns the Hamming distance of the alignment."""
-        return len(self.alignment_1) - self.matches()
+        return int(self.get_mismatch_prefix()[-1])
 
     def largest_mismatch(self) -> Tuple[int, int]:
         """Returns the position and size of the largest mismatch in the alignment."""
-        matches = self.get_match_string()
-        found_mismatch = False
-        largest_mismatch = 0
-        largest_mismatch_pos = 0
-        current_mismatch = 0
-        for i, c in enumerate(matches):
-            if c == " ":
-                found_mismatch = True
-                current_mismatch += 1
-                if current_mismatch > largest_mismatch:
-                    largest_mismatch = current_mismatch
-                    largest_mismatch_pos = i - largest_mismatch + 1
-            else:
-                current_mismatch = 0
-        if found_mismatch:
-            return (largest_mismatch_pos, largest_mismatch)
-        return (-1, 0)
+        mismatches = self.get_mismatch_mask()
+        if not mismatches.any():
+            return (-1, 0)
+
+        # Runs of mismatches start where the padded mask rises and end where it falls
+        edges = np.diff(np.concatenate(([0], mismatches.view(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1)
+        sizes = np.flatnonzero(edges == -1) - starts
+
+        largest = int(np.argmax(sizes))  # The first of any tied runs
+        return (int(starts[largest]), int(sizes[largest]))
 
     def format_result(self, line_length: int = 80):
         """
@@ -188,7 +248,7 @@ def score_cell(
     left_char: str,
     nucleotides: bool,
     chemical_classes: dict,
-) -> np.int:
+) -> np.int64:
     """Calculate the Needleman-Wunsch score for a cell."""
     down_score = quad[0, 1] - 1
     right_score = quad[1, 0] - 1
@@ -204,27 +264,38 @@ def score_cell(
     return max([down_score, right_score, diag_score])
 
 
-def align_sequences(
-    top_seq: str, left_seq: str, nucleotides: bool = True
-) -> AlignmentResult:
+def init_search_matrix(size1: int, size2: int, gap_penalty: int = 1) -> np.ndarray:
     """
-    This function aligns the two provided sequences using Needleman-Wunsch
-    alignment. It uses a scoring scheme with a gap penalty of -1, a match
-    bonus of 1, and a mismatch penalty of -1. If the two sequences are
-    `nucleotides`, then an additional -1 penalty is applied to transversions.
+    Builds a `size2` by `size1` search matrix with the gap penalties
+    filled into its first row and column.
     """
+    search = np.zeros((size2, size1), dtype=np.int64)
+    search[0] = np.arange(0, -size1, -1) * gap_penalty
+    search[:, 0] = np.arange(0, -size2, -1) * gap_penalty
+    return search
+
+
+def fill_reference(
+    top_seq: str,
+    left_seq: str,
+    nucleotides: bool,
+    scheme: Optional[SubstitutionScheme] = None,
+) -> np.ndarray:
+    """
+    Fills the Needleman-Wunsch search matrix one cell at a time with
+    `score_cell`. This is slow, and is kept as the reference that the
+    other fill engines are checked against. It only supports the
+    default scoring schemes.
+    """
+    if scheme is not None and scheme is not default_scheme(nucleotides):
+        raise ValueError("the reference engine only supports the default schemes")
 
     size1 = len(top_seq) + 1
     size2 = len(left_seq) + 1
 
     chemical_classes = CHEMICAL_CLASS  # Copy this into the local scope so it can be accessed more quickly
 
-    # Build search matrix
-    search = np.zeros((size2, size1), dtype=np.int)
-    search[0] = [i for i in range(0, -size1, -1)]
-    search[:, 0] = [i for i in range(0, -size2, -1)]
-
-    # Do scoring
+    search = init_search_matrix(size1, size2)
     for x in range(1, size2):
         for y in range(1, size1):
             search[x, y] = score_cell(
@@ -234,6 +305,306 @@ def align_sequences(
                 nucleotides,
                 chemical_classes,
             )
+    return search
+
+
+class ScoringInputs:
+    """
+    ScoringInputs holds the encoded forms of a pair of sequences so the vectorized
+    engines can look up cell scores for whole rows or diagonals at once. Cell
+    positions use search matrix coordinates, where `x` indexes `left_seq` and
+    `y` indexes `top_seq`, both offset by one for the gap row and column.
+    """
+
+    def __init__(self, top_seq: str, left_seq: str, scheme: SubstitutionScheme):
+        """Encodes the two sequences for vectorized scoring with `scheme`."""
+        self.scheme = scheme
+        self.top = scheme.encode(top_seq)
+        self.left = scheme.encode(left_seq)
+        self.init_gap_codes()
+
+    def init_gap_codes(self):
+        """
+        Builds copies of the encoded sequences offset by one, where index 0 refers
+        to the scheme's gap row/column so that edge indels need no special casing.
+        """
+        border = len(self.scheme.alphabet)
+        self.top_gap_codes = np.insert(self.top, 0, border, axis=-1)
+        self.left_gap_codes = np.insert(self.left, 0, border)
+
+    def diag_scores(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """Returns the score for reaching cells `(xs, ys)` with a diagonal move."""
+        return self.scheme.scores[self.top[..., ys - 1], self.left[xs - 1]]
+
+    def gap_costs(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """Returns the penalty for reaching cells `(xs, ys)` with an indel."""
+        if self.scheme.uniform_gaps:
+            return np.full(
+                np.broadcast(xs, ys).shape, self.scheme.gap_penalty, dtype=np.int64
+            )
+        return self.scheme.gap_penalties[
+            self.top_gap_codes[..., ys], self.left_gap_codes[xs]
+        ]
+
+
+class BatchScoringInputs(ScoringInputs):
+    """
+    BatchScoringInputs stacks several top sequences of the same length along
+    a leading axis, so every lookup returns one row of scores per sequence.
+    """
+
+    def __init__(
+        self,
+        top_seqs: Union[List[str], np.ndarray],
+        left_seq: Union[str, np.ndarray],
+        scheme: SubstitutionScheme,
+    ):
+        """
+        Encodes the top sequences and the shared left sequence for vectorized scoring.
+        The top sequences may also be provided already encoded, one per row.
+        """
+        self.scheme = scheme
+        if isinstance(top_seqs, np.ndarray):
+            self.top = top_seqs
+        else:
+            self.top = np.stack([scheme.encode(seq) for seq in top_seqs])
+        self.left = scheme.encode(left_seq)
+        self.init_gap_codes()
+
+
+def trace_wavefront(scoring: ScoringInputs) -> np.ndarray:
+    """
+    Scores the search matrix one anti-diagonal at a time. Every cell on an
+    anti-diagonal only depends on the two anti-diagonals before it, so each one is
+    scored with a handful of vector operations, and only the last two are kept.
+    Instead of the scores, each cell records the move `backtrack` would make from
+    it in a `uint8` matrix, which is all `unwind_moves` needs to recover the
+    alignment, the same one `unwind` finds through `fill_reference`. `scoring` can
+    also be a `BatchScoringInputs`, in which case one matrix of moves is returned
+    per top sequence, stacked along the first axis.
+    """
+    size1 = scoring.top.shape[-1] + 1
+    size2 = len(scoring.left) + 1
+    batch_shape = scoring.top.shape[:-1]
+    gap_penalty = scoring.scheme.gap_penalty
+
+    moves = np.full(batch_shape + (size2, size1), MOVE_DIAGONAL, dtype=np.uint8)
+    moves[..., 0, :] = MOVE_RIGHT
+    moves[..., :, 0] = MOVE_DOWN
+    flat_moves = moves.reshape(batch_shape + (-1,))
+
+    # Anti-diagonals are indexed by x, the row of each cell
+    prev2 = np.zeros(batch_shape + (size2,), dtype=np.int64)
+    prev1 = np.full(batch_shape + (size2,), -gap_penalty, dtype=np.int64)
+    for d in range(2, size1 + size2 - 1):
+        cur = np.empty_like(prev1)
+        if d < size1:
+            cur[..., 0] = -d * gap_penalty
+        if d < size2:
+            cur[..., d] = -d * gap_penalty
+
+        x_lo, x_hi = max(1, d - size1 + 1), min(size2 - 1, d - 1)
+        xs = np.arange(x_lo, x_hi + 1)
+        ys = d - xs
+
+        down_neighbor = prev1[..., x_lo - 1 : x_hi]
+        right_neighbor = prev1[..., x_lo : x_hi + 1]
+        diag_neighbor = prev2[..., x_lo - 1 : x_hi]
+
+        gap_costs = scoring.gap_costs(xs, ys)
+        cur[..., x_lo : x_hi + 1] = np.maximum(
+            np.maximum(down_neighbor, right_neighbor) - gap_costs,
+            diag_neighbor + scoring.diag_scores(xs, ys),
+        )
+
+        # numpy's argmax doesn't allow for prioritizing non-indels
+        move = np.where(right_neighbor > diag_neighbor, MOVE_RIGHT, MOVE_DIAGONAL)
+        best_neighbor = np.maximum(right_neighbor, diag_neighbor)
+        move = np.where(down_neighbor > best_neighbor, MOVE_DOWN, move)
+        flat_moves[..., xs * size1 + ys] = move
+
+        prev2, prev1 = prev1, cur
+    return moves
+
+
+def next_row(
+    scoring: ScoringInputs, prev: np.ndarray, x: int, y0: int, y1: int
+) -> np.ndarray:
+    """
+    Scores row `x` of the search matrix over columns `y0` through `y1` from
+    the row above it. The left-to-right dependency along the row is resolved
+    with a running maximum, so the whole row is computed without a Python loop.
+    """
+    ys = np.arange(y0, y1 + 1)
+    gap_costs = scoring.gap_costs(x, ys)
+
+    row = prev - gap_costs
+    row[1:] = np.maximum(row[1:], prev[:-1] + scoring.diag_scores(x, ys[1:]))
+
+    # row[y] = max over k <= y of (row[k] - gaps between k and y)
+    offsets = np.zeros_like(row)
+    np.cumsum(gap_costs[1:], out=offsets[1:])
+    return np.maximum.accumulate(row + offsets) - offsets
+
+
+def first_row(scoring: ScoringInputs, x: int, y0: int, y1: int) -> np.ndarray:
+    """Scores row `x` over columns `y0` through `y1` using only rightward moves."""
+    gap_costs = scoring.gap_costs(x, np.arange(y0 + 1, y1 + 1))
+    row = np.zeros(gap_costs.shape[:-1] + (y1 - y0 + 1,), dtype=np.int64)
+    np.cumsum(-gap_costs, axis=-1, out=row[..., 1:])
+    return row
+
+
+def forward_scores(
+    scoring: ScoringInputs, x0: int, x1: int, y0: int, y1: int
+) -> np.ndarray:
+    """
+    Returns row `x1` of the search matrix restricted to the rectangle from
+    `(x0, y0)` to `(x1, y1)`, using only one row of memory at a time.
+    """
+    row = first_row(scoring, x0, y0, y1)
+    for x in range(x0 + 1, x1 + 1):
+        row = next_row(scoring, row, x, y0, y1)
+    return row
+
+
+def reverse_scores(
+    scoring: ScoringInputs, x0: int, x1: int, y0: int, y1: int
+) -> np.ndarray:
+    """
+    Returns, for each cell in row `x0` between `y0` and `y1`, the best score of a
+    path from that cell to `(x1, y1)`, using only one row of memory at a time.
+    """
+    ys = np.arange(y0, y1 + 1)
+    gap_costs = scoring.gap_costs(x1, ys)
+
+    # Only leftward moves are possible along the last row
+    row = np.zeros(y1 - y0 + 1, dtype=np.int64)
+    np.cumsum(-gap_costs[:0:-1], out=row[-2::-1])
+
+    for x in range(x1 - 1, x0 - 1, -1):
+        below = row
+        row = below - gap_costs
+        row[:-1] = np.maximum(row[:-1], below[1:] + scoring.diag_scores(x + 1, ys[1:]))
+
+        gap_costs = scoring.gap_costs(x, ys)
+        offsets = np.zeros_like(row)
+        np.cumsum(gap_costs[1:], out=offsets[1:])
+        row = np.maximum.accumulate((row - offsets)[::-1])[::-1] + offsets
+    return row
+
+
+def align_block(
+    scoring: ScoringInputs,
+    top_seq: str,
+    left_seq: str,
+    x0: int,
+    x1: int,
+    y0: int,
+    y1: int,
+) -> Tuple[str, str]:
+    """
+    Aligns the rectangle from `(x0, y0)` to `(x1, y1)` with a full search matrix,
+    and returns the aligned slices of the top and left sequences.
+    """
+    rows = [first_row(scoring, x0, y0, y1)]
+    for x in range(x0 + 1, x1 + 1):
+        rows.append(next_row(scoring, rows[-1], x, y0, y1))
+    search = np.array(rows)
+
+    final_top = []
+    final_left = []
+
+    x, y = x1, y1
+    while x != x0 or y != y0:
+        score = search[x - x0, y - y0]
+        if (
+            x > x0
+            and y > y0
+            and score == search[x - x0 - 1, y - y0 - 1] + scoring.diag_scores(x, y)
+        ):
+            final_top.append(top_seq[y - 1])
+            final_left.append(left_seq[x - 1])
+            x -= 1
+            y -= 1
+        elif y > y0 and score == search[x - x0, y - y0 - 1] - scoring.gap_costs(x, y):
+            final_top.append(top_seq[y - 1])
+            final_left.append("-")
+            y -= 1
+        else:
+            final_top.append("-")
+            final_left.append(left_seq[x - 1])
+            x -= 1
+
+    return "".join(reversed(final_top)), "".join(reversed(final_left))
+
+
+# Rectangles at or below this many cells are aligned with a full search matrix
+HIRSCHBERG_BLOCK_CELLS = 1 << 16
+
+
+def align_linear(
+    top_seq: str,
+    left_seq: str,
+    nucleotides: bool = True,
+    scheme: Optional[SubstitutionScheme] = None,
+) -> AlignmentResult:
+    """
+    Aligns the two provided sequences with the same scoring scheme as
+    `align_sequences`, using Hirschberg's divide-and-conquer algorithm so
+    that memory use grows with the sum of the sequence lengths rather than
+    their product. This always returns an optimal alignment, but where several
+    alignments score the same, it can return a different one from the full-matrix
+    engines, which trace back through the highest-scoring neighbouring cell. Mismatch
+    statistics such as `clustered_mismatch_variance` depend on which alignment is
+    chosen, so this is not a drop-in replacement for them in the analysis and
+    simulations, whose observed and simulated alignments must use the same engine.
+    """
+    scoring = ScoringInputs(top_seq, left_seq, scheme or default_scheme(nucleotides))
+    top_parts = []
+    left_parts = []
+
+    def solve(x0: int, x1: int, y0: int, y1: int):
+        if x1 - x0 <= 1 or (x1 - x0 + 1) * (y1 - y0 + 1) <= HIRSCHBERG_BLOCK_CELLS:
+            top_part, left_part = align_block(
+                scoring, top_seq, left_seq, x0, x1, y0, y1
+            )
+            top_parts.append(top_part)
+            left_parts.append(left_part)
+            return
+
+        mid = (x0 + x1) // 2
+        scores = forward_scores(scoring, x0, mid, y0, y1) + reverse_scores(
+            scoring, mid, x1, y0, y1
+        )
+        split = y0 + int(np.argmax(scores))
+        solve(x0, mid, y0, split)
+        solve(mid, x1, split, y1)
+
+    solve(0, len(left_seq), 0, len(top_seq))
+    return AlignmentResult("".join(top_parts), "".join(left_parts))
+
+
+def alignment_score(
+    top_seq: str,
+    left_seq: str,
+    nucleotides: bool = True,
+    scheme: Optional[SubstitutionScheme] = None,
+) -> int:
+    """
+    Returns the Needleman-Wunsch score of the best alignment of the two provided
+    sequences without tracing back the alignment itself. This only keeps one row
+    of the search matrix in memory at a time.
+    """
+    scoring = ScoringInputs(top_seq, left_seq, scheme or default_scheme(nucleotides))
+    return int(forward_scores(scoring, 0, len(left_seq), 0, len(top_seq))[-1])
+
+
+def unwind(search: np.ndarray, top_seq: str, left_seq: str) -> AlignmentResult:
+    """Traces back through a filled search matrix to recover the alignment."""
+    size1 = len(top_seq) + 1
+    size2 = len(left_seq) + 1
+
     search = search.T
 
     # Unwind result
@@ -258,3 +629,377 @@ def align_sequences(
             bt_x -= 1
 
     return AlignmentResult(final_top, final_left)
+
+
+def unwind_moves(moves: np.ndarray, top_seq: str, left_seq: str) -> AlignmentResult:
+    """
+    Follows the moves recorded by `trace_wavefront` back from the bottom-right
+    corner of the search matrix to recover the alignment.
+    """
+    x, y = len(left_seq), len(top_seq)
+
+    # The alignment is written into the buffers from the end
+    pos = x + y
+    final_top = [""] * pos
+    final_left = [""] * pos
+
+    while x != 0 or y != 0:
+        pos -= 1
+        next_move = moves[x, y]
+        if next_move == MOVE_DIAGONAL:
+            final_top[pos] = top_seq[y - 1]
+            final_left[pos] = left_seq[x - 1]
+            x -= 1
+            y -= 1
+        elif next_move == MOVE_DOWN:
+            final_top[pos] = "-"
+            final_left[pos] = left_seq[x - 1]
+            x -= 1
+        else:
+            final_top[pos] = top_seq[y - 1]
+            final_left[pos] = "-"
+            y -= 1
+
+    return AlignmentResult("".join(final_top[pos:]), "".join(final_left[pos:]))
+
+
+# Score given to cells outside of a band. This never wins a comparison, but
+# stays far enough from the int64 limit that subtracting penalties is safe.
+NEG_INF = -(1 << 40)
+
+# Automatically chosen bandwidths cover this fraction of the longer sequence,
+# and are never narrower than the minimum width
+BANDED_MIN_WIDTH = 32
+BANDED_WIDTH_FRACTION = 0.05
+
+
+def auto_bandwidth(top_len: int, left_len: int) -> int:
+    """Chooses a bandwidth for aligning sequences with the provided lengths."""
+    return max(BANDED_MIN_WIDTH, ceil(BANDED_WIDTH_FRACTION * max(top_len, left_len)))
+
+
+def band_limits(top_len: int, left_len: int, bandwidth: int) -> Tuple[int, int]:
+    """
+    Returns the lowest and highest diagonals `y - x` of a band that extends
+    `bandwidth` diagonals past both the main diagonal and the diagonal ending
+    in the bottom-right corner of the search matrix.
+    """
+    corner = top_len - left_len
+    return min(0, corner) - bandwidth, max(0, corner) + bandwidth
+
+
+def fill_banded(
+    scoring: ScoringInputs, lo: int, hi: int, x_drop: Optional[int] = None
+) -> np.ndarray:
+    """
+    Fills the cells of the search matrix on diagonals `lo` through `hi`, one
+    row at a time. Row `x` of the returned band holds column `x + lo + j` of the
+    search matrix at index `j`, and cells that were not computed are `NEG_INF`.
+    If `x_drop` is set, cells scoring more than `x_drop` below the best score
+    seen so far are dropped, and later rows skip the columns they lead to.
+    `scoring` can also be a `BatchScoringInputs`, in which case one band is
+    filled per top sequence.
+    """
+    left_len = scoring.left.shape[-1]
+    top_len = scoring.top.shape[-1]
+    width = hi - lo + 1
+
+    # The extra last column stays at NEG_INF, standing in for cells past the band
+    band = np.full(
+        scoring.top.shape[:-1] + (left_len + 1, width + 1), NEG_INF, dtype=np.int64
+    )
+    y_hi = min(top_len, hi)
+    band[..., 0, -lo : y_hi - lo + 1] = first_row(scoring, 0, 0, y_hi)
+
+    if x_drop is not None:
+        best = band[..., 0, :].max(axis=-1, keepdims=True)
+        # Dropped cells can only reach this many columns further with rightward moves
+        reach = x_drop // max(1, int(scoring.scheme.gap_penalties.min())) + 1
+        live_lo, live_hi = 0, y_hi
+
+    for x in range(1, left_len + 1):
+        y_lo, y_hi = max(0, x + lo), min(top_len, x + hi)
+        if x_drop is not None:
+            y_lo, y_hi = max(y_lo, live_lo), min(y_hi, live_hi + reach)
+            if y_lo > y_hi:
+                break
+
+        ys = np.arange(y_lo, y_hi + 1)
+        js = ys - x - lo
+        prev = band[..., x - 1, :]
+
+        gap_costs = scoring.gap_costs(x, ys)
+        row = prev[..., js + 1] - gap_costs
+        start = 1 if y_lo == 0 else 0
+        row[..., start:] = np.maximum(
+            row[..., start:],
+            prev[..., js[start:]] + scoring.diag_scores(x, ys[start:]),
+        )
+
+        offsets = np.zeros(gap_costs.shape, dtype=np.int64)
+        np.cumsum(gap_costs[..., 1:], axis=-1, out=offsets[..., 1:])
+        row = np.maximum(
+            np.maximum.accumulate(row + offsets, axis=-1) - offsets, NEG_INF
+        )
+
+        if x_drop is not None:
+            best = np.maximum(best, row.max(axis=-1, keepdims=True))
+            row[row < best - x_drop] = NEG_INF
+            live = np.flatnonzero((row > NEG_INF).reshape(-1, len(ys)).any(axis=0))
+            if len(live) == 0:
+                break
+            live_lo, live_hi = y_lo + live[0], y_lo + live[-1]
+
+        band[..., x, js] = row
+    return band
+
+
+def exact_in_band(
+    band: np.ndarray,
+    lo: int,
+    hi: int,
+    xs: np.ndarray,
+    ys: np.ndarray,
+    scheme: SubstitutionScheme,
+) -> bool:
+    """
+    Returns whether the cells `(xs, ys)` of a band filled by `fill_banded` without an
+    X-drop cutoff hold the same scores as the full search matrix. A banded score is the
+    best score of the paths that stay in the band. A path that leaves the band needs
+    enough indels to reach a diagonal outside of it and come back, which bounds its
+    score, so a cell's banded score is exact if no such path can score higher.
+    """
+    ds = ys - xs
+    scores = band[xs, ds - lo]
+
+    # Paths to (x, y) only cross the diagonals from -x to y
+    below = lo - 1 >= -xs
+    above = hi + 1 <= ys
+    indels = np.minimum(
+        np.where(below, ds - 2 * (lo - 1), xs + ys),
+        np.where(above, 2 * (hi + 1) - ds, xs + ys),
+    )
+    max_score = max(0, int(scheme.scores.max()))
+    min_gap = max(0, int(scheme.gap_penalties.min()))
+    bound = max_score * (xs + ys - indels) // 2 - min_gap * indels
+    return bool(np.all(~(below | above) | (scores >= bound)))
+
+
+def unwind_banded(
+    band: np.ndarray,
+    lo: int,
+    hi: int,
+    top_seq: str,
+    left_seq: str,
+    scheme: Optional[SubstitutionScheme] = None,
+) -> Optional[AlignmentResult]:
+    """
+    Traces back through a band filled by `fill_banded`, breaking ties between moves
+    the same way as `unwind`. Returns `None` if the band was too narrow, meaning that
+    the traceback touched one of its edges or could not reach the bottom-right corner
+    of the search matrix. If `scheme` is provided, this also returns `None` unless
+    `exact_in_band` confirms that every score the traceback compared matches the full
+    search matrix, so that any alignment returned is the one `unwind` would find.
+    """
+    x, y = len(left_seq), len(top_seq)
+    if band[x, y - x - lo] == NEG_INF:
+        return None
+
+    def score(x: int, y: int) -> int:
+        j = y - x - lo
+        return band[x, j] if 0 <= j < band.shape[1] else NEG_INF
+
+    final_top = []
+    final_left = []
+    compared = []
+
+    while x != 0 or y != 0:
+        if (y - x == lo and lo > -len(left_seq)) or (y - x == hi and hi < len(top_seq)):
+            return None
+
+        # Break ties the same way as backtrack
+        if y == 0:
+            next_move = MOVE_DOWN
+        elif x == 0:
+            next_move = MOVE_RIGHT
+        else:
+            compared.append((x, y))
+            next_move = MOVE_DIAGONAL
+            next_score = score(x - 1, y - 1)
+            if score(x, y - 1) > next_score:
+                next_move = MOVE_RIGHT
+                next_score = score(x, y - 1)
+            if score(x - 1, y) > next_score:
+                next_move = MOVE_DOWN
+
+        if next_move == MOVE_DIAGONAL:
+            final_top.append(top_seq[y - 1])
+            final_left.append(left_seq[x - 1])
+            x -= 1
+            y -= 1
+        elif next_move == MOVE_DOWN:
+            final_top.append("-")
+            final_left.append(left_seq[x - 1])
+            x -= 1
+        else:
+            final_top.append(top_seq[y - 1])
+            final_left.append("-")
+            y -= 1
+
+    if scheme is not None and compared:
+        xs, ys = np.array(compared).T
+        neighbors_x = np.concatenate((xs - 1, xs, xs - 1))
+        neighbors_y = np.concatenate((ys - 1, ys - 1, ys))
+        if not exact_in_band(band, lo, hi, neighbors_x, neighbors_y, scheme):
+            return None
+
+    return AlignmentResult("".join(reversed(final_top)), "".join(reversed(final_left)))
+
+
+def align_banded(
+    top_seq: str,
+    left_seq: str,
+    nucleotides: bool = True,
+    bandwidth: Optional[int] = None,
+    x_drop: Optional[int] = None,
+    scheme: Optional[SubstitutionScheme] = None,
+    diagonals: Optional[Tuple[int, int]] = None,
+) -> AlignmentResult:
+    """
+    Aligns the two provided sequences like `align_sequences`, but only computes
+    the cells of the search matrix within `bandwidth` diagonals of the path
+    between its corners. The bandwidth is chosen with `auto_bandwidth` if it is
+    not provided. Alternatively, `diagonals` sets the lowest and highest
+    diagonals `y - x` of the band directly, which must include the diagonals of
+    both corners. An `x_drop` cutoff additionally stops computing cells that
+    fall too far below the best score seen so far.
+
+    This is much faster for similar sequences. The band is only used if
+    `exact_in_band` confirms that the traceback through it matches the full search
+    matrix. Otherwise, this falls back to filling the full matrix, so the result
+    always matches the full-matrix engines. The check is conservative, and for less
+    similar sequences it usually fails, which makes this slower than filling the full
+    matrix in the first place. With an `x_drop` cutoff, the band can't be checked,
+    and the result may be a worse alignment than the full-matrix engines find.
+    """
+    if diagonals is not None:
+        lo, hi = diagonals
+        corner = len(top_seq) - len(left_seq)
+        if lo > min(0, corner) or hi < max(0, corner):
+            raise ValueError("band does not include the corners of the search matrix")
+    else:
+        if bandwidth is None:
+            bandwidth = auto_bandwidth(len(top_seq), len(left_seq))
+        lo, hi = band_limits(len(top_seq), len(left_seq), bandwidth)
+
+    scoring = ScoringInputs(top_seq, left_seq, scheme or default_scheme(nucleotides))
+    if lo > -len(left_seq) or hi < len(top_seq):
+        band = fill_banded(scoring, lo, hi, x_drop=x_drop)
+        alignment_result = unwind_banded(
+            band,
+            lo,
+            hi,
+            top_seq,
+            left_seq,
+            scheme=scoring.scheme if x_drop is None else None,
+        )
+        if alignment_result is not None:
+            return alignment_result
+
+    return unwind_moves(trace_wavefront(scoring), top_seq, left_seq)
+
+
+METHOD_WAVEFRONT = "wavefront"
+METHOD_REFERENCE = "reference"
+METHOD_LINEAR = "linear"
+METHOD_BANDED = "banded"
+
+
+def align_sequences(
+    top_seq: str,
+    left_seq: str,
+    nucleotides: bool = True,
+    method: str = METHOD_WAVEFRONT,
+    scheme: Optional[SubstitutionScheme] = None,
+) -> AlignmentResult:
+    """
+    This function aligns the two provided sequences using Needleman-Wunsch
+    alignment. It uses a scoring scheme with a gap penalty of -1, a match
+    bonus of 1, and a mismatch penalty of -1. If the two sequences are
+    `nucleotides`, then an additional -1 penalty is applied to transversions.
+    A different `SubstitutionScheme`, such as `scoring.BLOSUM62`, can be
+    passed as `scheme` to replace this scoring.
+
+    `method` selects the engine used to fill the search matrix. `"wavefront"`
+    is the vectorized default, and `"reference"` is the original cell-by-cell
+    loop. `"banded"` uses `align_banded` with an automatically chosen bandwidth.
+    These all produce identical alignments. `"linear"` uses `align_linear`, which
+    needs far less memory for long sequences, and finds an alignment with the same
+    score, but not always the same alignment, so its mismatch statistics can differ.
+    """
+    if method == METHOD_LINEAR:
+        return align_linear(top_seq, left_seq, nucleotides=nucleotides, scheme=scheme)
+    if method == METHOD_BANDED:
+        return align_banded(top_seq, left_seq, nucleotides=nucleotides, scheme=scheme)
+    if method == METHOD_REFERENCE:
+        search = fill_reference(top_seq, left_seq, nucleotides, scheme=scheme)
+        return unwind(search, top_seq, left_seq)
+    if method != METHOD_WAVEFRONT:
+        raise ValueError(f"unknown alignment method: {method}")
+
+    scoring = ScoringInputs(top_seq, left_seq, scheme or default_scheme(nucleotides))
+    return unwind_moves(trace_wavefront(scoring), top_seq, left_seq)
+
+
+def align_many(
+    query: Union[str, np.ndarray],
+    targets: Union[List[str], np.ndarray],
+    nucleotides: bool = True,
+    scheme: Optional[SubstitutionScheme] = None,
+    method: str = METHOD_WAVEFRONT,
+) -> List[AlignmentResult]:
+    """
+    Aligns each of the `targets` against `query`, returning the same results as
+    calling `align_sequences(target, query, nucleotides, method, scheme)` for
+    each target. The targets must all have the same length. Their search
+    matrices are filled together, so memory use grows with the number of
+    targets; callers aligning many targets should pass them in batches.
+    `method` may be `"wavefront"` or `"banded"`. The targets may also be
+    provided already encoded with the scheme, as a matrix with one row per
+    target, such as a batch from a `PermutationSource`, and the query as an
+    array of codes, such as one read from the sequence cache. Encoded
+    sequences are only decoded to build the returned alignments.
+    """
+    if len(targets) == 0:
+        return []
+    if any(len(target) != len(targets[0]) for target in targets):
+        raise ValueError("target sequences have differing lengths")
+
+    scheme = scheme or default_scheme(nucleotides)
+    scoring = BatchScoringInputs(targets, query, scheme)
+    if isinstance(targets, np.ndarray):
+        targets = [scheme.decode(codes) for codes in targets]
+    if isinstance(query, np.ndarray):
+        query = scheme.decode(query)
+    if method == METHOD_WAVEFRONT:
+        return [
+            unwind_moves(moves, target, query)
+            for moves, target in zip(trace_wavefront(scoring), targets)
+        ]
+    if method != METHOD_BANDED:
+        raise ValueError(f"unsupported batch alignment method: {method}")
+
+    lo, hi = band_limits(
+        len(targets[0]), len(query), auto_bandwidth(len(targets[0]), len(query))
+    )
+    bands = fill_banded(scoring, lo, hi)
+
+    # Targets whose alignments couldn't be confirmed in the band are aligned again in full
+    alignment_results = []
+    for band, target in zip(bands, targets):
+        alignment_result = unwind_banded(band, lo, hi, target, query, scheme=scheme)
+        if alignment_result is None:
+            moves = trace_wavefront(ScoringInputs(target, query, scoring.scheme))
+            alignment_result = unwind_moves(moves, target, query)
+        alignment_results.append(alignment_result)
+    return alignment_results
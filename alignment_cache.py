@@ -0,0 +1,167 @@
+"""
+The `alignment_cache` module caches alignments in memory and on disk, so that the same pair of
+sequences isn't aligned again by every script and worker process that needs it.
+"""
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:
+    # fcntl is only available on POSIX systems; elsewhere the cache isn't locked
+    fcntl = None
+
+from alignment import METHOD_WAVEFRONT, AlignmentResult, align_sequences
+from dir_utils import get_cache, make_cache_dir
+from options import ALIGNMENT_CACHE_ENTRIES, ALIGNMENT_CACHE_MAX_BYTES
+from scoring import SubstitutionScheme, default_scheme
+from sequence_cache import write_atomically
+
+# The most recently used alignments of this process, oldest first
+memory_cache = OrderedDict()
+
+
+def get_alignment_key(
+    top_seq: str,
+    left_seq: str,
+    nucleotides: bool,
+    method: str,
+    scheme: Optional[SubstitutionScheme],
+) -> str:
+    """
+    Returns the cache key of an alignment, a hash of both sequences, the `nucleotides`
+    flag, the alignment method and the scoring scheme used.
+    """
+    scheme = scheme or default_scheme(nucleotides)
+    digest = hashlib.sha256()
+    for part in [
+        top_seq,
+        left_seq,
+        str(nucleotides),
+        method,
+        scheme.name,
+        scheme.alphabet,
+        str(scheme.gap_penalty),
+    ]:
+        digest.update(part.encode() + b"\0")
+    digest.update(scheme.scores.tobytes())
+    digest.update(scheme.gap_penalties.tobytes())
+    return digest.hexdigest()
+
+
+def get_alignment_cache(filename: str) -> str:
+    """Gets the relative file path for the provided file in the alignment cache."""
+    return get_cache("alignments/" + filename)
+
+
+class AlignmentCacheLock:
+    """
+    AlignmentCacheLock holds an exclusive lock on the on-disk alignment cache while
+    it is used as a context manager, so that only one process writes to it or evicts
+    entries from it at a time. Reads don't need the lock, since entries are replaced
+    atomically. On systems without `fcntl`, such as Windows, nothing is locked, so
+    processes evicting entries at once may remove more than they need to.
+    """
+
+    def __enter__(self):
+        self.file = open(get_alignment_cache(".lock"), "a")
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+def read_cached_alignment(key: str) -> Optional[AlignmentResult]:
+    """
+    Reads the alignment with the provided key from the on-disk cache, or returns
+    `None` if it isn't cached. Reading an entry marks it as recently used.
+    """
+    filename = get_alignment_cache(f"{key}.json")
+    try:
+        with open(filename, "r") as f:
+            data = json.load(f)
+        os.utime(filename)
+    except (FileNotFoundError, json.JSONDecodeError):
+        # The entry was never written, or another process evicted it
+        return None
+    return AlignmentResult(data["alignment_1"], data["alignment_2"])
+
+
+def evict_alignments(max_bytes: int):
+    """
+    Removes the least recently used entries of the on-disk cache until its entries
+    take up at most `max_bytes`. The cache lock must be held.
+    """
+    entries = []
+    for entry in os.scandir(get_alignment_cache("")):
+        if entry.name.endswith(".json"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        os.remove(path)
+        total_bytes -= size
+
+
+def write_cached_alignment(key: str, alignment_result: AlignmentResult, max_bytes: int):
+    """Writes an alignment to the on-disk cache, evicting old entries if it is full."""
+    data = json.dumps(
+        {
+            "alignment_1": alignment_result.get_alignment_1(),
+            "alignment_2": alignment_result.get_alignment_2(),
+        }
+    ).encode()
+    with AlignmentCacheLock():
+        write_atomically(get_alignment_cache(f"{key}.json"), lambda f: f.write(data))
+        evict_alignments(max_bytes)
+
+
+def remember_alignment(key: str, alignment_result: AlignmentResult):
+    """Adds an alignment to the in-memory cache, forgetting the least recently used ones."""
+    memory_cache[key] = alignment_result
+    memory_cache.move_to_end(key)
+    while len(memory_cache) > ALIGNMENT_CACHE_ENTRIES:
+        memory_cache.popitem(last=False)
+
+
+def align_sequences_cached(
+    top_seq: str,
+    left_seq: str,
+    nucleotides: bool = True,
+    method: str = METHOD_WAVEFRONT,
+    scheme: Optional[SubstitutionScheme] = None,
+    max_bytes: int = ALIGNMENT_CACHE_MAX_BYTES,
+) -> AlignmentResult:
+    """
+    Aligns the two provided sequences like `align_sequences`, returning a cached
+    alignment if they were aligned with the same parameters before. Alignments are
+    cached in memory, and in the cache directory, which is shared by every process
+    and kept to at most `max_bytes` by removing its least recently used entries.
+    The returned alignment may be shared with other callers, and should not be
+    modified.
+    """
+    key = get_alignment_key(top_seq, left_seq, nucleotides, method, scheme)
+    alignment_result = memory_cache.get(key)
+    if alignment_result is None:
+        make_cache_dir()
+        os.makedirs(get_alignment_cache(""), exist_ok=True)
+        alignment_result = read_cached_alignment(key)
+        if alignment_result is None:
+            alignment_result = align_sequences(
+                top_seq, left_seq, nucleotides=nucleotides, method=method, scheme=scheme
+            )
+            write_cached_alignment(key, alignment_result, max_bytes)
+
+    remember_alignment(key, alignment_result)
+    return alignment_result
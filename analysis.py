@@ -1,35 +1,45 @@
 """Entrypoint analysis script."""
 
 import json
-from typing import List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
-from dnds import dnds
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import seaborn as sns
 
-from alignment import AlignmentResult, align_sequences
+from alignment import AlignmentResult
+from alignment_cache import align_sequences_cached
 from data_index import CSTSI, CSGSI, CSTSI_PROTEIN, CSGSI_PROTEIN
 from dir_utils import get_data, make_output_dir, get_output
+import dnds_engine
 from dnds_prep import trim_for_dnds
-from options import CLUSTER_COUNTS, DNDS_WINDOW_SIZES
-from parse_fasta import parse_fasta
-from sliding_window import sliding_window
-
-
-def make_cluster_graphs(seq_filename: str, alignment_result: AlignmentResult):
+from options import (
+    CLUSTER_COUNTS,
+    DNDS_BOOTSTRAP_CONFIDENCE,
+    DNDS_BOOTSTRAP_REPLICATES,
+    DNDS_WINDOW_SIZES,
+    DNDS_WINDOW_STEP,
+)
+from pipeline import Stage, run_pipeline
+from scoring import default_scheme
+from sequence_cache import read_first_sequence
+
+
+def make_cluster_graphs(
+    seq_filename: str, clustered_mismatches: Dict[int, List[int]]
+) -> List[str]:
     """
     Produces graphs with the mismatch cluster sizes and saves them to the
-    output directory.
+    output directory. `clustered_mismatches` holds the mismatches in each
+    cluster by cluster count. Returns the paths of the graphs.
     """
     sns.set_theme()
+    paths = []
 
-    for clusters in CLUSTER_COUNTS:
+    for clusters, cluster_mismatches in clustered_mismatches.items():
         # Build DataFrame of mismatch windows
-        df = pd.DataFrame(
-            {"clusters": alignment_result.clustered_mismatches(cluster_count=clusters)}
-        )
+        df = pd.DataFrame({"clusters": cluster_mismatches})
 
         sns.relplot(data=df["clusters"], kind="line")
 
@@ -44,26 +54,37 @@ def make_cluster_graphs(seq_filename: str, alignment_result: AlignmentResult):
         plt.xticks(np.arange(clusters), np.arange(1, clusters + 1))
         plt.yticks(np.arange(y_max + 1), np.arange(y_max + 1))
 
-        plt.savefig(get_output(f"{seq_filename}_clustered_mismatches_{clusters}.png"))
+        paths.append(get_output(f"{seq_filename}_clustered_mismatches_{clusters}.png"))
+        plt.savefig(paths[-1])
+
+    return paths
 
 
 def make_dnds_graph(
     seq_filename: str,
     window_sizes: List[int],
     dnds_ratio_data: List[Tuple[List[int], List[float]]],
-):
+    dnds_band_data: Optional[List[Tuple[List[float], List[float]]]] = None,
+) -> List[str]:
     """
     Produces several graphs showing dN/dS ratios across a whole sequence and saves
     them to the output directory. `window_sizes` and `dnds_ratio_data` are expected
-    to be in the same order with respect to the analyses they represent.
+    to be in the same order with respect to the analyses they represent, as is
+    `dnds_band_data`, which holds the bounds of confidence bands to shade, if any.
+    Returns the paths of the graphs.
     """
     sns.set_theme()
+    paths = []
 
     for i, window_size in enumerate(window_sizes):
         df = pd.DataFrame({"bp": dnds_ratio_data[i][0], "ratio": dnds_ratio_data[i][1]})
         df = df.set_index("bp")
 
         sns.relplot(data=df, kind="line")
+        if dnds_band_data is not None:
+            plt.fill_between(
+                dnds_ratio_data[i][0], *dnds_band_data[i], alpha=0.3, linewidth=0
+            )
 
         plt.title(f"dN/dS ratios over windows of size {window_size}")
         plt.xlabel("window starting bp")
@@ -74,84 +95,154 @@ def make_dnds_graph(
 
         plt.axhline(y=1.0, color="r", linestyle="--")
 
-        plt.savefig(get_output(f"{seq_filename}_dnds_{window_size}.png"))
+        paths.append(get_output(f"{seq_filename}_dnds_{window_size}.png"))
+        plt.savefig(paths[-1])
+
+    return paths
 
 
 def sliding_window_dnds(
-    sequence_1: str, sequence_2: str, window_size: int
+    sequence_1: str, sequence_2: str, window_size: int, step: int = DNDS_WINDOW_STEP
 ) -> Tuple[List[int], List[float]]:
     """
-    Performs a sliding-window dN/dS analysis over the provided sequences.
-    Returns a list of tuples (start_base_pair, dnds_ratio).
+    Performs a sliding-window dN/dS analysis over the provided sequences,
+    starting a window every `step` base pairs. Returns a tuple
+    (start_base_pairs, dnds_ratios), where windows with undefined ratios are NaN.
     """
-    windows = zip(
-        sliding_window(sequence_1, n=window_size),
-        sliding_window(sequence_2, n=window_size),
-    )
-    return (
-        [i for i in range(len(sequence_1) - window_size + 1)],
-        [dnds(*window_pair) for window_pair in windows],
+    starts, ratios = dnds_engine.sliding_window_dnds(
+        sequence_1, sequence_2, window_size, step
     )
+    return starts.tolist(), ratios.tolist()
 
 
-def analyze(seq1_filename: str, seq2_filename: str, nucleotides: bool = False):
+def bootstrap_dnds_bands(
+    sequence_1: str,
+    sequence_2: str,
+    window_sizes: List[int],
+    step: int = DNDS_WINDOW_STEP,
+    n_replicates: int = DNDS_BOOTSTRAP_REPLICATES,
+    confidence: float = DNDS_BOOTSTRAP_CONFIDENCE,
+) -> List[Tuple[List[float], List[float]]]:
     """
-    Performs an alignment-based analysis on the sequences in the provided FASTA files.
-    `nucleotides` should be `True` if the two filenames refer to nucleotide sequences.
+    Calculates bootstrap confidence bands for the sliding-window dN/dS analyses of the
+    provided sequences with each of `window_sizes`. Returns a tuple (lower_bounds,
+    upper_bounds) per window size, with a bound for each window of `sliding_window_dnds`.
     """
-    # Read first sequence
-    seq_name, seq1 = list(parse_fasta(get_data(seq1_filename)))[0]
+    return [
+        (lower.tolist(), upper.tolist())
+        for lower, upper in dnds_engine.bootstrap_dnds_bands(
+            sequence_1, sequence_2, window_sizes, step, n_replicates, confidence
+        )
+    ]
 
-    # Analyze second sequence
-    print("Analyzing %s..." % seq2_filename)
 
-    seq2 = list(parse_fasta(get_data(seq2_filename)))[0][1]
-    alignment_result = align_sequences(seq2, seq1, nucleotides=nucleotides)
+def read_sequence(filename: str, nucleotides: bool) -> Tuple[str, str]:
+    """Reads the name and sequence of the first record of a FASTA file in the data directory."""
+    scheme = default_scheme(nucleotides)
+    name, codes = read_first_sequence(get_data(filename), scheme)
+    return name, scheme.decode(codes)
 
-    largest_mismatch_pos, largest_mismatch = alignment_result.largest_mismatch()
-    percent_similarity = 1 - (
-        alignment_result.hamming_distance() / alignment_result.get_alignment_length()
-    )
 
-    if nucleotides:
-        trimmed_alignment_1, trimmed_alignment_2 = trim_for_dnds(alignment_result)
-        dnds_ratio_data = [
-            sliding_window_dnds(trimmed_alignment_1, trimmed_alignment_2, window_size=i)
-            for i in DNDS_WINDOW_SIZES
-        ]
-        make_dnds_graph(
-            f"{seq2_filename}_dnds_ratios.png", DNDS_WINDOW_SIZES, dnds_ratio_data
-        )
+def align_records(
+    record_1: Tuple[str, str], record_2: Tuple[str, str], nucleotides: bool
+) -> AlignmentResult:
+    """Aligns the sequence of `record_2` against that of `record_1`."""
+    return align_sequences_cached(record_2[1], record_1[1], nucleotides=nucleotides)
 
-    for clusters in CLUSTER_COUNTS:
-        clustered_mismatches = alignment_result.clustered_mismatches(
-            cluster_count=clusters
-        )
-        clustered_mismatch_variance = alignment_result.clustered_mismatch_variance(
-            cluster_count=clusters
-        )
 
-        # Output Supplementary Data 4
-        make_output_dir()
-        with open(get_output(f"{seq2_filename}_{clusters}.aln.txt"), "w+") as f:
-            f.write(alignment_result.format_result(line_length=100))
+def dnds_windows(
+    trimmed_alignment: Tuple[str, str], window_sizes: List[int], step: int
+) -> List[Tuple[List[int], List[float]]]:
+    """Performs a sliding-window dN/dS analysis of a trimmed alignment for each of `window_sizes`."""
+    return [
+        sliding_window_dnds(*trimmed_alignment, window_size, step)
+        for window_size in window_sizes
+    ]
+
+
+def dnds_bands(
+    trimmed_alignment: Tuple[str, str],
+    window_sizes: List[int],
+    step: int,
+    n_replicates: int,
+    confidence: float,
+) -> List[Tuple[List[float], List[float]]]:
+    """Calculates the bootstrap confidence bands of `dnds_windows`."""
+    return bootstrap_dnds_bands(
+        *trimmed_alignment, window_sizes, step, n_replicates, confidence
+    )
 
-        with open(get_output(f"{seq2_filename}_{clusters}.meta.txt"), "w+") as f:
+
+def cluster_statistics(
+    alignment_result: AlignmentResult, cluster_counts: List[int]
+) -> Dict[str, Any]:
+    """
+    Calculates the similarity and largest mismatch of an alignment, and the mismatches
+    per cluster and their variance for each of `cluster_counts`.
+    """
+    largest_mismatch_pos, largest_mismatch = alignment_result.largest_mismatch()
+    return {
+        "percent_similarity": 1
+        - (
+            alignment_result.hamming_distance()
+            / alignment_result.get_alignment_length()
+        ),
+        "largest_mismatch_pos": largest_mismatch_pos,
+        "largest_mismatch": largest_mismatch,
+        "clustered_mismatch_variances": dict(
+            zip(
+                cluster_counts,
+                alignment_result.clustered_mismatch_variances(cluster_counts),
+            )
+        ),
+        "clustered_mismatches": {
+            clusters: alignment_result.clustered_mismatches(cluster_count=clusters)
+            for clusters in cluster_counts
+        },
+    }
+
+
+def write_alignment(alignment_result: AlignmentResult, seq_filename: str) -> List[str]:
+    """Writes an alignment to the output directory (Supplementary Data 4)."""
+    make_output_dir()
+    path = get_output(f"{seq_filename}.aln.txt")
+    with open(path, "w+") as f:
+        f.write(alignment_result.format_result(line_length=100))
+    return [path]
+
+
+def write_cluster_metadata(
+    record_1: Tuple[str, str], statistics: Dict[str, Any], seq_filename: str
+) -> List[str]:
+    """
+    Writes the statistics of an alignment against `record_1` to the output directory,
+    in a formatted and a JSON file per cluster count.
+    """
+    make_output_dir()
+    paths = []
+    for clusters, clustered_mismatches in statistics["clustered_mismatches"].items():
+        clustered_mismatch_variance = statistics["clustered_mismatch_variances"][
+            clusters
+        ]
+
+        paths.append(get_output(f"{seq_filename}_{clusters}.meta.txt"))
+        with open(paths[-1], "w+") as f:
             f.write(
                 "Formatted metadata -- not for programmatic use.\n\n"
-                + f"Information for alignment with {seq_name}:\n\n"
-                + f"Percent similarity: {percent_similarity}\n"
-                + f"Largest mismatch location: {largest_mismatch_pos}\n"
-                + f"Largest mismatch size: {largest_mismatch}bp\n"
+                + f"Information for alignment with {record_1[0]}:\n\n"
+                + f"Percent similarity: {statistics['percent_similarity']}\n"
+                + f"Largest mismatch location: {statistics['largest_mismatch_pos']}\n"
+                + f"Largest mismatch size: {statistics['largest_mismatch']}bp\n"
                 + f"Variance between clusters ({clusters} clusters): {clustered_mismatch_variance}\n"
                 + f"Clustered mismatches: {clustered_mismatches}\n"
             )
 
-        with open(get_output(f"{seq2_filename}_{clusters}.meta.json"), "w+") as f:
+        paths.append(get_output(f"{seq_filename}_{clusters}.meta.json"))
+        with open(paths[-1], "w+") as f:
             json_output = {
-                "percent_similarity": percent_similarity,
-                "largest_mismatch_pos": largest_mismatch_pos,
-                "largest_mismatch": largest_mismatch,
+                "percent_similarity": statistics["percent_similarity"],
+                "largest_mismatch_pos": statistics["largest_mismatch_pos"],
+                "largest_mismatch": statistics["largest_mismatch"],
                 "clustered_mismatch_variance": clustered_mismatch_variance,
                 "clustered_mismatches": clustered_mismatches,
             }
@@ -160,10 +251,156 @@ def analyze(seq1_filename: str, seq2_filename: str, nucleotides: bool = False):
                 json_output,
                 f,
             )
+    return paths
+
+
+def render_cluster_graphs(statistics: Dict[str, Any], seq_filename: str) -> List[str]:
+    """Produces the mismatch cluster graphs of an alignment."""
+    make_output_dir()
+    return make_cluster_graphs(seq_filename, statistics["clustered_mismatches"])
+
+
+def render_dnds(
+    dnds_ratio_data: List[Tuple[List[int], List[float]]],
+    dnds_band_data: List[Tuple[List[float], List[float]]],
+    seq_filename: str,
+    window_sizes: List[int],
+) -> List[str]:
+    """
+    Produces the dN/dS graphs of an alignment, and writes the ratios and their
+    confidence bands to a JSON file in the output directory.
+    """
+    make_output_dir()
+    paths = make_dnds_graph(seq_filename, window_sizes, dnds_ratio_data, dnds_band_data)
+
+    paths.append(get_output(f"{seq_filename}_dnds.json"))
+    with open(paths[-1], "w+") as f:
+        json.dump(
+            {
+                window_size: {
+                    "bp": bp,
+                    "ratio": ratios,
+                    "lower": lower,
+                    "upper": upper,
+                }
+                for window_size, (bp, ratios), (lower, upper) in zip(
+                    window_sizes, dnds_ratio_data, dnds_band_data
+                )
+            },
+            f,
+        )
+    return paths
+
+
+def analysis_stages(
+    seq1_filename: str, seq2_filename: str, nucleotides: bool = False
+) -> List[Stage]:
+    """
+    Returns the pipeline stages of an alignment-based analysis of the sequences in the
+    provided FASTA files, named after the second file. `nucleotides` should be `True`
+    if the two filenames refer to nucleotide sequences, which adds dN/dS stages.
+    """
+
+    def name(stage: str) -> str:
+        return f"{seq2_filename}:{stage}"
+
+    stages = [
+        Stage(
+            name("parse_1"),
+            read_sequence,
+            config={"filename": seq1_filename, "nucleotides": nucleotides},
+            files=(get_data(seq1_filename),),
+        ),
+        Stage(
+            name("parse_2"),
+            read_sequence,
+            config={"filename": seq2_filename, "nucleotides": nucleotides},
+            files=(get_data(seq2_filename),),
+        ),
+        Stage(
+            name("align"),
+            align_records,
+            inputs=(name("parse_1"), name("parse_2")),
+            config={"nucleotides": nucleotides},
+        ),
+        Stage(
+            name("cluster_stats"),
+            cluster_statistics,
+            inputs=(name("align"),),
+            config={"cluster_counts": CLUSTER_COUNTS},
+        ),
+        Stage(
+            name("render_alignment"),
+            write_alignment,
+            inputs=(name("align"),),
+            config={"seq_filename": seq2_filename},
+            writes_files=True,
+        ),
+        Stage(
+            name("render_metadata"),
+            write_cluster_metadata,
+            inputs=(name("parse_1"), name("cluster_stats")),
+            config={"seq_filename": seq2_filename},
+            writes_files=True,
+        ),
+        Stage(
+            name("render_clusters"),
+            render_cluster_graphs,
+            inputs=(name("cluster_stats"),),
+            config={"seq_filename": seq2_filename},
+            writes_files=True,
+        ),
+    ]
+
+    if nucleotides:
+        dnds_config = {"window_sizes": DNDS_WINDOW_SIZES, "step": DNDS_WINDOW_STEP}
+        stages += [
+            Stage(name("trim"), trim_for_dnds, inputs=(name("align"),)),
+            Stage(
+                name("dnds"), dnds_windows, inputs=(name("trim"),), config=dnds_config
+            ),
+            Stage(
+                name("dnds_bands"),
+                dnds_bands,
+                inputs=(name("trim"),),
+                config={
+                    **dnds_config,
+                    "n_replicates": DNDS_BOOTSTRAP_REPLICATES,
+                    "confidence": DNDS_BOOTSTRAP_CONFIDENCE,
+                },
+            ),
+            Stage(
+                name("render_dnds"),
+                render_dnds,
+                inputs=(name("dnds"), name("dnds_bands")),
+                config={
+                    "seq_filename": seq2_filename,
+                    "window_sizes": DNDS_WINDOW_SIZES,
+                },
+                writes_files=True,
+            ),
+        ]
 
-    make_cluster_graphs(seq2_filename, alignment_result)
+    return stages
+
+
+def analyze(seq1_filename: str, seq2_filename: str, nucleotides: bool = False):
+    """
+    Performs an alignment-based analysis on the sequences in the provided FASTA files.
+    `nucleotides` should be `True` if the two filenames refer to nucleotide sequences.
+    Stages whose inputs haven't changed since the last analysis are loaded from the
+    cache directory.
+    """
+    print("Analyzing %s..." % seq2_filename)
+    run_pipeline(
+        analysis_stages(seq1_filename, seq2_filename, nucleotides), verbose=True
+    )
 
 
 if __name__ == "__main__":
-    analyze(CSTSI, CSGSI, nucleotides=True)
-    analyze(CSTSI_PROTEIN, CSGSI_PROTEIN)
+    # Both analyses run as one pipeline, so that their stages can run concurrently
+    run_pipeline(
+        analysis_stages(CSTSI, CSGSI, nucleotides=True)
+        + analysis_stages(CSTSI_PROTEIN, CSGSI_PROTEIN),
+        verbose=True,
+    )
@@ -10,6 +10,9 @@ ZMGS = "zmgs.fas"
 FNGS = "fngs.fas"
 NTGS = "ntgs.fas"
 
+# Every GS/TS transcript, for all-vs-all comparisons
+GS_TRANSCRIPTS = [CSTSI, CSGSI, VVGS, HSGS, CGGS, PAGS, ZMGS, FNGS, NTGS]
+
 CSTSI_PROTEIN = "cstsi.protein.fas"
 CSGSI_PROTEIN = "csgsi.protein.fas"
 
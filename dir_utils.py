@@ -17,3 +17,13 @@ def make_output_dir():
 def get_output(filename: str) -> str:
     """Gets the relative file path for the provided output file."""
     return "./output/" + filename
+
+
+def make_cache_dir():
+    """Creates the cache directory, if it doesn't exist."""
+    os.makedirs("./cache", exist_ok=True)
+
+
+def get_cache(filename: str) -> str:
+    """Gets the relative file path for the provided cache file."""
+    return "./cache/" + filename
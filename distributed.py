@@ -0,0 +1,374 @@
+"""
+The `distributed` module runs Monte-Carlo simulations across several machines. A coordinator
+serves batches of trials over TCP, and workers on any host connect to it to run them.
+"""
+
+import argparse
+import multiprocessing
+import queue
+import socket
+import threading
+from collections import deque
+from multiprocessing import AuthenticationError
+from multiprocessing.managers import BaseManager, Server
+from time import monotonic
+from typing import Callable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from monte_carlo import (
+    MonteCarloSimulationResult,
+    T,
+    init_worker,
+    make_batches,
+    make_results,
+    run_worker_trials,
+    should_stop,
+)
+from options import (
+    DISTRIBUTED_IDLE_TIMEOUT,
+    DISTRIBUTED_LEASE_TIME,
+    DISTRIBUTED_PORT,
+    SEQUENTIAL_CONFIDENCE,
+    SEQUENTIAL_MIN_TRIALS,
+    WORKER_POLL_INTERVAL,
+)
+from trial_log import TrialLog
+
+
+class WorkQueue:
+    """
+    WorkQueue hands out batches of trials to workers and collects their success counts.
+    It lives in the coordinator, and workers call its methods over the network. A batch
+    is leased to the worker that claims it, and if it isn't completed within the lease
+    time, it is handed to another worker, since the first one may have died.
+    """
+
+    def __init__(self, spec: tuple, batches: List[Tuple[int, int]], lease_time: float):
+        """
+        Produces a new WorkQueue for the provided batches, with `spec` being the arguments
+        to `init_worker` that every worker needs before it can run trials.
+        """
+        self.spec = spec
+        self.lease_time = lease_time
+        self.n_batches = len(batches)
+        self.pending = deque(batches)
+        self.leases = {}
+        self.completed = set()
+        self.stopped = False
+        self.results = queue.Queue()
+        self.condition = threading.Condition()
+        self.last_activity = monotonic()
+
+    def get_spec(self) -> tuple:
+        """Returns the trial specification to be passed to `init_worker`."""
+        with self.condition:
+            self.last_activity = monotonic()
+        return self.spec
+
+    def is_idle(self, timeout: float) -> bool:
+        """
+        Returns whether no worker has connected, claimed a batch or completed one for
+        `timeout` seconds, and no worker holds a lease that hasn't expired.
+        """
+        with self.condition:
+            now = monotonic()
+            leased = any(
+                now - lease[2] <= self.lease_time for lease in self.leases.values()
+            )
+            return not leased and now - self.last_activity > timeout
+
+    def claim(self, worker: str) -> Optional[Tuple[int, int]]:
+        """
+        Claims a batch for `worker`, returning its index and size. If every batch is
+        leased, this waits for one to complete or expire. Returns `None` once there
+        is no more work to do.
+        """
+        with self.condition:
+            self.last_activity = monotonic()
+            while True:
+                if self.stopped or len(self.completed) == self.n_batches:
+                    return None
+                if self.pending:
+                    batch = self.pending.popleft()
+                    break
+                expired = [
+                    lease
+                    for lease in self.leases.values()
+                    if monotonic() - lease[2] > self.lease_time
+                ]
+                if expired:
+                    batch = min(expired, key=lambda lease: lease[2])[0]
+                    break
+                self.condition.wait(timeout=WORKER_POLL_INTERVAL)
+
+            self.leases[batch[0]] = (batch, worker, monotonic())
+            return batch
+
+    def complete(self, worker: str, batch_index: int, n_successes: List[int]):
+        """
+        Records the success counts of a batch run by `worker`. If the batch was
+        handed out more than once, only the first result is counted.
+        """
+        with self.condition:
+            self.last_activity = monotonic()
+            if batch_index in self.completed:
+                return
+            self.completed.add(batch_index)
+            batch = self.leases.pop(batch_index)[0]
+            self.results.put((worker, batch, n_successes))
+            self.condition.notify_all()
+
+    def stop(self):
+        """Stops handing out batches, so that the workers exit."""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+
+class CoordinatorManager(BaseManager):
+    """
+    CoordinatorManager serves a `WorkQueue` to workers. Each coordinator registers
+    its own queue on a subclass, so that coordinators don't share any state.
+    """
+
+
+class WorkerManager(BaseManager):
+    """WorkerManager connects to a coordinator's `WorkQueue`."""
+
+
+WorkerManager.register("get_work_queue")
+
+
+def serve_manager(server: Server, stopping: threading.Event):
+    """
+    Handles each connection to a manager `server` in its own thread, until `stopping`
+    is set and `stop_manager` wakes this up, and then stops listening.
+    """
+    # Connections are served until the server's stop event is set, which is
+    # normally created by `Server.serve_forever`
+    server.stop_event = stopping
+    try:
+        while not stopping.is_set():
+            try:
+                connection = server.listener.accept()
+            except (OSError, EOFError, AuthenticationError):
+                # The client went away before it was accepted
+                continue
+            if stopping.is_set():
+                connection.close()
+                break
+            threading.Thread(
+                target=server.handle_request, args=(connection,), daemon=True
+            ).start()
+    finally:
+        server.listener.close()
+
+
+def stop_manager(server: Server, stopping: threading.Event, thread: threading.Thread):
+    """
+    Stops a manager `server` running `serve_manager` in `thread`, which waits for
+    a connection, by setting `stopping` and connecting to the server.
+    """
+    stopping.set()
+    host, port = server.address
+    try:
+        socket.create_connection(
+            ("localhost" if host in ("", "0.0.0.0") else host, port),
+            timeout=WORKER_POLL_INTERVAL,
+        ).close()
+    except OSError:
+        # The server already stopped listening
+        pass
+    thread.join(timeout=WORKER_POLL_INTERVAL)
+
+
+def monte_carlo_coordinator(
+    simulation_fn: Union[
+        Callable[[], T], Callable[[int, np.random.Generator], List[T]]
+    ],
+    effect_size_fn: Union[Callable[[T], np.float64], List[Callable[[T], np.float64]]],
+    observed_effect_size: Union[np.float64, List[np.float64]],
+    n_trials: int,
+    address: Tuple[str, int],
+    authkey: bytes,
+    batch_size: int = 1,
+    verbose: bool = False,
+    alpha: Optional[float] = None,
+    confidence: float = SEQUENTIAL_CONFIDENCE,
+    min_trials: int = SEQUENTIAL_MIN_TRIALS,
+    log_path: Optional[str] = None,
+    seed: Optional[int] = None,
+    lease_time: float = DISTRIBUTED_LEASE_TIME,
+    idle_timeout: Optional[float] = DISTRIBUTED_IDLE_TIMEOUT,
+    batched: bool = False,
+) -> Union[MonteCarloSimulationResult, List[MonteCarloSimulationResult]]:
+    """
+    Runs a Monte-Carlo simulation like `monte_carlo_parallel`, but serves the batches of
+    trials at `address` for workers started with `run_workers` to run, on this machine
+    or others. Workers must use the same `authkey`, and may join or leave at any time.
+
+    The simulation specification is sent to each worker when it connects, so it must be
+    picklable, and the modules it uses must be importable by the workers. With a `seed`,
+    each batch is seeded by its index, so the result is the same as that of `monte_carlo`
+    or `monte_carlo_parallel` with the same seed, no matter how many workers connect.
+
+    If no worker connects, claims a batch or completes one for `idle_timeout` seconds
+    while no batch is leased, a `RuntimeError` is raised, rather than waiting forever.
+    The server is shut down when the simulation finishes, or fails.
+    """
+    multiple = isinstance(effect_size_fn, (list, tuple))
+    effect_size_fns = list(effect_size_fn) if multiple else [effect_size_fn]
+    observed_effect_sizes = (
+        list(observed_effect_size) if multiple else [observed_effect_size]
+    )
+
+    trial_log = TrialLog(log_path) if log_path is not None else None
+    if trial_log is not None:
+        n_completed, n_successes, logged_batches = trial_log.resume(
+            len(effect_size_fns)
+        )
+    else:
+        n_completed, n_successes = 0, np.zeros(len(effect_size_fns), dtype=np.int64)
+        logged_batches = set()
+
+    batches = make_batches(n_trials, batch_size, logged_batches)
+    if should_stop(n_successes, n_completed, alpha, confidence, min_trials):
+        batches = []
+    spec = (
+        simulation_fn,
+        effect_size_fns,
+        observed_effect_sizes,
+        batch_size,
+        seed,
+        batched,
+    )
+    work_queue = WorkQueue(spec, batches, lease_time)
+
+    class Manager(CoordinatorManager):
+        """Manager serves this coordinator's `WorkQueue`."""
+
+    Manager.register("get_work_queue", callable=lambda: work_queue)
+    server = Manager(address=address, authkey=authkey).get_server()
+    stopping = threading.Event()
+    server_thread = threading.Thread(
+        target=serve_manager, args=(server, stopping), daemon=True
+    )
+    server_thread.start()
+
+    try:
+        if verbose:
+            print(
+                "Serving Monte-Carlo simulation with %d trials at %s:%d."
+                % (n_trials, *server.address)
+            )
+
+        n_received = 0
+        while n_received < len(batches):
+            try:
+                worker, (batch_index, batch_trials), batch_successes = (
+                    work_queue.results.get(timeout=WORKER_POLL_INTERVAL)
+                )
+            except queue.Empty:
+                if idle_timeout is not None and work_queue.is_idle(idle_timeout):
+                    raise RuntimeError(
+                        f"no workers have been active for {idle_timeout} seconds"
+                    )
+                continue
+
+            n_received += 1
+            n_successes += batch_successes
+            n_completed += batch_trials
+            if trial_log is not None:
+                trial_log.append(batch_index, batch_trials, batch_successes)
+            if verbose:
+                print(
+                    "Completed %d/%d simulations (last batch from %s)."
+                    % (n_completed, n_trials, worker)
+                )
+
+            if should_stop(n_successes, n_completed, alpha, confidence, min_trials):
+                if verbose:
+                    print("Stopping early after %d simulations." % n_completed)
+                break
+    finally:
+        work_queue.stop()
+        stop_manager(server, stopping, server_thread)
+        if trial_log is not None:
+            trial_log.close()
+
+    return make_results(n_successes, n_completed, multiple, alpha, confidence)
+
+
+def work(address: Tuple[str, int], authkey: bytes, worker: str):
+    """
+    Connects to the coordinator at `address` and runs batches of trials until there
+    are none left, or the coordinator goes away.
+    """
+    manager = WorkerManager(address=address, authkey=authkey)
+    manager.connect()
+    work_queue = manager.get_work_queue()
+    spec = work_queue.get_spec()
+    if spec is None:
+        # The coordinator stopped serving while this worker connected
+        return
+    init_worker(*spec)
+
+    try:
+        while True:
+            batch = work_queue.claim(worker)
+            if batch is None:
+                return
+            work_queue.complete(worker, batch[0], run_worker_trials(batch))
+    except (EOFError, ConnectionError):
+        # The coordinator finished or stopped early
+        return
+
+
+def run_workers(address: Tuple[str, int], authkey: bytes, processes: int, name: str):
+    """
+    Runs `processes` worker processes for the coordinator at `address`, waiting for them
+    to finish. The workers are spawned rather than forked, since a worker forked from the
+    coordinator's process would inherit its listening socket, which keeps the listener
+    open once the coordinator closes it, and hangs the worker when it disconnects.
+    """
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=work, args=(address, authkey, f"{name}/{i}"))
+        for i in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """Parses a `host:port` address, using `DISTRIBUTED_PORT` if no port is provided."""
+    host, _, port = address.rpartition(":") if ":" in address else (address, "", "")
+    return host, int(port) if port else DISTRIBUTED_PORT
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description="Run Monte-Carlo simulation workers for a coordinator."
+    )
+    parser.add_argument("--address", "-a", dest="address", required=True)
+    parser.add_argument("--authkey", "-k", dest="authkey", required=True)
+    parser.add_argument(
+        "--processes",
+        "-p",
+        dest="processes",
+        type=int,
+        default=multiprocessing.cpu_count(),
+    )
+    parser.add_argument("--name", "-n", dest="name", default=None)
+    args = parser.parse_args()
+
+    run_workers(
+        parse_address(args.address),
+        args.authkey.encode(),
+        args.processes,
+        args.name or socket.gethostname(),
+    )
@@ -0,0 +1,310 @@
+"""
+The `dnds_engine` module calculates dN/dS (Ka/Ks) ratios over many windows of a pair of aligned
+coding sequences at once, following Nei & Gojobori (1986) with the Jukes-Cantor correction.
+"""
+
+import multiprocessing
+import warnings
+from itertools import product
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from options import (
+    DNDS_BOOTSTRAP_BATCH_SIZE,
+    DNDS_BOOTSTRAP_CONFIDENCE,
+    DNDS_BOOTSTRAP_REPLICATES,
+)
+
+# The standard genetic code, for codons ordered by their bases in this order
+CODON_BASES = "TCAG"
+GENETIC_CODE = "FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG"
+
+# Codons containing anything but the four bases get this index
+INVALID_CODON = 64
+
+
+def build_codon_tables() -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Builds tables of the number of synonymous sites in each codon, and of the
+    number of synonymous and total differences between each pair of codons.
+    A difference is synonymous if it doesn't change the amino acid; codons
+    which differ at several positions average over the single-base changes
+    from either codon, as in the `dnds` package.
+    """
+    codons = ["".join(bases) for bases in product(CODON_BASES, repeat=3)]
+    amino_acids = dict(zip(codons, GENETIC_CODE))
+
+    synonymous_sites = np.zeros(len(codons))
+    for i, codon in enumerate(codons):
+        for position, base in enumerate(codon):
+            for new_base in CODON_BASES.replace(base, ""):
+                mutant = codon[:position] + new_base + codon[position + 1 :]
+                if amino_acids[mutant] == amino_acids[codon]:
+                    synonymous_sites[i] += 1 / 3
+
+    synonymous_differences = np.zeros((len(codons), len(codons)))
+    differences = np.zeros((len(codons), len(codons)), dtype=np.int64)
+    for (i, codon_1), (j, codon_2) in product(enumerate(codons), repeat=2):
+        changed = [p for p in range(3) if codon_1[p] != codon_2[p]]
+        differences[i, j] = len(changed)
+        if len(changed) == 1:
+            synonymous_differences[i, j] = amino_acids[codon_1] == amino_acids[codon_2]
+        elif len(changed) > 1:
+            for position in changed:
+                mutant = (
+                    codon_1[:position] + codon_2[position] + codon_1[position + 1 :]
+                )
+                synonymous_differences[i, j] += (
+                    amino_acids[mutant] == amino_acids[codon_1]
+                ) + (amino_acids[mutant] == amino_acids[codon_2])
+            synonymous_differences[i, j] /= len(changed)
+
+    return synonymous_sites, synonymous_differences, differences
+
+
+SYNONYMOUS_SITES, SYNONYMOUS_DIFFERENCES, CODON_DIFFERENCES = build_codon_tables()
+
+BASE_LOOKUP = np.full(256, 4, dtype=np.int64)
+for base_index, base in enumerate(CODON_BASES):
+    BASE_LOOKUP[ord(base)] = base_index
+    BASE_LOOKUP[ord(base.lower())] = base_index
+
+
+def encode_codons(seq: str, frame: int = 0) -> np.ndarray:
+    """
+    Returns the index of each complete codon of `seq` in the given reading
+    frame, or `INVALID_CODON` for codons with anything but the four bases.
+    """
+    n_codons = (len(seq) - frame) // 3
+    bases = BASE_LOOKUP[
+        np.frombuffer(seq.encode("ascii"), dtype=np.uint8)[frame : frame + 3 * n_codons]
+    ].reshape(-1, 3)
+    codons = bases[:, 0] * 16 + bases[:, 1] * 4 + bases[:, 2]
+    return np.where((bases == 4).any(axis=1), INVALID_CODON, codons)
+
+
+class CodonCounts:
+    """
+    CodonCounts holds the synonymous sites and the synonymous and total
+    differences of each codon pair of two aligned sequences in one reading
+    frame, as prefix sums, so that they can be totalled over any run of
+    codons in constant time.
+    """
+
+    def __init__(self, seq_1: str, seq_2: str, frame: int = 0):
+        """Counts the codon pairs of the provided sequences in the provided reading frame."""
+        codons_1 = encode_codons(seq_1, frame)
+        codons_2 = encode_codons(seq_2, frame)
+        invalid = (codons_1 == INVALID_CODON) | (codons_2 == INVALID_CODON)
+        codons_1 = np.where(invalid, 0, codons_1)
+        codons_2 = np.where(invalid, 0, codons_2)
+
+        # One row per count: synonymous sites, synonymous differences,
+        # differences and invalid codons
+        self.counts = np.where(
+            invalid,
+            [[0], [0], [0], [1]],
+            [
+                (SYNONYMOUS_SITES[codons_1] + SYNONYMOUS_SITES[codons_2]) / 2,
+                SYNONYMOUS_DIFFERENCES[codons_1, codons_2],
+                CODON_DIFFERENCES[codons_1, codons_2],
+                np.zeros(len(invalid)),
+            ],
+        )
+        self.prefix_sums = np.concatenate(
+            (np.zeros((4, 1)), np.cumsum(self.counts, axis=1)), axis=1
+        )
+
+    def totals(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """
+        Returns the total synonymous sites, synonymous differences, differences
+        and invalid codons of the codon pairs from each of `starts` up to each
+        of `ends`, one per row.
+        """
+        return self.prefix_sums[:, ends] - self.prefix_sums[:, starts]
+
+    def resampled_totals(
+        self,
+        starts: np.ndarray,
+        n_codons: int,
+        n_replicates: int,
+        rng: np.random.Generator,
+    ) -> np.ndarray:
+        """
+        Returns the totals of `n_replicates` bootstrap resamples of the runs of
+        `n_codons` codon pairs from each of `starts`, with an axis of replicates
+        after the axis of counts. Each resample draws `n_codons` codon pairs from
+        its run with replacement.
+        """
+        offsets = rng.integers(0, n_codons, size=(n_replicates, len(starts), n_codons))
+        indices = starts[:, np.newaxis] + offsets
+        return np.array([row[indices].sum(axis=-1) for row in self.counts])
+
+
+def jukes_cantor(p: np.ndarray) -> np.ndarray:
+    """
+    Applies the Jukes-Cantor correction to proportions of differing sites.
+    Proportions of 3/4 or more can't be corrected, and become NaN.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return -(3 / 4) * np.log(1 - (4 * p / 3))
+
+
+def dnds_ratios(totals: np.ndarray, window_size: int) -> np.ndarray:
+    """
+    Calculates dN/dS ratios from the totals of windows of `window_size` bases,
+    as returned by `CodonCounts.totals`. Ratios which are undefined are NaN.
+    """
+    synonymous_sites, synonymous_differences, differences, invalid = totals
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pn = (differences - synonymous_differences) / (window_size - synonymous_sites)
+        ps = synonymous_differences / synonymous_sites
+        ratios = jukes_cantor(pn) / jukes_cantor(ps)
+    return np.where((invalid == 0) & (synonymous_differences > 0), ratios, np.nan)
+
+
+def sliding_window_dnds(
+    seq_1: str, seq_2: str, window_size: int, step: int = 3
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculates dN/dS ratios over windows of `window_size` bases of the provided
+    aligned coding sequences, every `step` bases. Returns an array of the
+    starting base of each window and an array of its dN/dS ratio. Each window
+    is read in the frame it starts in, and its ratio matches that of the `dnds`
+    package for the window. Windows for which the ratio is undefined, such as
+    those without synonymous differences or with invalid codons, are NaN.
+    """
+    check_sequences(seq_1, seq_2, window_size)
+
+    starts = np.arange(0, len(seq_1) - window_size + 1, step)
+    ratios = np.full(len(starts), np.nan)
+    for frame in range(3):
+        in_frame = starts % 3 == frame
+        if not in_frame.any():
+            continue
+
+        first_codons = starts[in_frame] // 3
+        totals = CodonCounts(seq_1, seq_2, frame).totals(
+            first_codons, first_codons + window_size // 3
+        )
+        ratios[in_frame] = dnds_ratios(totals, window_size)
+    return starts, ratios
+
+
+def check_sequences(seq_1: str, seq_2: str, window_size: int):
+    """Raises a `ValueError` if the provided sequences can't be compared in windows of `window_size`."""
+    if len(seq_1) != len(seq_2):
+        raise ValueError("sequences have differing lengths")
+    if window_size % 3 != 0:
+        raise ValueError("window size must be a multiple of 3")
+
+
+def bootstrap_dnds(
+    seq_1: str,
+    seq_2: str,
+    window_size: int,
+    step: int,
+    n_replicates: int,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    """
+    Calculates the dN/dS ratios of `n_replicates` bootstrap replicates of each of
+    the windows of `sliding_window_dnds`, with one row per replicate and one column
+    per window. Each replicate of a window resamples its codons with replacement.
+    """
+    check_sequences(seq_1, seq_2, window_size)
+
+    starts = np.arange(0, len(seq_1) - window_size + 1, step)
+    ratios = np.full((n_replicates, len(starts)), np.nan)
+    for frame in range(3):
+        in_frame = starts % 3 == frame
+        if not in_frame.any():
+            continue
+
+        totals = CodonCounts(seq_1, seq_2, frame).resampled_totals(
+            starts[in_frame] // 3, window_size // 3, n_replicates, rng
+        )
+        ratios[:, in_frame] = dnds_ratios(totals, window_size)
+    return ratios
+
+
+def run_bootstrap_batch(
+    seq_1: str,
+    seq_2: str,
+    window_size: int,
+    step: int,
+    n_replicates: int,
+    entropy: int,
+    batch_index: int,
+) -> np.ndarray:
+    """
+    Runs a batch of `bootstrap_dnds` replicates in a worker process. Each batch
+    draws from its own generator, seeded by its window size and index, so the
+    replicates don't depend on how the batches are spread over processes.
+    """
+    seed_sequence = np.random.SeedSequence(
+        entropy, spawn_key=(window_size, batch_index)
+    )
+    return bootstrap_dnds(
+        seq_1,
+        seq_2,
+        window_size,
+        step,
+        n_replicates,
+        np.random.default_rng(seed_sequence),
+    )
+
+
+def bootstrap_dnds_bands(
+    seq_1: str,
+    seq_2: str,
+    window_sizes: List[int],
+    step: int = 3,
+    n_replicates: int = DNDS_BOOTSTRAP_REPLICATES,
+    confidence: float = DNDS_BOOTSTRAP_CONFIDENCE,
+    workers: Optional[int] = None,
+    seed: Optional[int] = None,
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Calculates bootstrap confidence intervals for the dN/dS ratios of every window
+    of `sliding_window_dnds`, for each of `window_sizes`. Returns a tuple of arrays
+    (lower, upper) per window size, holding the percentile interval of each window
+    at the provided confidence. Replicates with undefined ratios are left out of the
+    intervals, and windows whose own ratio is undefined have NaN bounds.
+
+    The replicates are run in batches on a pool of `workers` processes, which
+    defaults to the number of CPUs. With a `seed`, the intervals are reproducible.
+    """
+    for window_size in window_sizes:
+        check_sequences(seq_1, seq_2, window_size)
+    entropy = np.random.SeedSequence(seed).entropy
+    batch_sizes = [DNDS_BOOTSTRAP_BATCH_SIZE] * (
+        n_replicates // DNDS_BOOTSTRAP_BATCH_SIZE
+    )
+    if n_replicates % DNDS_BOOTSTRAP_BATCH_SIZE:
+        batch_sizes.append(n_replicates % DNDS_BOOTSTRAP_BATCH_SIZE)
+
+    tasks = [
+        (seq_1, seq_2, window_size, step, batch_size, entropy, batch_index)
+        for window_size in window_sizes
+        for batch_index, batch_size in enumerate(batch_sizes)
+    ]
+    with multiprocessing.Pool(workers) as pool:
+        batches = pool.starmap(run_bootstrap_batch, tasks)
+
+    bands = []
+    for i, window_size in enumerate(window_sizes):
+        replicates = np.concatenate(
+            batches[i * len(batch_sizes) : (i + 1) * len(batch_sizes)]
+        )
+        defined = ~np.isnan(sliding_window_dnds(seq_1, seq_2, window_size, step)[1])
+        tail = 100 * (1 - confidence) / 2
+        with warnings.catch_warnings():
+            # Windows without any defined replicates have NaN bounds
+            warnings.simplefilter("ignore", RuntimeWarning)
+            lower, upper = np.nanpercentile(replicates, [tail, 100 - tail], axis=0)
+        bands.append(
+            (np.where(defined, lower, np.nan), np.where(defined, upper, np.nan))
+        )
+    return bands
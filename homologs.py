@@ -0,0 +1,210 @@
+"""
+The `homologs` module aligns every pair of a set of homologous genes, and summarizes the
+alignments as matrices of identity, Hamming distance and clustered mismatch variance.
+"""
+
+import argparse
+import multiprocessing
+from itertools import combinations
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from alignment_cache import align_sequences_cached
+from data_index import GS_TRANSCRIPTS
+from dir_utils import get_data, get_output, make_output_dir
+from kmers import KmerIndex, align_seeded
+from options import CLUSTER_COUNTS
+from scoring import default_scheme
+from sequence_cache import read_first_sequence
+
+
+class HomologMatrices(NamedTuple):
+    """
+    HomologMatrices holds the results of aligning every pair of a set of sequences.
+    `identity` and `hamming` are symmetric matrices with a row and column per name,
+    and `variances` holds a matrix of clustered mismatch variances per cluster count.
+    Pairs that were skipped for being too dissimilar have a NaN identity and variance,
+    and a Hamming distance of -1.
+    """
+
+    names: List[str]
+    cluster_counts: List[int]
+    identity: np.ndarray
+    hamming: np.ndarray
+    variances: np.ndarray
+
+
+worker_state = {}
+
+
+def init_worker(
+    sequences: List[str], nucleotides: bool, cluster_counts: List[int], seeded: bool
+):
+    """Initializes a worker process with the sequences to align."""
+    worker_state["sequences"] = sequences
+    worker_state["nucleotides"] = nucleotides
+    worker_state["cluster_counts"] = cluster_counts
+    worker_state["seeded"] = seeded
+
+
+def align_pair(pair: Tuple[int, int]) -> Tuple[int, int, float, int, List[float]]:
+    """
+    Aligns a pair of sequences in a worker process, given their indices. Returns the
+    indices, followed by the identity and Hamming distance of the alignment and its
+    clustered mismatch variance for each cluster count.
+    """
+    i, j = pair
+    align = align_seeded if worker_state["seeded"] else align_sequences_cached
+    alignment_result = align(
+        worker_state["sequences"][i],
+        worker_state["sequences"][j],
+        nucleotides=worker_state["nucleotides"],
+    )
+    return (
+        i,
+        j,
+        alignment_result.matches() / alignment_result.get_alignment_length(),
+        alignment_result.hamming_distance(),
+        alignment_result.clustered_mismatch_variances(worker_state["cluster_counts"]),
+    )
+
+
+def align_all_pairs(
+    names: List[str],
+    sequences: List[str],
+    nucleotides: bool = True,
+    cluster_counts: List[int] = CLUSTER_COUNTS,
+    workers: Optional[int] = None,
+    verbose: bool = False,
+    min_similarity: Optional[float] = None,
+) -> HomologMatrices:
+    """
+    Aligns every unordered pair of the provided sequences once, on a pool of `workers`
+    processes, which defaults to the number of CPUs. Alignments take time in proportion
+    to the product of the sequences' lengths, so the longest pairs are handed out first,
+    leaving the shortest ones to fill in at the end.
+
+    With a `min_similarity`, pairs whose k-mer similarity is lower are skipped, and the
+    others are aligned with `align_seeded`, only around the diagonals they share k-mers on.
+    """
+    if min_similarity is None:
+        candidates = combinations(range(len(sequences)), 2)
+    else:
+        candidates = [
+            (i, j)
+            for i, j, _ in KmerIndex(sequences, nucleotides).similar_pairs(
+                min_similarity
+            )
+        ]
+    pairs = sorted(
+        candidates,
+        key=lambda pair: len(sequences[pair[0]]) * len(sequences[pair[1]]),
+        reverse=True,
+    )
+
+    identity = np.full((len(sequences), len(sequences)), np.nan)
+    hamming = np.full((len(sequences), len(sequences)), -1, dtype=np.int64)
+    variances = np.full((len(cluster_counts), len(sequences), len(sequences)), np.nan)
+    np.fill_diagonal(identity, 1)
+    np.fill_diagonal(hamming, 0)
+    for variance in variances:
+        np.fill_diagonal(variance, 0)
+
+    with multiprocessing.Pool(
+        workers,
+        initializer=init_worker,
+        initargs=(sequences, nucleotides, cluster_counts, min_similarity is not None),
+    ) as pool:
+        for n_completed, result in enumerate(pool.imap_unordered(align_pair, pairs), 1):
+            i, j, pair_identity, pair_hamming, pair_variances = result
+            identity[i, j] = identity[j, i] = pair_identity
+            hamming[i, j] = hamming[j, i] = pair_hamming
+            variances[:, i, j] = variances[:, j, i] = pair_variances
+            if verbose:
+                print(
+                    "Aligned %s and %s (%d/%d)."
+                    % (names[i], names[j], n_completed, len(pairs))
+                )
+
+    return HomologMatrices(names, list(cluster_counts), identity, hamming, variances)
+
+
+def save_homolog_matrices(matrices: HomologMatrices, filename: str):
+    """Saves homolog matrices to a compressed `.npz` file."""
+    np.savez_compressed(
+        filename,
+        names=np.array(matrices.names),
+        cluster_counts=np.array(matrices.cluster_counts),
+        identity=matrices.identity,
+        hamming=matrices.hamming,
+        variances=matrices.variances,
+    )
+
+
+def load_homolog_matrices(filename: str) -> HomologMatrices:
+    """Loads homolog matrices saved by `save_homolog_matrices`."""
+    with np.load(filename) as data:
+        return HomologMatrices(
+            data["names"].tolist(),
+            data["cluster_counts"].tolist(),
+            data["identity"],
+            data["hamming"],
+            data["variances"],
+        )
+
+
+def analyze_homologs(
+    filenames: List[str] = GS_TRANSCRIPTS,
+    nucleotides: bool = True,
+    workers: Optional[int] = None,
+    min_similarity: Optional[float] = None,
+) -> HomologMatrices:
+    """
+    Aligns the first sequence of every pair of the provided FASTA files in the data
+    directory, and saves the resulting matrices to the output directory. Pairs with
+    a k-mer similarity below `min_similarity` are skipped.
+    """
+    scheme = default_scheme(nucleotides)
+    # The sequences are decoded once here, since the alignments are built from text
+    sequences = [
+        scheme.decode(read_first_sequence(get_data(filename), scheme)[1])
+        for filename in filenames
+    ]
+    matrices = align_all_pairs(
+        filenames,
+        sequences,
+        nucleotides,
+        workers=workers,
+        verbose=True,
+        min_similarity=min_similarity,
+    )
+
+    make_output_dir()
+    save_homolog_matrices(matrices, get_output("homologs.npz"))
+    return matrices
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description="Align every pair of GS/TS transcripts."
+    )
+    parser.add_argument(
+        "--processes",
+        "-p",
+        dest="processes",
+        type=int,
+        default=multiprocessing.cpu_count(),
+    )
+    parser.add_argument(
+        "--min-similarity",
+        "-m",
+        dest="min_similarity",
+        type=float,
+        default=None,
+        help="Skip pairs sharing less than this fraction of their k-mers.",
+    )
+    args = parser.parse_args()
+
+    analyze_homologs(workers=args.processes, min_similarity=args.min_similarity)
@@ -0,0 +1,196 @@
+"""
+The `kmers` module compares sequences by the k-mers they share, which is far cheaper than aligning
+them. It is used to skip unrelated pairs of sequences in collection-scale comparisons, and to find
+the diagonals around which a related pair needs to be aligned.
+"""
+
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from alignment import AlignmentResult, align_banded
+from scoring import SubstitutionScheme, default_scheme
+
+# Default k-mer lengths for nucleotide and protein sequences
+NUCLEOTIDE_KMER_SIZE = 8
+PROTEIN_KMER_SIZE = 3
+
+# K-mers occurring more often than this in a sequence are ignored when finding
+# anchors, since repeats produce hits on many unrelated diagonals
+MAX_KMER_OCCURRENCES = 8
+
+# A diagonal needs this many k-mer hits to be an anchor, which rules out
+# nearly all chance hits, and seeded alignments cover this many diagonals
+# on either side of their anchors
+ANCHOR_MIN_HITS = 3
+ANCHOR_PADDING = 32
+
+
+def default_kmer_size(nucleotides: bool) -> int:
+    """Returns the default k-mer length for nucleotide or protein sequences."""
+    return NUCLEOTIDE_KMER_SIZE if nucleotides else PROTEIN_KMER_SIZE
+
+
+def kmer_codes(codes: np.ndarray, k: int, base: int) -> np.ndarray:
+    """
+    Returns a code for the k-mer starting at each position of a sequence encoded
+    with an alphabet of `base` elements, computed for every position at once.
+    """
+    n_kmers = len(codes) - k + 1
+    if n_kmers <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if base**k > np.iinfo(np.int64).max:
+        raise ValueError("k-mers are too long to be encoded")
+
+    kmers = np.zeros(n_kmers, dtype=np.int64)
+    for offset in range(k):
+        kmers = kmers * base + codes[offset : offset + n_kmers]
+    return kmers
+
+
+def expand_ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Returns the concatenation of `range(start, start + length)` for each pair."""
+    ends = np.cumsum(lengths)
+    return np.repeat(starts - (ends - lengths), lengths) + np.arange(
+        ends[-1] if len(ends) else 0
+    )
+
+
+class KmerProfile:
+    """
+    KmerProfile holds the k-mers of a sequence, in order, and how many times each
+    distinct k-mer occurs.
+    """
+
+    def __init__(self, seq: str, scheme: SubstitutionScheme, k: int):
+        """Produces the KmerProfile of `seq`, encoded with `scheme`."""
+        self.k = k
+        self.kmers = kmer_codes(scheme.encode(seq), k, len(scheme.alphabet))
+        self.unique, self.counts = np.unique(self.kmers, return_counts=True)
+
+    def similarity(self, other: "KmerProfile") -> float:
+        """
+        Estimates the similarity of two sequences as the fraction of the k-mers of
+        the shorter one that also occur in the other, counting repeats.
+        """
+        _, i, j = np.intersect1d(
+            self.unique, other.unique, assume_unique=True, return_indices=True
+        )
+        shared = np.minimum(self.counts[i], other.counts[j]).sum()
+        return shared / max(1, min(len(self.kmers), len(other.kmers)))
+
+    def anchor_diagonals(
+        self, other: "KmerProfile", min_hits: int = ANCHOR_MIN_HITS
+    ) -> np.ndarray:
+        """
+        Returns the diagonals `y - x` of the search matrix for aligning this profile's
+        sequence along the top and `other`'s along the left which have at least
+        `min_hits` shared k-mers on them, in increasing order.
+        """
+        order = np.argsort(other.kmers, kind="stable")
+        sorted_kmers = other.kmers[order]
+        starts = np.searchsorted(sorted_kmers, self.kmers, side="left")
+        lengths = np.searchsorted(sorted_kmers, self.kmers, side="right") - starts
+        repeated = self.unique[self.counts > MAX_KMER_OCCURRENCES]
+        lengths[(lengths > MAX_KMER_OCCURRENCES) | np.isin(self.kmers, repeated)] = 0
+
+        top_positions = np.repeat(np.arange(len(self.kmers)), lengths)
+        left_positions = order[expand_ranges(starts, lengths)]
+        diagonals, hits = np.unique(top_positions - left_positions, return_counts=True)
+        return diagonals[hits >= min_hits]
+
+
+class KmerIndex:
+    """
+    KmerIndex is an inverted index from k-mers to the sequences they occur in,
+    which finds the sequences of a collection that are similar to a query
+    without comparing it to each one in turn.
+    """
+
+    def __init__(
+        self,
+        sequences: List[str],
+        nucleotides: bool = True,
+        k: Optional[int] = None,
+        scheme: Optional[SubstitutionScheme] = None,
+    ):
+        """
+        Produces a new KmerIndex of the provided sequences, using k-mers of length
+        `k`, which defaults to `default_kmer_size`.
+        """
+        self.scheme = scheme or default_scheme(nucleotides)
+        self.k = k or default_kmer_size(nucleotides)
+        self.profiles = [KmerProfile(seq, self.scheme, self.k) for seq in sequences]
+        self.lengths = np.array([len(profile.kmers) for profile in self.profiles])
+
+        kmers = np.concatenate(
+            [profile.unique for profile in self.profiles] + [np.zeros(0, np.int64)]
+        )
+        order = np.argsort(kmers, kind="stable")
+        self.kmers = kmers[order]
+        self.counts = np.concatenate(
+            [profile.counts for profile in self.profiles] + [np.zeros(0, np.int64)]
+        )[order]
+        self.records = np.repeat(
+            np.arange(len(self.profiles)),
+            [len(profile.unique) for profile in self.profiles],
+        )[order]
+
+    def similarities(self, profile: KmerProfile) -> np.ndarray:
+        """
+        Returns the `KmerProfile.similarity` of `profile` to each indexed sequence,
+        looking up each of its distinct k-mers once.
+        """
+        starts = np.searchsorted(self.kmers, profile.unique, side="left")
+        lengths = np.searchsorted(self.kmers, profile.unique, side="right") - starts
+        postings = expand_ranges(starts, lengths)
+        shared = np.bincount(
+            self.records[postings],
+            weights=np.minimum(
+                self.counts[postings], np.repeat(profile.counts, lengths)
+            ),
+            minlength=len(self.profiles),
+        )
+        return shared / np.maximum(1, np.minimum(self.lengths, len(profile.kmers)))
+
+    def similar_pairs(self, min_similarity: float) -> List[Tuple[int, int, float]]:
+        """
+        Returns the index pairs `(i, j)`, with `i < j`, of the indexed sequences whose
+        similarity is at least `min_similarity`, along with the similarity.
+        """
+        pairs = []
+        for i, profile in enumerate(self.profiles):
+            similarities = self.similarities(profile)
+            for j in np.flatnonzero(similarities[i + 1 :] >= min_similarity) + i + 1:
+                pairs.append((i, int(j), float(similarities[j])))
+        return pairs
+
+
+def align_seeded(
+    top_seq: str,
+    left_seq: str,
+    nucleotides: bool = True,
+    k: Optional[int] = None,
+    scheme: Optional[SubstitutionScheme] = None,
+    padding: int = ANCHOR_PADDING,
+) -> AlignmentResult:
+    """
+    Aligns the two provided sequences like `align_sequences`, but only computes the
+    band of the search matrix spanning the diagonals they share k-mers on, along with
+    its corners, and `padding` diagonals either side. As with `align_banded`, the full
+    matrix is filled instead unless the traceback through the band is confirmed to match
+    it, so the result is the same as that of `align_sequences`. Pairs that are too
+    divergent for the band to be confirmed take longer than `align_sequences` would.
+    """
+    scheme = scheme or default_scheme(nucleotides)
+    k = k or default_kmer_size(nucleotides)
+    anchors = KmerProfile(top_seq, scheme, k).anchor_diagonals(
+        KmerProfile(left_seq, scheme, k)
+    )
+    diagonals = np.concatenate(([0, len(top_seq) - len(left_seq)], anchors))
+    return align_banded(
+        top_seq,
+        left_seq,
+        scheme=scheme,
+        diagonals=(int(diagonals.min()) - padding, int(diagonals.max()) + padding),
+    )
@@ -0,0 +1,226 @@
+"""
+The `local_alignment` module provides an implementation of the Smith-Waterman local alignment
+algorithm, vectorized with Farrar's striped layout, using the same scoring schemes as `alignment`.
+"""
+
+from math import ceil
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+from alignment import NEG_INF, AlignmentResult
+from scoring import SubstitutionScheme, default_scheme
+
+# Number of consecutive query elements in each lane of a striped query. Each
+# column of the search matrix takes one vector operation per stripe, plus the
+# passes needed to carry vertical gaps from one lane into the next.
+STRIPE_SEGMENT_LENGTH = 8
+
+
+class LocalAlignmentResult(AlignmentResult):
+    """
+    LocalAlignmentResult represents the result of a local alignment, which only covers
+    part of each sequence. Along with the aligned parts, it holds the score of the
+    alignment and where it starts and ends in each sequence.
+    """
+
+    __slots__ = ("score", "top_range", "left_range")
+
+    def __init__(
+        self,
+        alignment_1: str,
+        alignment_2: str,
+        score: int,
+        top_range: Tuple[int, int],
+        left_range: Tuple[int, int],
+    ):
+        """
+        Produces a new LocalAlignmentResult. `top_range` and `left_range` are the
+        start and end positions of the aligned parts of the top and left sequences,
+        with the end positions being exclusive.
+        """
+        super().__init__(alignment_1, alignment_2)
+        self.score = score
+        self.top_range = top_range
+        self.left_range = left_range
+
+    def get_score(self) -> int:
+        """Returns the score of the alignment."""
+        return self.score
+
+    def get_top_range(self) -> Tuple[int, int]:
+        """Returns the start and exclusive end of the aligned part of the top sequence."""
+        return self.top_range
+
+    def get_left_range(self) -> Tuple[int, int]:
+        """Returns the start and exclusive end of the aligned part of the left sequence."""
+        return self.left_range
+
+
+class StripedQuery:
+    """
+    StripedQuery holds the left sequence of an alignment in Farrar's striped layout.
+    The sequence is split into consecutive segments, one per vector lane, and stripe
+    `j` holds element `j` of every segment, so that the cells of a column of the search
+    matrix which don't depend on each other are scored together. For every element of
+    the alphabet, it holds the striped scores and gap penalties of the cells in a column
+    whose top element is that element.
+    """
+
+    def __init__(
+        self,
+        left_seq: str,
+        scheme: SubstitutionScheme,
+        segment_length: int = STRIPE_SEGMENT_LENGTH,
+    ):
+        """Stripes `left_seq`, encoded with `scheme`, into segments of `segment_length`."""
+        self.scheme = scheme
+        self.left = scheme.encode(left_seq)
+        self.segment_length = max(1, min(segment_length, len(self.left)))
+        self.n_segments = max(1, ceil(len(self.left) / self.segment_length))
+
+        padded_length = self.n_segments * self.segment_length
+        codes = np.zeros(padded_length, dtype=np.int64)
+        codes[: len(self.left)] = self.left
+        self.valid = self.stripe(np.arange(padded_length) < len(self.left))
+
+        size = len(scheme.alphabet)
+        striped_codes = self.stripe(codes)
+        self.scores = np.where(self.valid, scheme.scores[:, striped_codes], NEG_INF)
+        self.gap_costs = scheme.gap_penalties[:size, striped_codes]
+
+    def stripe(self, values: np.ndarray) -> np.ndarray:
+        """
+        Arranges values for each element of the padded sequence into stripes, with
+        one row per stripe and one column per segment.
+        """
+        return values.reshape(self.n_segments, self.segment_length).T
+
+    def unstripe(self, striped: np.ndarray) -> np.ndarray:
+        """Arranges striped values back into the order of the sequence, without padding."""
+        return striped.swapaxes(-1, -2).reshape(striped.shape[:-2] + (-1,))[
+            ..., : len(self.left)
+        ]
+
+
+def shift_lanes(stripe: np.ndarray, fill: int) -> np.ndarray:
+    """Moves each value of a stripe into the next lane, filling the first lane with `fill`."""
+    return np.concatenate(([fill], stripe[:-1]))
+
+
+def striped_columns(query: StripedQuery, top: np.ndarray) -> Iterator[np.ndarray]:
+    """
+    Fills the Smith-Waterman search matrix for `query` and the encoded top sequence
+    one column at a time, yielding each striped column. Within a column, each stripe
+    is scored from the one before it, assuming no vertical gaps cross from one lane
+    into the next. Those are then carried over in further passes until they no
+    longer improve any cell, which usually takes a single stripe.
+    """
+    h_prev = np.zeros((query.segment_length, query.n_segments), dtype=np.int64)
+    for code in top:
+        scores = query.scores[code]
+        gap_costs = query.gap_costs[code]
+        h = np.empty_like(h_prev)
+
+        diag = shift_lanes(h_prev[-1], 0)
+        up = np.full(query.n_segments, NEG_INF, dtype=np.int64)
+        for j in range(query.segment_length):
+            up = h[j] = np.maximum(
+                np.maximum(diag + scores[j], np.maximum(h_prev[j], up) - gap_costs[j]),
+                0,
+            )
+            diag = h_prev[j]
+
+        # Carry vertical gaps across lanes
+        improved = True
+        while improved:
+            up = shift_lanes(h[-1], NEG_INF)
+            for j in range(query.segment_length):
+                from_above = up - gap_costs[j]
+                improved = (from_above > h[j]).any()
+                if not improved:
+                    break
+                up = h[j] = np.maximum(h[j], from_above)
+
+        yield h
+        h_prev = h
+
+
+def local_alignment_score(
+    top_seq: str,
+    left_seq: str,
+    nucleotides: bool = True,
+    scheme: Optional[SubstitutionScheme] = None,
+    segment_length: int = STRIPE_SEGMENT_LENGTH,
+) -> int:
+    """
+    Returns the Smith-Waterman score of the best local alignment of the two provided
+    sequences without tracing back the alignment itself. This only keeps two columns
+    of the search matrix in memory at a time, which makes it suited to screening many
+    sequences.
+    """
+    query = StripedQuery(
+        left_seq, scheme or default_scheme(nucleotides), segment_length
+    )
+    best = np.zeros((query.segment_length, query.n_segments), dtype=np.int64)
+    for column in striped_columns(query, query.scheme.encode(top_seq)):
+        np.maximum(best, column, out=best)
+    return int(best[query.valid].max(initial=0))
+
+
+def align_local(
+    top_seq: str,
+    left_seq: str,
+    nucleotides: bool = True,
+    scheme: Optional[SubstitutionScheme] = None,
+    segment_length: int = STRIPE_SEGMENT_LENGTH,
+) -> LocalAlignmentResult:
+    """
+    Aligns the best matching parts of the two provided sequences using Smith-Waterman
+    local alignment, scoring them with the same scheme as `align_sequences`, but without
+    penalizing the unaligned ends of either sequence. Returns the aligned parts, along
+    with the score of the alignment and where it starts and ends in each sequence. If
+    no part of the sequences scores above zero, the alignment is empty.
+    """
+    scheme = scheme or default_scheme(nucleotides)
+    query = StripedQuery(left_seq, scheme, segment_length)
+    top = scheme.encode(top_seq)
+    left = query.left
+
+    search = np.zeros((len(left) + 1, len(top) + 1), dtype=np.int64)
+    for y, column in enumerate(striped_columns(query, top), 1):
+        search[1:, y] = query.unstripe(column)
+
+    x, y = np.unravel_index(np.argmax(search), search.shape)
+    score = int(search[x, y])
+    x_end, y_end = x, y
+
+    final_top = []
+    final_left = []
+
+    while search[x, y] > 0:
+        gap_cost = scheme.gap_penalties[top[y - 1], left[x - 1]]
+        if (
+            search[x, y]
+            == search[x - 1, y - 1] + scheme.scores[top[y - 1], left[x - 1]]
+        ):
+            final_top.append(top_seq[y - 1])
+            final_left.append(left_seq[x - 1])
+            x -= 1
+            y -= 1
+        elif search[x, y] == search[x, y - 1] - gap_cost:
+            final_top.append(top_seq[y - 1])
+            final_left.append("-")
+            y -= 1
+        else:
+            final_top.append("-")
+            final_left.append(left_seq[x - 1])
+            x -= 1
+
+    return LocalAlignmentResult(
+        "".join(reversed(final_top)),
+        "".join(reversed(final_left)),
+        score,
+        (int(y), int(y_end)),
+        (int(x), int(x_end)),
+    )
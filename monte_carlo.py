@@ -1,28 +1,51 @@
 """The `monte_carlo` module provides an implementation of a Monte-Carlo simulation."""
 
 import json
+import os
+import random
+from collections import defaultdict
 from math import nan
 
 from time import perf_counter
-from typing import Callable, TypeVar
+from typing import Callable, Collection, List, Optional, Tuple, TypeVar, Union
 
 import numpy as np
 
+from options import SEQUENTIAL_CONFIDENCE, SEQUENTIAL_MIN_TRIALS
+from scheduler import schedule_batches
+from stats import wilson_interval
+from trial_log import TrialLog
+
 T = TypeVar("T")
 
+# Why a sequential simulation stopped for a given statistic
+STOP_TRIAL_LIMIT = "trial_limit"
+STOP_BELOW_ALPHA = "below_alpha"
+STOP_ABOVE_ALPHA = "above_alpha"
+
 
 class MonteCarloSimulationResult:
     """
     MonteCarloSimulationResult represents the result of a Monte-Carlo simulation.
     """
 
-    def __init__(self, p_value: float, n_trials: int, n_successes: int):
+    def __init__(
+        self,
+        p_value: float,
+        n_trials: int,
+        n_successes: int,
+        confidence_interval: Optional[Tuple[float, float]] = None,
+        stop_reason: Optional[str] = None,
+    ):
         """
         Produces a new MonteCarloSimulationResult representing the result of a Monte-Carlo simulation.
+        Sequential simulations also report the confidence interval of the p-value and why they stopped.
         """
         self.p_value = p_value
         self.n_trials = n_trials
         self.n_successes = n_successes
+        self.confidence_interval = confidence_interval
+        self.stop_reason = stop_reason
 
     def examine(self):
         """Prints information about the simulation to the console."""
@@ -30,17 +53,26 @@ class MonteCarloSimulationResult:
 
     def format_result(self):
         """Formats the results of the simulation for external use."""
-        return f"Monte-Carlo simulation summary:\nTrials: {self.n_trials}\nSuccesses: {self.n_successes}\np-value: {self.p_value}"
+        summary = f"Monte-Carlo simulation summary:\nTrials: {self.n_trials}\nSuccesses: {self.n_successes}\np-value: {self.p_value}"
+        if self.confidence_interval is not None:
+            lower, upper = self.confidence_interval
+            summary += f"\nConfidence interval: [{lower}, {upper}]"
+        if self.stop_reason is not None:
+            summary += f"\nStop reason: {self.stop_reason}"
+        return summary
 
     def to_json(self):
         """Formats the results of the simulation as a JSON string and returns it."""
-        return json.dumps(
-            {
-                "p_value": self.p_value,
-                "n_trials": self.n_trials,
-                "n_successes": self.n_successes,
-            }
-        )
+        data = {
+            "p_value": self.p_value,
+            "n_trials": self.n_trials,
+            "n_successes": self.n_successes,
+        }
+        if self.confidence_interval is not None:
+            data["confidence_interval"] = list(self.confidence_interval)
+        if self.stop_reason is not None:
+            data["stop_reason"] = self.stop_reason
+        return json.dumps(data)
 
     def get_p_value(self):
         """Returns the estimated p-value of the simmulation."""
@@ -54,38 +86,167 @@ class MonteCarloSimulationResult:
         """Returns the number of successes in the simmulation."""
         return self.n_successes
 
+    def get_confidence_interval(self):
+        """Returns the confidence interval of the p-value, if the simulation was sequential."""
+        return self.confidence_interval
+
+    def get_stop_reason(self):
+        """Returns the reason the simulation stopped, if the simulation was sequential."""
+        return self.stop_reason
+
+
+def stop_reasons(
+    n_successes: np.ndarray, n_trials: int, alpha: float, confidence: float
+) -> List[str]:
+    """
+    Decides, for each statistic, whether the Wilson interval of its p-value after
+    `n_trials` trials lies entirely below or above `alpha`. Statistics which can't
+    be decided yet are given `STOP_TRIAL_LIMIT`, since only the trial limit can
+    stop the simulation for them.
+    """
+    lower, upper = wilson_interval(n_successes, n_trials, confidence)
+    return [
+        (
+            STOP_BELOW_ALPHA
+            if hi < alpha
+            else STOP_ABOVE_ALPHA if lo > alpha else STOP_TRIAL_LIMIT
+        )
+        for lo, hi in zip(lower, upper)
+    ]
+
+
+def should_stop(
+    n_successes: np.ndarray,
+    n_trials: int,
+    alpha: Optional[float],
+    confidence: float,
+    min_trials: int,
+) -> bool:
+    """
+    Returns whether a sequential simulation can stop early, which is once it has run
+    at least `min_trials` trials and the conclusion for every statistic is known.
+    """
+    if alpha is None or n_trials == 0 or n_trials < min_trials:
+        return False
+    return STOP_TRIAL_LIMIT not in stop_reasons(
+        n_successes, n_trials, alpha, confidence
+    )
+
+
+def make_results(
+    n_successes: np.ndarray,
+    n_trials: int,
+    multiple: bool,
+    alpha: Optional[float] = None,
+    confidence: float = SEQUENTIAL_CONFIDENCE,
+) -> Union[MonteCarloSimulationResult, List[MonteCarloSimulationResult]]:
+    """
+    Builds one result per statistic from the success counts of a simulation, or a
+    single result if only one effect size function was provided. If `alpha` is
+    provided, the results also carry a confidence interval and stopping reason.
+    """
+    if alpha is None:
+        intervals = [None] * len(n_successes)
+        reasons = [None] * len(n_successes)
+    else:
+        lower, upper = wilson_interval(n_successes, n_trials, confidence)
+        intervals = [(float(lo), float(hi)) for lo, hi in zip(lower, upper)]
+        reasons = stop_reasons(n_successes, n_trials, alpha, confidence)
+
+    # These can have numpy dtypes, which aren't serializable
+    results = [
+        MonteCarloSimulationResult(
+            float(successes / n_trials), int(n_trials), int(successes), interval, reason
+        )
+        for successes, interval, reason in zip(n_successes, intervals, reasons)
+    ]
+    return results if multiple else results[0]
+
 
 def monte_carlo(
-    simulation_fn: Callable[[], T],
-    effect_size_fn: Callable[[T], np.float64],
-    observed_effect_size: np.float64,
+    simulation_fn: Union[
+        Callable[[], T], Callable[[int, np.random.Generator], List[T]]
+    ],
+    effect_size_fn: Union[Callable[[T], np.float64], List[Callable[[T], np.float64]]],
+    observed_effect_size: Union[np.float64, List[np.float64]],
     n_trials: int,
     verbose: bool = False,
-) -> MonteCarloSimulationResult:
+    batch_size: int = 1,
+    alpha: Optional[float] = None,
+    confidence: float = SEQUENTIAL_CONFIDENCE,
+    min_trials: int = SEQUENTIAL_MIN_TRIALS,
+    log_path: Optional[str] = None,
+    seed: Optional[int] = None,
+    first_batch: int = 0,
+    batched: bool = False,
+) -> Union[MonteCarloSimulationResult, List[MonteCarloSimulationResult]]:
     """
     Runs a Monte-Carlo simulation. Returns an object representing the result of the simulation,
     which will contain the final p-value.
 
 
-    `simulation_fn`: A function that runs a single trial of the simulation.
+    `simulation_fn`: A function that runs a single trial of the simulation, or a batch of them if `batched`
+    is set.
 
     `effect_size_fn`: A function that calculates an effect size from the return value of the simulation function.
+    A list of functions can be provided instead to test several statistics against the same trials, in which
+    case a list of results is returned, in the same order.
 
-    `observed_effect_size`: The observed effect size that is being tested.
+    `observed_effect_size`: The observed effect size that is being tested. This must be a list in the same
+    order as `effect_size_fn` if that is a list.
 
     `n_trials`: The number of trials to run. More trials will more precisely estimate the p-value.
 
     `verbose`: Whether or not to perform logging to the console while the simulation is running.
+
+    `batch_size`: The number of trials to run at once. Batches are the unit of logging and seeding.
+
+    `batched`: Whether `simulation_fn` runs a batch of trials. If set, it is called with the number of
+    trials to run and a NumPy random `Generator` to draw them from, and must return a list of that many
+    results. Otherwise, it is called once per trial, with no arguments.
+
+    `alpha`: If provided, the simulation is sequential. After each batch, it stops early once the
+    `confidence` Wilson interval of every p-value lies entirely below or above `alpha`, as long as at
+    least `min_trials` trials have run. `n_trials` remains the upper limit on the number of trials.
+
+    `log_path`: If provided, the outcome of each batch is appended to a `TrialLog` at this path. If the
+    log already exists, the simulation resumes from the trials it records, running only the batches that
+    aren't logged.
+
+    `seed`: If provided, each batch gets its own random number generators from `seed_batch`, so that
+    the simulation is reproducible. Batches are numbered from `first_batch`, which lets a run be
+    split into batches that are simulated elsewhere, giving the same result.
     """
+    multiple = isinstance(effect_size_fn, (list, tuple))
+    effect_size_fns = effect_size_fn if multiple else [effect_size_fn]
+    observed_effect_sizes = np.array(
+        observed_effect_size if multiple else [observed_effect_size]
+    )
+    if len(effect_size_fns) != len(observed_effect_sizes):
+        raise ValueError("each effect size function needs an observed effect size")
+
+    trial_log = TrialLog(log_path) if log_path is not None else None
+    if trial_log is not None:
+        n_resumed, n_successes, logged_batches = trial_log.resume(len(effect_size_fns))
+    else:
+        n_resumed, n_successes = 0, np.zeros(len(effect_size_fns), dtype=np.int64)
+        logged_batches = set()
 
     if verbose:
         print("Beginning Monte-Carlo simulation with %d trials." % n_trials)
+        if n_resumed > 0:
+            print("Resuming from %d logged trials." % n_resumed)
         start_time = perf_counter()
 
-    def get_next_result(trial: int) -> bool:
+    def get_next_result(trial: int, simulation_result: T) -> np.ndarray:
         if verbose:
             elapsed_time = perf_counter() - start_time
-            eta = (elapsed_time / trial) * (n_trials + 1 - trial) if trial > 1 else nan
+            run_trials = trial - n_resumed
+            eta = (
+                (elapsed_time / run_trials) * (n_trials + 1 - trial)
+                if run_trials > 1
+                else nan
+            )
             eta_units = "seconds"
 
             if eta > 59:
@@ -105,24 +266,251 @@ def monte_carlo(
                 % (trial, n_trials, eta, eta_units)
             )
 
-        next_effect_size = effect_size_fn(simulation_fn())
-        next_result = next_effect_size >= observed_effect_size
+        next_effect_sizes = np.array([fn(simulation_result) for fn in effect_size_fns])
+        next_result = next_effect_sizes >= observed_effect_sizes
 
         if verbose:
-            if next_result:
+            if multiple:
+                print(
+                    "Simulation %d suceeded for %d/%d statistics."
+                    % (trial, np.count_nonzero(next_result), len(next_result))
+                )
+            elif next_result[0]:
                 print("Simulation %d suceeded." % trial)
             else:
                 print("Simulation %d failed." % trial)
 
         return next_result
 
-    trials = [get_next_result(trial + 1) for trial in range(n_trials)]
-    n_successes = sum(trials)  # Yes, this is summing booleans
+    # Without a seed, every batch draws from one freshly seeded generator
+    rng = np.random.default_rng()
+    n_completed = n_resumed
+    try:
+        for batch_index, batch_trials in make_batches(
+            n_trials, batch_size, logged_batches
+        ):
+            if should_stop(n_successes, n_completed, alpha, confidence, min_trials):
+                break
+            if seed is not None:
+                rng = seed_batch(seed, first_batch + batch_index)
+            if batched:
+                simulation_results = simulation_fn(batch_trials, rng)
+            else:
+                simulation_results = [simulation_fn() for _ in range(batch_trials)]
+            batch_successes = np.zeros_like(n_successes)
+            for simulation_result in simulation_results:
+                n_completed += 1
+                batch_successes += get_next_result(n_completed, simulation_result)
+            n_successes += batch_successes
+
+            if trial_log is not None:
+                trial_log.append(batch_index, len(simulation_results), batch_successes)
+    finally:
+        if trial_log is not None:
+            trial_log.close()
+
+    if verbose and n_completed < n_trials:
+        print("Stopping early after %d simulations." % n_completed)
+
+    if verbose:
+        for successes in n_successes:
+            print(
+                "Monte-Carlo simulation completed. Final p-value: %.6f"
+                % (successes / n_completed)
+            )
+
+    return make_results(n_successes, n_completed, multiple, alpha, confidence)
+
+
+def seed_batch(seed: int, batch_index: int) -> np.random.Generator:
+    """
+    Returns a NumPy random `Generator` for the batch of trials at `batch_index`,
+    and seeds the `random` module from the same stream for simulation functions
+    that use it. Each batch gets an independent stream derived from `seed`, so a
+    seeded simulation gives the same result however its batches are distributed.
+    """
+    seed_sequence = np.random.SeedSequence(seed, spawn_key=(batch_index,))
+    state = seed_sequence.generate_state(4)
+    random.seed(int.from_bytes(state.tobytes(), "little"))
+    return np.random.default_rng(seed_sequence)
+
+
+def make_batches(
+    n_trials: int, batch_size: int, logged_batches: Collection[int] = ()
+) -> List[Tuple[int, int]]:
+    """
+    Splits `n_trials` trials into batches of at most `batch_size`, returning the
+    index and size of each batch, except for the batches in `logged_batches`,
+    which have already been run.
+    """
+    return [
+        (index, min(batch_size, n_trials - start))
+        for index, start in enumerate(range(0, n_trials, batch_size))
+        if index not in logged_batches
+    ]
+
+
+# The trial specification for the current worker process, set by init_worker
+worker_state = {}
+
+
+def init_worker(
+    simulation_fn: Union[
+        Callable[[], T], Callable[[int, np.random.Generator], List[T]]
+    ],
+    effect_size_fns: List[Callable[[T], np.float64]],
+    observed_effect_sizes: List[np.float64],
+    batch_size: int,
+    seed: Optional[int] = None,
+    batched: bool = False,
+):
+    """
+    Stores the trial specification in a worker process of `monte_carlo_parallel`,
+    so that it only needs to be sent to each worker once.
+    """
+    # Forked workers would otherwise all inherit the parent's random state
+    random.seed()
+
+    worker_state["simulation_fn"] = simulation_fn
+    worker_state["effect_size_fns"] = effect_size_fns
+    worker_state["observed_effect_sizes"] = observed_effect_sizes
+    worker_state["batch_size"] = batch_size
+    worker_state["seed"] = seed
+    worker_state["batched"] = batched
+
+
+def run_worker_trials(batch: Tuple[int, int]) -> List[int]:
+    """
+    Runs a batch of trials in a worker process, given the index and size of the
+    batch, and returns the number of successes for each statistic.
+    """
+    batch_index, n_trials = batch
+    return [
+        result.get_success_count()
+        for result in monte_carlo(
+            worker_state["simulation_fn"],
+            worker_state["effect_size_fns"],
+            worker_state["observed_effect_sizes"],
+            n_trials=n_trials,
+            batch_size=worker_state["batch_size"],
+            seed=worker_state["seed"],
+            first_batch=batch_index,
+            batched=worker_state["batched"],
+        )
+    ]
+
+
+def monte_carlo_parallel(
+    simulation_fn: Union[
+        Callable[[], T], Callable[[int, np.random.Generator], List[T]]
+    ],
+    effect_size_fn: Union[Callable[[T], np.float64], List[Callable[[T], np.float64]]],
+    observed_effect_size: Union[np.float64, List[np.float64]],
+    n_trials: int,
+    workers: Optional[int] = None,
+    batch_size: int = 1,
+    verbose: bool = False,
+    alpha: Optional[float] = None,
+    confidence: float = SEQUENTIAL_CONFIDENCE,
+    min_trials: int = SEQUENTIAL_MIN_TRIALS,
+    log_path: Optional[str] = None,
+    seed: Optional[int] = None,
+    batched: bool = False,
+) -> Union[MonteCarloSimulationResult, List[MonteCarloSimulationResult]]:
+    """
+    Runs a Monte-Carlo simulation like `monte_carlo`, but spreads the trials over
+    `workers` processes, which defaults to the number of CPUs. Returns the merged
+    result of all of the trials, or a list of results if a list of effect size
+    functions is provided.
+
+    `simulation_fn` and `effect_size_fn` are sent to each worker once when it starts,
+    so they must be picklable; closures are not, but instances of classes with a
+    `__call__` method and their bound methods are. Trials are handed out by
+    `schedule_batches` `batch_size` at a time, as workers become free, and
+    `batch_size` and `batched` are passed on to `monte_carlo`. A batch whose worker crashes is
+    run again on another worker. With a `seed`, each batch is seeded by its index,
+    so the result is the same as that of `monte_carlo` with the same seed, no matter
+    how many workers are used, unless the simulation stops early.
+
+    If `alpha` is provided, the simulation stops early as in `monte_carlo`, checking
+    the stopping rule whenever a batch completes. Batches which are still running
+    at that point are discarded.
+
+    If `log_path` is provided, this process appends each completed batch to a
+    `TrialLog` at that path, and resumes from it if it already exists, running only
+    the batches that aren't logged.
+    """
+    multiple = isinstance(effect_size_fn, (list, tuple))
+    effect_size_fns = list(effect_size_fn) if multiple else [effect_size_fn]
+    observed_effect_sizes = (
+        list(observed_effect_size) if multiple else [observed_effect_size]
+    )
+
+    trial_log = TrialLog(log_path) if log_path is not None else None
+    if trial_log is not None:
+        n_completed, n_successes, logged_batches = trial_log.resume(
+            len(effect_size_fns)
+        )
+    else:
+        n_completed, n_successes = 0, np.zeros(len(effect_size_fns), dtype=np.int64)
+        logged_batches = set()
 
-    p_value = n_successes / n_trials
+    workers = workers or os.cpu_count()
+    chunks = make_batches(n_trials, batch_size, logged_batches)
+    if should_stop(n_successes, n_completed, alpha, confidence, min_trials):
+        chunks = []
 
     if verbose:
-        print("Monte-Carlo simulation completed. Final p-value: %.6f" % p_value)
+        print(
+            "Beginning Monte-Carlo simulation with %d trials on %d workers."
+            % (n_trials, workers)
+        )
+        if n_completed > 0:
+            print("Resuming from %d logged trials." % n_completed)
+
+    worker_trials = defaultdict(int)
+    batches = schedule_batches(
+        run_worker_trials,
+        chunks,
+        workers,
+        initializer=init_worker,
+        initargs=(
+            simulation_fn,
+            effect_size_fns,
+            observed_effect_sizes,
+            batch_size,
+            seed,
+            batched,
+        ),
+    )
+    try:
+        for worker_id, index, batch_successes in batches:
+            batch_index, batch_trials = chunks[index]
+            n_successes += batch_successes
+            n_completed += batch_trials
+            worker_trials[worker_id] += batch_trials
+            if trial_log is not None:
+                trial_log.append(batch_index, batch_trials, batch_successes)
+            if verbose:
+                print(
+                    "Completed %d/%d simulations (worker %d has completed %d)."
+                    % (n_completed, n_trials, worker_id, worker_trials[worker_id])
+                )
+
+            if should_stop(n_successes, n_completed, alpha, confidence, min_trials):
+                if verbose:
+                    print("Stopping early after %d simulations." % n_completed)
+                break
+    finally:
+        batches.close()
+        if trial_log is not None:
+            trial_log.close()
 
-    # These can have numpy dtypes, which aren't serializable
-    return MonteCarloSimulationResult(float(p_value), int(n_trials), int(n_successes))
+    if verbose:
+        for successes in n_successes:
+            print(
+                "Monte-Carlo simulation completed. Final p-value: %.6f"
+                % (successes / n_completed)
+            )
+
+    return make_results(n_successes, n_completed, multiple, alpha, confidence)
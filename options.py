@@ -7,6 +7,61 @@ CLUSTER_COUNTS = [5, 10, 15, 20, 30]
 # Number of simulations to perform.
 SIMULATION_COUNT = 1000
 
+# Number of simulated alignments to compute at once. Larger batches are
+# faster, but each one holds a search matrix per trial in memory.
+SIMULATION_BATCH_SIZE = 16
+
+# Two-sided confidence level of the interval used to stop sequential
+# simulations early, and the number of trials to run before checking it.
+SEQUENTIAL_CONFIDENCE = 0.99
+SEQUENTIAL_MIN_TRIALS = 100
+
+# Maximum number of seconds between flushes of a simulation's trial log.
+# This is the most work that is lost if a simulation is killed.
+TRIAL_LOG_FLUSH_INTERVAL = 5
+
+# Number of times a batch of trials is retried if it crashes the worker
+# process running it, and the number of seconds between checks for
+# crashed workers.
+MAX_BATCH_RETRIES = 3
+WORKER_POLL_INTERVAL = 1
+
+# Default port for a distributed simulation's coordinator, and the number
+# of seconds a worker has to finish a batch before it is handed to another
+# worker, in case the first one has died.
+DISTRIBUTED_PORT = 50000
+DISTRIBUTED_LEASE_TIME = 300
+
+# Number of seconds a distributed simulation's coordinator waits for a worker
+# to connect, or for any worker to show signs of life, before giving up.
+DISTRIBUTED_IDLE_TIMEOUT = 600
+
 # Window sizes (in base pairs) to use during sliding-window dN/dS analysis.
 # If the window size is too small, there can be situations in which dS is 0.
 DNDS_WINDOW_SIZES = [180, 360, 540]
+
+# Number of base pairs between the starts of sliding dN/dS windows.
+# Steps which are a multiple of 3 keep every window in the same reading frame.
+DNDS_WINDOW_STEP = 3
+
+# Number of bootstrap replicates used for the confidence intervals of each
+# sliding dN/dS window, the confidence level of the intervals, and the number
+# of replicates computed at once by each worker process.
+DNDS_BOOTSTRAP_REPLICATES = 1000
+DNDS_BOOTSTRAP_CONFIDENCE = 0.95
+DNDS_BOOTSTRAP_BATCH_SIZE = 25
+
+# Number of alignments kept in memory by each process, and the maximum
+# number of bytes of alignments kept in the cache directory.
+ALIGNMENT_CACHE_ENTRIES = 32
+ALIGNMENT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Number of best hits kept by a database search, and the number of database
+# records sent to a worker process at once.
+SEARCH_TOP_K = 10
+SEARCH_BATCH_SIZE = 32
+
+# Maximum number of search matrix cells used to locally re-align a search hit
+# to find its identity. Local alignments hold the whole matrix in memory, so
+# hits with longer records are reported without an identity.
+SEARCH_MAX_LOCAL_CELLS = 16 * 1024 * 1024
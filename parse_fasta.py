@@ -1,6 +1,20 @@
 """The `parse_fasta` module exposes functions for reading FASTA files."""
 
-from typing import Iterator, Tuple
+import gzip
+import os
+from typing import BinaryIO, Dict, Iterator, NamedTuple, Tuple
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def open_fasta(filename: str) -> BinaryIO:
+    """
+    Opens the FASTA file with the provided filename for buffered binary reading,
+    decompressing it transparently if it is gzipped.
+    """
+    with open(filename, "rb") as f:
+        is_gzipped = f.read(2) == GZIP_MAGIC
+    return gzip.open(filename, "rb") if is_gzipped else open(filename, "rb")
 
 
 def parse_fasta(filename: str) -> Iterator[Tuple[str, str]]:
@@ -8,24 +22,132 @@ def parse_fasta(filename: str) -> Iterator[Tuple[str, str]]:
     Parses the FASTA file with the provided filename. Returns
     an iterator of tuples, structured with the sequence name
     in the first element and the sequence itself in the second.
+    Records are read lazily, so only the first one needs to be
+    read to get it with `next`. The file may be gzipped.
     """
-    with open(filename, "r") as f:
-        data = f.read()
-
-    if data[0] != ">":
-        raise ValueError("input file is not a FASTA file")
-
-    currentSeq = []
-    currentKey = ""
-    for line in data.splitlines():
-        if line.startswith(">"):
-            if currentKey != "":
-                yield currentKey, "".join(currentSeq)
-                currentSeq = []
-            currentKey = line[1:].split()[0]  # Only key on the protein name
-        else:
-            currentSeq.append(line.strip().upper())
-
-    # Return last pair, if it exists
-    if currentKey != "":
-        yield currentKey, "".join(currentSeq)
+    with open_fasta(filename) as f:
+        if f.peek(1)[:1] != b">":
+            raise ValueError("input file is not a FASTA file")
+
+        currentSeq = []
+        currentKey = ""
+        for line in f:
+            if line.startswith(b">"):
+                if currentKey != "":
+                    yield currentKey, b"".join(currentSeq).decode()
+                    currentSeq = []
+                # Only key on the protein name
+                currentKey = line[1:].split()[0].decode()
+            else:
+                currentSeq.append(line.strip().upper())
+
+        # Return last pair, if it exists
+        if currentKey != "":
+            yield currentKey, b"".join(currentSeq).decode()
+
+
+class FastaIndexEntry(NamedTuple):
+    """
+    FastaIndexEntry is one line of a `.fai` index, as written by `samtools faidx`:
+    the length of a sequence, the byte offset of its first base, and the number of
+    bases and bytes in each of its lines.
+    """
+
+    length: int
+    offset: int
+    line_bases: int
+    line_width: int
+
+
+def build_fasta_index(filename: str) -> Dict[str, FastaIndexEntry]:
+    """
+    Scans the FASTA file with the provided filename and returns an index of its
+    records by name. Every line of a record but its last must have the same
+    length, so that the position of any base can be calculated.
+    """
+    index = {}
+    name = None
+
+    def add_entry():
+        if name in index:
+            raise ValueError(f"duplicate sequence name in FASTA file: {name}")
+        index[name] = FastaIndexEntry(length, offset, line_bases, line_width)
+
+    with open_fasta(filename) as f:
+        position = 0
+        for line in f:
+            bases = len(line.rstrip(b"\r\n"))
+            if line.startswith(b">"):
+                if name is not None:
+                    add_entry()
+                name = line[1:].split()[0].decode()
+                offset = position + len(line)
+                length = line_bases = line_width = 0
+                ended = False
+            elif name is not None and bases == 0:
+                # Only trailing blank lines are allowed
+                ended = length > 0
+            elif name is not None:
+                if ended or (line_bases != 0 and bases > line_bases):
+                    raise ValueError(f"sequence {name} has lines of differing lengths")
+                if line_bases == 0:
+                    line_bases, line_width = bases, len(line)
+                ended = bases < line_bases
+                length += bases
+            position += len(line)
+
+        if name is not None:
+            add_entry()
+    return index
+
+
+def get_index_path(filename: str) -> str:
+    """Gets the path of the `.fai` index for the FASTA file with the provided filename."""
+    return filename + ".fai"
+
+
+def write_fasta_index(filename: str) -> Dict[str, FastaIndexEntry]:
+    """Builds the index for a FASTA file and writes it next to the file, returning it."""
+    index = build_fasta_index(filename)
+    with open(get_index_path(filename), "w") as f:
+        for name, entry in index.items():
+            f.write("\t".join([name] + [str(field) for field in entry]) + "\n")
+    return index
+
+
+def read_fasta_index(filename: str) -> Dict[str, FastaIndexEntry]:
+    """
+    Reads the `.fai` index of the FASTA file with the provided filename, building
+    and writing it first if it doesn't exist or is older than the file.
+    """
+    index_path = get_index_path(filename)
+    if not os.path.exists(index_path) or os.path.getmtime(
+        index_path
+    ) < os.path.getmtime(filename):
+        return write_fasta_index(filename)
+
+    index = {}
+    with open(index_path, "r") as f:
+        for line in f:
+            name, *fields = line.rstrip("\n").split("\t")
+            index[name] = FastaIndexEntry(*(int(field) for field in fields[:4]))
+    return index
+
+
+def fetch_fasta(filename: str, name: str) -> str:
+    """
+    Fetches the sequence with the provided name from a FASTA file using its index,
+    without scanning the records before it. Gzipped files can only be read from
+    the beginning, so they are decompressed up to the record.
+    """
+    entry = read_fasta_index(filename).get(name)
+    if entry is None:
+        raise KeyError(f"sequence {name} is not in {filename}")
+    if entry.length == 0:
+        return ""
+
+    full_lines, remainder = divmod(entry.length, entry.line_bases)
+    with open_fasta(filename) as f:
+        f.seek(entry.offset)
+        data = f.read(full_lines * entry.line_width + remainder)
+    return b"".join(data.split()).upper().decode()
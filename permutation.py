@@ -0,0 +1,37 @@
+"""The `permutation` module generates shuffled copies of sequences for permutation tests."""
+
+from typing import Union
+
+import numpy as np
+
+from scoring import SubstitutionScheme
+
+
+class PermutationSource:
+    """
+    PermutationSource produces batches of random permutations of a sequence,
+    already encoded for a `SubstitutionScheme`, so that they can be aligned
+    without converting them to and from strings.
+    """
+
+    def __init__(self, seq: Union[str, np.ndarray], scheme: SubstitutionScheme):
+        """
+        Produces a new PermutationSource for `seq`, encoded with `scheme` unless it
+        already is.
+        """
+        self.scheme = scheme
+        self.codes = scheme.encode(seq)
+
+    def batch(self, n_permutations: int, rng: np.random.Generator) -> np.ndarray:
+        """
+        Returns `n_permutations` independent random permutations of the sequence,
+        one per row of a `uint8` matrix of codes. Each row is ordered by sorting
+        a row of uniform random keys drawn from `rng`, so the whole batch is
+        shuffled at once.
+        """
+        keys = rng.random((n_permutations, len(self.codes)))
+        return self.codes[np.argsort(keys, axis=1)]
+
+    def decode(self, permutations: np.ndarray) -> list:
+        """Decodes a batch of permutations back into strings."""
+        return [self.scheme.decode(row) for row in permutations]
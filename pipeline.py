@@ -0,0 +1,182 @@
+"""
+The `pipeline` module runs analyses made of named stages. Each stage's result is cached on
+disk, keyed by its configuration and the results it depends on, so that re-running a
+pipeline only recomputes the stages whose inputs changed.
+"""
+
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import pickle
+import re
+from glob import glob
+from multiprocessing.connection import wait
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from dir_utils import get_cache, make_cache_dir
+from sequence_cache import file_digest, write_atomically
+
+
+class Stage(NamedTuple):
+    """
+    Stage is one step of a pipeline. Its function is called with the results of the
+    stages named in `inputs`, in order, followed by the keyword arguments in `config`.
+    The contents of the files in `files` are part of its cache key, so it is re-run
+    if they change. A stage which `writes_files` returns the paths it wrote, and is
+    re-run if any of them is missing.
+    """
+
+    name: str
+    fn: Callable[..., Any]
+    inputs: Tuple[str, ...] = ()
+    config: Optional[Dict[str, Any]] = None
+    files: Tuple[str, ...] = ()
+    writes_files: bool = False
+
+
+def get_stage_cache(stage: Stage, key: str) -> str:
+    """Gets the path of the cached result of a stage with the provided cache key."""
+    return get_cache(
+        f"pipeline/{re.sub(r'[^a-zA-Z0-9_.-]', '_', stage.name)}.{key}.pkl"
+    )
+
+
+def get_function_digest(fn: Callable[..., Any]) -> str:
+    """
+    Returns a digest of the source code of a function, so that editing a stage's
+    function invalidates its cached results. Functions whose source isn't available,
+    such as builtins, are identified by their qualified name instead.
+    """
+    try:
+        source = inspect.getsource(fn)
+    except (OSError, TypeError):
+        source = f"{getattr(fn, '__module__', None)}.{getattr(fn, '__qualname__', fn)}"
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def get_stage_key(stage: Stage, input_digests: List[str]) -> str:
+    """
+    Returns the cache key of a stage, given the digests of the results of its inputs.
+    The key covers the source of the stage's function, its configuration and files.
+    """
+    source = json.dumps(
+        {
+            "name": stage.name,
+            "fn": get_function_digest(stage.fn),
+            "config": stage.config or {},
+            "files": [file_digest(filename) for filename in stage.files],
+            "inputs": input_digests,
+        },
+        sort_keys=True,
+        default=repr,
+    )
+    return hashlib.sha256(source.encode()).hexdigest()[:32]
+
+
+def run_stage(stage: Stage, input_values: List[Any], filename: str):
+    """Runs a stage in a worker process and writes its pickled result to `filename`."""
+    result = stage.fn(*input_values, **(stage.config or {}))
+    write_atomically(filename, lambda f: pickle.dump(result, f))
+
+
+def load_stage(stage: Stage, filename: str) -> Optional[Tuple[Any, str]]:
+    """
+    Loads the cached result of a stage, returning the result and the digest of its
+    pickled form, or `None` if it isn't cached or the files it wrote are missing.
+    """
+    try:
+        with open(filename, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+
+    result = pickle.loads(data)
+    if stage.writes_files and not all(os.path.exists(path) for path in result):
+        return None
+    return result, hashlib.sha256(data).hexdigest()
+
+
+def remove_stale_results(stage: Stage, filename: str):
+    """Removes the cached results of previous runs of a stage, other than `filename`."""
+    for stale in glob(get_stage_cache(stage, "*")):
+        if os.path.abspath(stale) != os.path.abspath(filename):
+            os.remove(stale)
+
+
+def run_pipeline(
+    stages: List[Stage], workers: Optional[int] = None, verbose: bool = False
+) -> Dict[str, Any]:
+    """
+    Runs the provided stages and returns their results by name. A stage is started as
+    soon as all of its inputs are available, and up to `workers` stages run at once in
+    separate processes, which defaults to the number of CPUs. Stages whose cache key is
+    unchanged since a previous run are loaded from the cache instead of being run.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    if len(by_name) != len(stages):
+        raise ValueError("stage names must be unique")
+    for stage in stages:
+        for name in stage.inputs:
+            if name not in by_name:
+                raise ValueError(f"stage {stage.name} depends on unknown stage {name}")
+
+    make_cache_dir()
+    os.makedirs(get_cache("pipeline"), exist_ok=True)
+    workers = workers or multiprocessing.cpu_count()
+
+    results = {}
+    digests = {}
+    waiting = list(stages)
+    running = {}
+
+    def finish(stage: Stage, filename: str, loaded: Tuple[Any, str]):
+        results[stage.name], digests[stage.name] = loaded
+        remove_stale_results(stage, filename)
+
+    while waiting or running:
+        ready = [
+            stage for stage in waiting if all(name in results for name in stage.inputs)
+        ]
+        if ready and len(running) < workers:
+            stage = ready[0]
+            waiting.remove(stage)
+            key = get_stage_key(stage, [digests[name] for name in stage.inputs])
+            filename = get_stage_cache(stage, key)
+            loaded = load_stage(stage, filename)
+            if loaded is not None:
+                if verbose:
+                    print("Using cached result of %s." % stage.name)
+                finish(stage, filename, loaded)
+                continue
+
+            if verbose:
+                print("Running %s..." % stage.name)
+            process = multiprocessing.Process(
+                target=run_stage,
+                args=(stage, [results[name] for name in stage.inputs], filename),
+            )
+            process.start()
+            running[process.sentinel] = (process, stage, filename)
+            continue
+
+        if not running:
+            raise ValueError(
+                "stages have circular dependencies: "
+                + ", ".join(stage.name for stage in waiting)
+            )
+
+        for sentinel in wait(list(running)):
+            process, stage, filename = running.pop(sentinel)
+            process.join()
+            loaded = load_stage(stage, filename) if process.exitcode == 0 else None
+            if loaded is None:
+                for other, _, _ in running.values():
+                    other.terminate()
+                raise RuntimeError(
+                    f"stage {stage.name} failed with exit code {process.exitcode}"
+                )
+            finish(stage, filename, loaded)
+
+    return results
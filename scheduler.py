@@ -0,0 +1,181 @@
+"""The `scheduler` module runs batches of work on a set of worker processes, handing them out as workers become free."""
+
+import multiprocessing
+import queue
+import traceback
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+from options import MAX_BATCH_RETRIES, WORKER_POLL_INTERVAL
+
+B = TypeVar("B")
+R = TypeVar("R")
+
+
+class BatchError(RuntimeError):
+    """
+    BatchError is raised by `schedule_batches` when a batch fails, either by raising an
+    exception, whose formatted traceback it carries, or by crashing its worker too many
+    times. Workers also send it back to the scheduler to report a failed batch.
+    """
+
+    def __init__(self, message: str, formatted_traceback: Optional[str] = None):
+        """Produces a new BatchError with the provided message and formatted traceback."""
+        super().__init__(
+            message
+            if formatted_traceback is None
+            else f"{message}:\n{formatted_traceback}"
+        )
+        self.message = message
+        self.formatted_traceback = formatted_traceback
+
+    def __reduce__(self):
+        return BatchError, (self.message, self.formatted_traceback)
+
+
+def worker_loop(
+    worker_id: int,
+    tasks: multiprocessing.SimpleQueue,
+    results: multiprocessing.Queue,
+    run_batch: Callable[[B], R],
+    initializer: Optional[Callable],
+    initargs: tuple,
+):
+    """
+    Runs in a worker process of `schedule_batches`. Reports that the worker is
+    ready, then runs each batch it is handed until it is told to stop.
+    """
+    if initializer is not None:
+        initializer(*initargs)
+    results.put((worker_id, None, None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        index, batch = task
+        try:
+            result = run_batch(batch)
+        except Exception:
+            result = BatchError("batch failed", traceback.format_exc())
+        results.put((worker_id, index, result))
+
+
+def schedule_batches(
+    run_batch: Callable[[B], R],
+    batches: List[B],
+    workers: int,
+    initializer: Optional[Callable] = None,
+    initargs: tuple = (),
+    max_retries: int = MAX_BATCH_RETRIES,
+) -> Iterator[Tuple[int, int, R]]:
+    """
+    Runs `run_batch` on each of `batches` in a set of `workers` processes, each
+    of which first calls `initializer(*initargs)`. Rather than splitting the
+    batches up front, each worker is handed the next batch as soon as it
+    finishes its last one, so a slow worker doesn't hold up the others.
+
+    Yields a tuple of the worker ID, batch index and result of each batch, in
+    the order they complete. If a worker process dies, the batch it was running
+    is handed to another worker, and a replacement worker is started. A batch
+    that crashes its worker more than `max_retries` times, or that raises an
+    exception, raises a `BatchError`. Closing the iterator early stops the
+    workers, discarding any batches they are running.
+    """
+    results = multiprocessing.Queue()
+    task_queues: Dict[int, multiprocessing.SimpleQueue] = {}
+    processes: Dict[int, multiprocessing.Process] = {}
+    ready = set()
+    retired = set()
+    in_flight: Dict[int, Tuple[int, B]] = {}
+    retries = [0] * len(batches)
+    pending = deque(enumerate(batches))
+    startup_crashes = 0
+
+    def start_worker():
+        worker_id = len(processes)
+        task_queues[worker_id] = multiprocessing.SimpleQueue()
+        processes[worker_id] = multiprocessing.Process(
+            target=worker_loop,
+            args=(
+                worker_id,
+                task_queues[worker_id],
+                results,
+                run_batch,
+                initializer,
+                initargs,
+            ),
+            daemon=True,
+        )
+        processes[worker_id].start()
+
+    def dispatch(worker_id: int):
+        if pending:
+            in_flight[worker_id] = pending.popleft()
+            task_queues[worker_id].put(in_flight[worker_id])
+        else:
+            task_queues[worker_id].put(None)
+            retired.add(worker_id)
+
+    def handle_crash(worker_id: int):
+        nonlocal startup_crashes
+        retired.add(worker_id)
+        if worker_id not in ready:
+            startup_crashes += 1
+            if startup_crashes > max_retries:
+                raise RuntimeError(
+                    f"workers died while starting up {startup_crashes} times"
+                )
+        task = in_flight.pop(worker_id, None)
+        if task is not None:
+            retries[task[0]] += 1
+            if retries[task[0]] > max_retries:
+                raise BatchError(
+                    f"batch {task[0]} crashed its worker {retries[task[0]]} times"
+                )
+            pending.appendleft(task)
+        start_worker()
+
+    for _ in range(min(workers, len(batches))):
+        start_worker()
+
+    try:
+        n_completed = 0
+        while n_completed < len(batches):
+            # Workers only exit by themselves once they've been told to stop
+            for worker_id, process in list(processes.items()):
+                if worker_id not in retired and not process.is_alive():
+                    handle_crash(worker_id)
+
+            try:
+                worker_id, index, result = results.get(timeout=WORKER_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+
+            if index is None:
+                if worker_id not in retired:
+                    ready.add(worker_id)
+                    dispatch(worker_id)
+                continue
+            if in_flight.get(worker_id, (None,))[0] != index:
+                # The worker died after reporting this, and the batch was requeued
+                continue
+
+            if isinstance(result, BatchError):
+                raise BatchError(
+                    f"batch {index} failed in worker {worker_id}",
+                    result.formatted_traceback,
+                )
+            del in_flight[worker_id]
+            n_completed += 1
+            dispatch(worker_id)
+            yield worker_id, index, result
+    finally:
+        for worker_id, process in processes.items():
+            if worker_id not in retired and process.is_alive():
+                task_queues[worker_id].put(None)
+        for process in processes.values():
+            process.join(timeout=WORKER_POLL_INTERVAL)
+            if process.is_alive():
+                process.terminate()
+                process.join()
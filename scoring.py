@@ -0,0 +1,190 @@
+"""
+The `scoring` module provides the integer sequence encodings and substitution
+tables used by the vectorized alignment engines.
+"""
+
+from typing import Dict, Union
+
+import numpy as np
+
+CHEMICAL_CLASS = {
+    "A": "Purine",
+    "G": "Purine",
+    "T": "Pyrimidine",
+    "C": "Pyrimidine",
+}
+
+NUCLEOTIDE_ALPHABET = "ACGT"
+PROTEIN_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ*"
+
+# Marks bytes that are not part of a scheme's alphabet
+INVALID_CODE = 255
+
+
+class SubstitutionScheme:
+    """
+    SubstitutionScheme describes how pairs of sequence elements are scored. Elements
+    are encoded as indices into `alphabet`, and the scores for every pair of
+    elements are precomputed into lookup tables.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        alphabet: str,
+        scores: np.ndarray,
+        gap_penalty: int,
+        gap_penalties: np.ndarray = None,
+    ):
+        """
+        Produces a new SubstitutionScheme. `scores[a, b]` is the score for aligning
+        element `a` of the top sequence with element `b` of the left sequence.
+        `gap_penalties[a, b]` is the penalty for an indel at a cell where those
+        elements meet, and defaults to `gap_penalty` everywhere. Indels along the
+        edges of an alignment are always penalized by `gap_penalty`.
+        """
+        size = len(alphabet)
+        if len(set(alphabet)) != size or size >= INVALID_CODE:
+            raise ValueError("alphabet must have fewer than 255 unique elements")
+        if scores.shape != (size, size):
+            raise ValueError("score table does not match the alphabet")
+        if gap_penalties is None:
+            gap_penalties = np.full((size, size), gap_penalty)
+        if gap_penalties.shape != (size, size):
+            raise ValueError("gap penalty table does not match the alphabet")
+
+        self.name = name
+        self.alphabet = alphabet
+        self.gap_penalty = gap_penalty
+        self.scores = scores.astype(np.int64)
+
+        # The extra last row and column stand for the gap row/column of the search matrix
+        self.gap_penalties = np.full((size + 1, size + 1), gap_penalty, dtype=np.int64)
+        self.gap_penalties[:size, :size] = gap_penalties
+        self.uniform_gaps = bool((self.gap_penalties == gap_penalty).all())
+
+        self.lookup = np.full(256, INVALID_CODE, dtype=np.uint8)
+        for i, c in enumerate(alphabet):
+            self.lookup[ord(c)] = i
+            self.lookup[ord(c.lower())] = i
+        self.symbols = np.frombuffer(alphabet.encode("ascii"), dtype=np.uint8)
+
+    def encode(self, seq: Union[str, np.ndarray]) -> np.ndarray:
+        """
+        Encodes a sequence as a `uint8` array of alphabet indices. A sequence that is
+        already encoded, such as one read from the sequence cache, is returned as is.
+        """
+        if isinstance(seq, np.ndarray):
+            return seq
+        try:
+            raw = np.frombuffer(seq.encode("ascii"), dtype=np.uint8)
+        except UnicodeEncodeError:
+            raise ValueError(
+                f"sequence contains elements outside the {self.name} alphabet"
+            )
+        codes = self.lookup[raw]
+        if (codes == INVALID_CODE).any():
+            raise ValueError(
+                f"sequence contains elements outside the {self.name} alphabet"
+            )
+        return codes
+
+    def decode(self, codes: np.ndarray) -> str:
+        """Decodes an array of alphabet indices back into a sequence."""
+        return self.symbols[codes].tobytes().decode("ascii")
+
+
+def identity_scores(size: int, match: int = 1, mismatch: int = -1) -> np.ndarray:
+    """Returns a score table with `match` on the diagonal and `mismatch` elsewhere."""
+    return np.where(np.eye(size, dtype=bool), match, mismatch)
+
+
+def transversion_penalties(
+    alphabet: str, chemical_classes: Dict[str, str]
+) -> np.ndarray:
+    """Returns a table with 1 for each pair of elements in differing chemical classes."""
+    classes = [chemical_classes[c] for c in alphabet]
+    return np.array([[int(a != b) for b in classes] for a in classes])
+
+
+def parse_substitution_matrix(
+    name: str, text: str, gap_penalty: int
+) -> SubstitutionScheme:
+    """
+    Parses a substitution matrix in the NCBI text format, where lines starting
+    with `#` are comments, the first remaining line lists the alphabet, and each
+    following line is a row label followed by that row's scores.
+    """
+    lines = [
+        line.split()
+        for line in text.splitlines()
+        if line.strip() and not line.startswith("#")
+    ]
+    alphabet = "".join(lines[0])
+    rows = {row[0]: [int(score) for score in row[1:]] for row in lines[1:]}
+    if sorted(rows) != sorted(alphabet):
+        raise ValueError("substitution matrix rows do not match its alphabet")
+    scores = np.array([rows[c] for c in alphabet])
+    return SubstitutionScheme(name, alphabet, scores, gap_penalty)
+
+
+def load_substitution_matrix(filename: str, gap_penalty: int = 4) -> SubstitutionScheme:
+    """
+    Loads a substitution matrix, such as those distributed by NCBI, from the
+    provided file. `gap_penalty` is the penalty applied to every indel.
+    """
+    with open(filename, "r") as f:
+        return parse_substitution_matrix(filename, f.read(), gap_penalty)
+
+
+# Matches score 1 and mismatches -1, with an extra -1 for indels at transversions
+NUCLEOTIDE_SCHEME = SubstitutionScheme(
+    "nucleotide",
+    NUCLEOTIDE_ALPHABET,
+    identity_scores(len(NUCLEOTIDE_ALPHABET)),
+    gap_penalty=1,
+    gap_penalties=1 + transversion_penalties(NUCLEOTIDE_ALPHABET, CHEMICAL_CLASS),
+)
+
+# Matches score 1 and mismatches -1
+PROTEIN_SCHEME = SubstitutionScheme(
+    "protein",
+    PROTEIN_ALPHABET,
+    identity_scores(len(PROTEIN_ALPHABET)),
+    gap_penalty=1,
+)
+
+BLOSUM62_MATRIX = """
+    A  R  N  D  C  Q  E  G  H  I  L  K  M  F  P  S  T  W  Y  V  B  Z  X  *
+A   4 -1 -2 -2  0 -1 -1  0 -2 -1 -1 -1 -1 -2 -1  1  0 -3 -2  0 -2 -1  0 -4
+R  -1  5  0 -2 -3  1  0 -2  0 -3 -2  2 -1 -3 -2 -1 -1 -3 -2 -3 -1  0 -1 -4
+N  -2  0  6  1 -3  0  0  0  1 -3 -3  0 -2 -3 -2  1  0 -4 -2 -3  3  0 -1 -4
+D  -2 -2  1  6 -3  0  2 -1 -1 -3 -4 -1 -3 -3 -1  0 -1 -4 -3 -3  4  1 -1 -4
+C   0 -3 -3 -3  9 -3 -4 -3 -3 -1 -1 -3 -1 -2 -3 -1 -1 -2 -2 -1 -3 -3 -2 -4
+Q  -1  1  0  0 -3  5  2 -2  0 -3 -2  1  0 -3 -1  0 -1 -2 -1 -2  0  3 -1 -4
+E  -1  0  0  2 -4  2  5 -2  0 -3 -3  1 -2 -3 -1  0 -1 -3 -2 -2  1  4 -1 -4
+G   0 -2  0 -1 -3 -2 -2  6 -2 -4 -4 -2 -3 -3 -2  0 -2 -2 -3 -3 -1 -2 -1 -4
+H  -2  0  1 -1 -3  0  0 -2  8 -3 -3 -1 -2 -1 -2 -1 -2 -2  2 -3  0  0 -1 -4
+I  -1 -3 -3 -3 -1 -3 -3 -4 -3  4  2 -3  1  0 -3 -2 -1 -3 -1  3 -3 -3 -1 -4
+L  -1 -2 -3 -4 -1 -2 -3 -4 -3  2  4 -2  2  0 -3 -2 -1 -2 -1  1 -4 -3 -1 -4
+K  -1  2  0 -1 -3  1  1 -2 -1 -3 -2  5 -1 -3 -1  0 -1 -3 -2 -2  0  1 -1 -4
+M  -1 -1 -2 -3 -1  0 -2 -3 -2  1  2 -1  5  0 -2 -1 -1 -1 -1  1 -3 -1 -1 -4
+F  -2 -3 -3 -3 -2 -3 -3 -3 -1  0  0 -3  0  6 -4 -2 -2  1  3 -1 -3 -3 -1 -4
+P  -1 -2 -2 -1 -3 -1 -1 -2 -2 -3 -3 -1 -2 -4  7 -1 -1 -4 -3 -2 -2 -1 -2 -4
+S   1 -1  1  0 -1  0  0  0 -1 -2 -2  0 -1 -2 -1  4  1 -3 -2 -2  0  0  0 -4
+T   0 -1  0 -1 -1 -1 -1 -2 -2 -1 -1 -1 -1 -2 -1  1  5 -2 -2  0 -1 -1  0 -4
+W  -3 -3 -4 -4 -2 -2 -3 -2 -2 -3 -2 -3 -1  1 -4 -3 -2 11  2 -3 -4 -3 -2 -4
+Y  -2 -2 -2 -3 -2 -1 -2 -3  2 -1 -1 -2 -1  3 -3 -2 -2  2  7 -1 -3 -2 -1 -4
+V   0 -3 -3 -3 -1 -2 -2 -3 -3  3  1 -2  1 -1 -2 -2  0 -3 -1  4 -3 -2 -1 -4
+B  -2 -1  3  4 -3  0  1 -1  0 -3 -4  0 -3 -3 -2  0 -1 -4 -3 -3  4  1 -1 -4
+Z  -1  0  0  1 -3  3  4 -2  0 -3 -3  1 -1 -3 -1  0 -1 -3 -2 -2  1  4 -1 -4
+X   0 -1 -1 -1 -2 -1 -1 -1 -1 -1 -1 -1 -1 -1 -2  0  0 -2 -1 -1 -1 -1 -1 -4
+*  -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4  1
+"""
+
+BLOSUM62 = parse_substitution_matrix("BLOSUM62", BLOSUM62_MATRIX, gap_penalty=4)
+
+
+def default_scheme(nucleotides: bool) -> SubstitutionScheme:
+    """Returns the scoring scheme `align_sequences` uses by default."""
+    return NUCLEOTIDE_SCHEME if nucleotides else PROTEIN_SCHEME
@@ -0,0 +1,299 @@
+"""
+The `search` module searches a query sequence against a FASTA database, keeping only the best
+scoring records. The database is streamed, so it can be far larger than memory.
+"""
+
+import argparse
+import heapq
+import multiprocessing
+import warnings
+from collections import deque
+from itertools import islice
+from multiprocessing.pool import AsyncResult
+from time import monotonic
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from alignment import alignment_score, align_linear
+from data_index import CSTSI
+from dir_utils import get_data
+from kmers import KmerProfile, default_kmer_size
+from local_alignment import align_local, local_alignment_score
+from options import SEARCH_BATCH_SIZE, SEARCH_MAX_LOCAL_CELLS, SEARCH_TOP_K
+from parse_fasta import parse_fasta
+from scoring import default_scheme
+
+
+class SearchHit(NamedTuple):
+    """
+    SearchHit is one of the best matching records of a search: its name and length,
+    the score of its alignment with the query, and the identity of that alignment.
+    The identity of a local alignment is NaN if the record was too long to re-align.
+    """
+
+    name: str
+    length: int
+    score: int
+    identity: float
+
+
+class SearchStatistics(NamedTuple):
+    """
+    SearchStatistics describes a finished search: how many records were read, how
+    many of those were aligned, how many were skipped for having elements outside
+    the query's alphabet, and how long it took.
+    """
+
+    n_records: int
+    n_aligned: int
+    n_invalid: int
+    seconds: float
+
+    def records_per_second(self) -> float:
+        """Returns the number of records searched per second."""
+        return self.n_records / self.seconds if self.seconds > 0 else 0.0
+
+
+worker_state = {}
+
+
+def init_worker(
+    query: str, nucleotides: bool, min_similarity: Optional[float], local: bool
+):
+    """Initializes a worker process with the query to search for."""
+    scheme = default_scheme(nucleotides)
+    worker_state["query"] = query
+    worker_state["scheme"] = scheme
+    worker_state["min_similarity"] = min_similarity
+    worker_state["score_fn"] = local_alignment_score if local else alignment_score
+    if min_similarity is not None:
+        worker_state["profile"] = KmerProfile(
+            query, scheme, default_kmer_size(nucleotides)
+        )
+
+
+def score_batch(
+    records: List[Tuple[str, str]],
+) -> Tuple[List[Tuple[int, str, str]], int]:
+    """
+    Aligns a batch of database records against the query in a worker process, and
+    returns the score, name and sequence of each one, along with the number of
+    records left out for having elements outside the query's alphabet. Records
+    with too few k-mers in common with the query are also left out.
+    """
+    scored = []
+    n_invalid = 0
+    for name, seq in records:
+        try:
+            if worker_state["min_similarity"] is not None:
+                profile = KmerProfile(
+                    seq, worker_state["scheme"], worker_state["profile"].k
+                )
+                if (
+                    worker_state["profile"].similarity(profile)
+                    < worker_state["min_similarity"]
+                ):
+                    continue
+            score = worker_state["score_fn"](
+                seq, worker_state["query"], scheme=worker_state["scheme"]
+            )
+        except ValueError:
+            n_invalid += 1
+            continue
+        scored.append((score, name, seq))
+    return scored, n_invalid
+
+
+def batch_records(
+    records: Iterator[Tuple[str, str]], batch_size: int
+) -> Iterator[List[Tuple[str, str]]]:
+    """Groups records into lists of up to `batch_size` records."""
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def search(
+    query: str,
+    database_filename: str,
+    top_k: int = SEARCH_TOP_K,
+    nucleotides: bool = True,
+    batch_size: int = SEARCH_BATCH_SIZE,
+    workers: Optional[int] = None,
+    min_similarity: Optional[float] = None,
+    local: bool = False,
+    verbose: bool = False,
+) -> Tuple[List[SearchHit], SearchStatistics]:
+    """
+    Aligns `query` against every record of a FASTA database and returns the `top_k`
+    best scoring records, best first, along with statistics about the search.
+
+    Records are read lazily and aligned in batches of `batch_size` on a pool of
+    `workers` processes, which defaults to the number of CPUs. Only a few batches
+    are read ahead of the workers, and only the best `top_k` records are kept in a
+    heap, so memory use doesn't grow with the size of the database. The hits are
+    re-aligned at the end to find their identities, in linear memory for global
+    alignments; local alignments need the full search matrix, so hits whose matrix
+    would have more than `SEARCH_MAX_LOCAL_CELLS` cells have a NaN identity. With a
+    `min_similarity`, records sharing a smaller fraction of k-mers with the query
+    are skipped without being aligned. Records with elements outside the query's
+    alphabet are skipped too, and counted in the statistics with a warning. With
+    `local`, records are scored by their best local alignment with the query
+    instead of a global one, so that records sharing only a domain with it can
+    rank highly.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    heap = []
+    n_records = n_aligned = n_invalid = n_batches = 0
+    start_time = monotonic()
+
+    def collect(n_batch_records: int, result: AsyncResult):
+        nonlocal n_records, n_aligned, n_invalid, n_batches
+        scored, n_batch_invalid = result.get()
+        n_invalid += n_batch_invalid
+        for score, name, seq in scored:
+            n_aligned += 1
+            # Ties are broken by record order, so results don't depend on timing
+            entry = (score, -n_aligned, name, seq)
+            if len(heap) < top_k:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+
+        n_records += n_batch_records
+        n_batches += 1
+        if verbose and n_batches % workers == 0:
+            print(
+                "Searched %d records (%.1f records/s)."
+                % (n_records, n_records / (monotonic() - start_time))
+            )
+
+    with multiprocessing.Pool(
+        workers,
+        initializer=init_worker,
+        initargs=(query, nucleotides, min_similarity, local),
+    ) as pool:
+        pending = deque()
+        for batch in batch_records(parse_fasta(database_filename), batch_size):
+            # Keep a bounded number of batches in flight, collecting them in order
+            if len(pending) >= 2 * workers:
+                collect(*pending.popleft())
+            pending.append((len(batch), pool.apply_async(score_batch, (batch,))))
+        while pending:
+            collect(*pending.popleft())
+
+    hits = []
+    for score, _, name, seq in sorted(heap, reverse=True):
+        # Hits are re-aligned in linear memory, except for local alignments, which
+        # are skipped if their search matrix would be too large
+        if not local:
+            alignment_result = align_linear(seq, query, nucleotides=nucleotides)
+        elif (len(seq) + 1) * (len(query) + 1) <= SEARCH_MAX_LOCAL_CELLS:
+            alignment_result = align_local(seq, query, nucleotides=nucleotides)
+        else:
+            alignment_result = None
+        hits.append(
+            SearchHit(
+                name,
+                len(seq),
+                score,
+                (
+                    float("nan")
+                    if alignment_result is None
+                    else alignment_result.matches()
+                    / max(1, alignment_result.get_alignment_length())
+                ),
+            )
+        )
+
+    statistics = SearchStatistics(
+        n_records, n_aligned, n_invalid, monotonic() - start_time
+    )
+    if n_invalid > 0:
+        warnings.warn(
+            f"skipped {n_invalid} records with elements outside the query's alphabet"
+        )
+    if verbose:
+        print(
+            "Searched %d records (%d aligned, %d invalid) in %.1fs (%.1f records/s)."
+            % (
+                statistics.n_records,
+                statistics.n_aligned,
+                statistics.n_invalid,
+                statistics.seconds,
+                statistics.records_per_second(),
+            )
+        )
+    return hits, statistics
+
+
+def format_hits(hits: List[SearchHit]) -> str:
+    """Formats search hits as a table."""
+    lines = ["rank\tscore\tidentity\tlength\tname"]
+    for rank, hit in enumerate(hits, 1):
+        lines.append(
+            f"{rank}\t{hit.score}\t{hit.identity:.3f}\t{hit.length}\t{hit.name}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description="Search a query sequence against a FASTA database."
+    )
+    parser.add_argument(
+        "database", help="The FASTA file to search, optionally gzipped."
+    )
+    parser.add_argument(
+        "--query",
+        "-q",
+        dest="query",
+        default=get_data(CSTSI),
+        help="The FASTA file whose first record is searched for.",
+    )
+    parser.add_argument("--top", "-k", dest="top_k", type=int, default=SEARCH_TOP_K)
+    parser.add_argument(
+        "--protein", dest="nucleotides", action="store_false", default=True
+    )
+    parser.add_argument(
+        "--batch-size", "-b", dest="batch_size", type=int, default=SEARCH_BATCH_SIZE
+    )
+    parser.add_argument(
+        "--processes",
+        "-p",
+        dest="processes",
+        type=int,
+        default=multiprocessing.cpu_count(),
+    )
+    parser.add_argument(
+        "--min-similarity",
+        "-m",
+        dest="min_similarity",
+        type=float,
+        default=None,
+        help="Skip records sharing less than this fraction of k-mers with the query.",
+    )
+    parser.add_argument(
+        "--local",
+        "-l",
+        dest="local",
+        action="store_true",
+        help="Score records by their best local alignment with the query.",
+    )
+    args = parser.parse_args()
+
+    query = next(parse_fasta(args.query))[1]
+    hits, _ = search(
+        query,
+        args.database,
+        top_k=args.top_k,
+        nucleotides=args.nucleotides,
+        batch_size=args.batch_size,
+        workers=args.processes,
+        min_similarity=args.min_similarity,
+        local=args.local,
+        verbose=True,
+    )
+    print(format_hits(hits))
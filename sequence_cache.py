@@ -0,0 +1,125 @@
+"""
+The `sequence_cache` module caches the sequences in FASTA files in a binary, encoded form,
+so that they don't need to be parsed again by every process that uses them.
+"""
+
+import hashlib
+import json
+import os
+from typing import BinaryIO, Callable, List, Tuple
+
+import numpy as np
+
+from dir_utils import get_cache, make_cache_dir
+from parse_fasta import parse_fasta
+from scoring import SubstitutionScheme
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_digest(filename: str) -> str:
+    """Returns the SHA-256 digest of the contents of the file with the provided filename."""
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_cache_key(filename: str, scheme: SubstitutionScheme) -> str:
+    """Returns the name of the cache entry for a FASTA file encoded with `scheme`."""
+    source = f"{os.path.abspath(filename)}\0{scheme.name}\0{scheme.alphabet}"
+    return hashlib.sha256(source.encode()).hexdigest()[:32]
+
+
+def write_atomically(filename: str, write: Callable[[BinaryIO], None]):
+    """
+    Calls `write` with a temporary file object, then moves it to `filename`, so
+    that other processes never see a partially written file.
+    """
+    temp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(temp_filename, "wb") as f:
+        write(f)
+    os.replace(temp_filename, filename)
+
+
+def build_cache_entry(
+    filename: str, scheme: SubstitutionScheme, key: str, metadata: dict
+):
+    """Parses and encodes a FASTA file and writes its cache entry."""
+    records = list(parse_fasta(filename))
+    codes = [scheme.encode(seq) for _, seq in records]
+    ends = np.cumsum([len(seq_codes) for seq_codes in codes], dtype=np.int64)
+    starts = ends - [len(seq_codes) for seq_codes in codes]
+    metadata["records"] = [
+        [name, int(start), int(end)]
+        for (name, _), start, end in zip(records, starts, ends)
+    ]
+
+    all_codes = np.concatenate(codes) if codes else np.zeros(0, dtype=np.uint8)
+    write_atomically(get_cache(f"{key}.npy"), lambda f: np.save(f, all_codes))
+    write_metadata(key, metadata)
+
+
+def write_metadata(key: str, metadata: dict):
+    """Writes the metadata of a cache entry."""
+    write_atomically(
+        get_cache(f"{key}.json"), lambda f: f.write(json.dumps(metadata).encode())
+    )
+
+
+def read_encoded_fasta(
+    filename: str, scheme: SubstitutionScheme
+) -> List[Tuple[str, np.ndarray]]:
+    """
+    Returns the records of the FASTA file with the provided filename, with each
+    sequence encoded with `scheme`. The first time a file is read, its encoded
+    sequences are cached in the cache directory; after that, the cache is
+    memory-mapped read-only, so processes reading the same file share one copy
+    of it. The cache is keyed by the file's path, and is used as long as the
+    file's modification time and size are unchanged, or its contents hash the
+    same. An entry whose encoded sequences are missing is rebuilt.
+    """
+    make_cache_dir()
+    key = get_cache_key(filename, scheme)
+    stat = os.stat(filename)
+    metadata = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+    try:
+        with open(get_cache(f"{key}.json"), "r") as f:
+            cached_metadata = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        cached_metadata = None
+    if not os.path.exists(get_cache(f"{key}.npy")):
+        # The encoded sequences were removed, so the metadata is no use alone
+        cached_metadata = None
+
+    if cached_metadata is not None and all(
+        cached_metadata.get(field) == value for field, value in metadata.items()
+    ):
+        metadata = cached_metadata
+    else:
+        metadata["sha256"] = file_digest(filename)
+        if cached_metadata is not None and cached_metadata.get("sha256") == (
+            metadata["sha256"]
+        ):
+            # The file was touched, but its contents are the same
+            metadata["records"] = cached_metadata["records"]
+            write_metadata(key, metadata)
+        else:
+            build_cache_entry(filename, scheme, key, metadata)
+
+    all_codes = np.load(get_cache(f"{key}.npy"), mmap_mode="r")
+    return [(name, all_codes[start:end]) for name, start, end in metadata["records"]]
+
+
+def read_first_sequence(
+    filename: str, scheme: SubstitutionScheme
+) -> Tuple[str, np.ndarray]:
+    """
+    Returns the name and encoded sequence of the first record of a FASTA file,
+    read through the sequence cache. The sequence is a read-only view of the
+    memory-mapped cache, so it should be passed to functions that accept
+    encoded sequences, like `align_many`, rather than decoded in every process.
+    """
+    return read_encoded_fasta(filename, scheme)[0]
@@ -1,34 +1,105 @@
 """Entrypoint simulation script."""
 
 import argparse
+import os
 from random import shuffle
-from typing import Callable
+from typing import Callable, List, Tuple, Union
 
-from alignment import align_sequences, AlignmentResult
+import numpy as np
+
+from alignment import align_many, align_sequences, AlignmentResult
+from alignment_cache import align_sequences_cached
 from data_index import CSTSI_PROTEIN, CSGSI_PROTEIN
 from dir_utils import get_data, make_output_dir, get_output
 from monte_carlo import monte_carlo
-from options import CLUSTER_COUNTS
-from parse_fasta import parse_fasta
+from options import CLUSTER_COUNTS, SIMULATION_BATCH_SIZE
+from permutation import PermutationSource
+from scoring import default_scheme
+from sequence_cache import read_first_sequence
+
+
+class ClusteringTrial:
+    """
+    ClusteringTrial specifies a single trial of the clustering simulation,
+    which compares a shuffled CsGSI sequence with CsTSI. Unlike a closure,
+    it can be pickled and sent to worker processes.
+    """
+
+    def __init__(
+        self,
+        cstsi_sequence: Union[str, np.ndarray],
+        csgsi_sequence: Union[str, np.ndarray],
+    ):
+        """
+        Produces a new ClusteringTrial for the provided sequences, which may also
+        be provided encoded with the default protein scheme. They are kept encoded.
+        """
+        self.scheme = default_scheme(nucleotides=False)
+        self.cstsi_codes = self.scheme.encode(cstsi_sequence)
+        self.csgsi_permutations = PermutationSource(csgsi_sequence, self.scheme)
+
+    def shuffled_csgsi(self) -> str:
+        """Returns a randomly shuffled copy of the CsGSI sequence."""
+        rand_seq_list = list(self.scheme.decode(self.csgsi_permutations.codes))
+        shuffle(rand_seq_list)
+        return "".join(rand_seq_list)
+
+    def __call__(self) -> AlignmentResult:
+        """Runs one trial of the simulation."""
+        return align_sequences(
+            self.shuffled_csgsi(),
+            self.scheme.decode(self.cstsi_codes),
+            nucleotides=False,
+        )
+
+    def run_batch(
+        self, n_trials: int, rng: np.random.Generator
+    ) -> List[AlignmentResult]:
+        """
+        Runs `n_trials` trials of the simulation, drawing the shuffled CsGSI
+        sequences from `rng` and aligning them all at once.
+        """
+        rand_seqs = self.csgsi_permutations.batch(n_trials, rng)
+        return align_many(self.cstsi_codes, rand_seqs, nucleotides=False)
+
+
+class ClusteringEffectSize:
+    """
+    ClusteringEffectSize computes the variance between the `cluster_count`
+    chunks of an alignment result. It can be pickled and sent to worker
+    processes.
+    """
+
+    def __init__(self, cluster_count: int):
+        """Produces a new ClusteringEffectSize for `cluster_count` clusters."""
+        self.cluster_count = cluster_count
+
+    def __call__(self, alignment_result: AlignmentResult) -> float:
+        """Returns the effect size for the provided alignment."""
+        return alignment_result.clustered_mismatch_variance(self.cluster_count)
 
 
 def get_clustering_simulation_fn(
-    cstsi_sequence: str, csgsi_sequence: str
+    cstsi_sequence: Union[str, np.ndarray], csgsi_sequence: Union[str, np.ndarray]
 ) -> Callable[[], AlignmentResult]:
     """
     Creates a simulation function to be used in a Monte-Carlo simulation
     that takes a CsTSI and a CsGSI sequence and compares a shuffled
     CsGSI with CsTSI each time it is called.
     """
+    return ClusteringTrial(cstsi_sequence, csgsi_sequence)
 
-    def simulation_fn() -> AlignmentResult:
-        rand_seq_list = list(csgsi_sequence)
-        shuffle(rand_seq_list)
-        rand_seq = "".join(rand_seq_list)
-
-        return align_sequences(rand_seq, cstsi_sequence, nucleotides=False)
 
-    return simulation_fn
+def get_clustering_batch_simulation_fn(
+    cstsi_sequence: Union[str, np.ndarray], csgsi_sequence: Union[str, np.ndarray]
+) -> Callable[[int, np.random.Generator], List[AlignmentResult]]:
+    """
+    Creates a batched simulation function to be used in a Monte-Carlo
+    simulation. Each call takes a number of trials to run and a random
+    number generator, shuffles that many copies of CsGSI, and aligns them
+    all against CsTSI at once.
+    """
+    return ClusteringTrial(cstsi_sequence, csgsi_sequence).run_batch
 
 
 def get_effect_size_fn(cluster_count: int) -> Callable[[AlignmentResult], float]:
@@ -37,11 +108,34 @@ def get_effect_size_fn(cluster_count: int) -> Callable[[AlignmentResult], float]
     The returned function returns the variance between the `cluster_count`
     chunks of the alignment result provided.
     """
+    return ClusteringEffectSize(cluster_count)
 
-    def effect_size_fn(alignment_result: AlignmentResult) -> float:
-        return alignment_result.clustered_mismatch_variance(cluster_count)
 
-    return effect_size_fn
+def get_trial_log_path(simulation_id: str) -> str:
+    """Gets the path of the trial log for the simulation with the provided ID."""
+    return get_output(f"monte_carlo.{simulation_id}.jsonl")
+
+
+def read_sequences() -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reads the CsTSI and CsGSI protein sequences, returning them in that order,
+    encoded with the default protein scheme. They are memory-mapped from the
+    sequence cache, so every process running the simulation shares them.
+    """
+    protein_scheme = default_scheme(nucleotides=False)
+    cstsi_seq = read_first_sequence(get_data(CSTSI_PROTEIN), protein_scheme)[1]
+    csgsi_seq = read_first_sequence(get_data(CSGSI_PROTEIN), protein_scheme)[1]
+    return cstsi_seq, csgsi_seq
+
+
+def align_observed(cstsi_seq: np.ndarray, csgsi_seq: np.ndarray) -> AlignmentResult:
+    """Aligns the encoded CsGSI sequence against CsTSI, through the alignment cache."""
+    protein_scheme = default_scheme(nucleotides=False)
+    return align_sequences_cached(
+        protein_scheme.decode(csgsi_seq),
+        protein_scheme.decode(cstsi_seq),
+        nucleotides=False,
+    )
 
 
 if __name__ == "__main__":
@@ -51,36 +145,68 @@ if __name__ == "__main__":
     )
     parser.add_argument("--id", dest="simulation_id", type=int)
     parser.add_argument("--trials", dest="n_trials", type=int)
+    parser.add_argument(
+        "--alpha",
+        dest="alpha",
+        type=float,
+        default=None,
+        help="Stop early once every p-value is confidently above or below this.",
+    )
+    parser.add_argument(
+        "--resume",
+        dest="resume",
+        action="store_true",
+        help="Resume from the trial log of a previous run with the same ID.",
+    )
+    parser.add_argument("--seed", dest="seed", type=int, default=None)
+    parser.add_argument(
+        "--first-batch",
+        dest="first_batch",
+        type=int,
+        default=0,
+        help="The index of this run's first batch of trials, for seeding.",
+    )
     args = parser.parse_args()
 
     simulation_id = args.simulation_id
     n_trials = args.n_trials
 
-    # Read CsTSI sequence
-    cstsi_seq = list(parse_fasta(get_data(CSTSI_PROTEIN)))[0][1]
+    # Read CsTSI and CsGSI sequences
+    cstsi_seq, csgsi_seq = read_sequences()
 
     # Analyze CsGSI sequence
     print("Analyzing %s..." % CSGSI_PROTEIN)
 
-    csgsi_seq = list(parse_fasta(get_data(CSGSI_PROTEIN)))[0][1]
-    alignment_result = align_sequences(csgsi_seq, cstsi_seq, nucleotides=False)
+    alignment_result = align_observed(cstsi_seq, csgsi_seq)
 
-    for clusters in CLUSTER_COUNTS:
+    observed_effect_sizes = alignment_result.clustered_mismatch_variances(
+        CLUSTER_COUNTS
+    )
+    for clusters, observed_effect_size in zip(CLUSTER_COUNTS, observed_effect_sizes):
         print(
-            f"Variance between clusters ({clusters} clusters): {str(alignment_result.clustered_mismatch_variance(cluster_count=clusters))}"
+            f"Variance between clusters ({clusters} clusters): {str(observed_effect_size)}"
         )
 
-        # Simulate random sequences
-        simulation_result = monte_carlo(
-            get_clustering_simulation_fn(cstsi_seq, csgsi_seq),
-            get_effect_size_fn(cluster_count=clusters),
-            observed_effect_size=alignment_result.clustered_mismatch_variance(
-                cluster_count=clusters
-            ),
-            n_trials=n_trials,
-        )
+    # Simulate random sequences, scoring each one for every cluster count
+    make_output_dir()
+    log_path = get_trial_log_path(str(simulation_id))
+    if not args.resume and os.path.exists(log_path):
+        os.remove(log_path)
+
+    simulation_results = monte_carlo(
+        get_clustering_batch_simulation_fn(cstsi_seq, csgsi_seq),
+        [get_effect_size_fn(cluster_count=clusters) for clusters in CLUSTER_COUNTS],
+        observed_effect_size=observed_effect_sizes,
+        n_trials=n_trials,
+        batch_size=SIMULATION_BATCH_SIZE,
+        alpha=args.alpha,
+        log_path=log_path,
+        seed=args.seed,
+        first_batch=args.first_batch,
+        batched=True,
+    )
 
-        make_output_dir()
+    for clusters, simulation_result in zip(CLUSTER_COUNTS, simulation_results):
         with open(
             get_output(f"monte_carlo_{clusters}.{simulation_id}.json"), "w+"
         ) as f:
@@ -1,28 +1,99 @@
 """Entrypoint simulation orchestration script."""
 
 import argparse
-import json
+import os
 from subprocess import Popen, DEVNULL
+from typing import List, Optional, Tuple
 
-from dir_utils import get_output
-from monte_carlo import MonteCarloSimulationResult
-from options import SIMULATION_COUNT, CLUSTER_COUNTS
+from dir_utils import get_output, make_output_dir
+from distributed import monte_carlo_coordinator, parse_address
+from monte_carlo import (
+    MonteCarloSimulationResult,
+    make_batches,
+    make_results,
+    monte_carlo_parallel,
+)
+from options import (
+    DISTRIBUTED_PORT,
+    SIMULATION_BATCH_SIZE,
+    SIMULATION_COUNT,
+    CLUSTER_COUNTS,
+)
+from simulation import (
+    align_observed,
+    get_clustering_batch_simulation_fn,
+    get_effect_size_fn,
+    get_trial_log_path,
+    read_sequences,
+)
+from trial_log import read_trial_logs
 
+BACKEND_POOL = "pool"
+BACKEND_SUBPROCESS = "subprocess"
+BACKEND_DISTRIBUTED = "distributed"
 
-def orchestrate_simulations(parallelism: int = 1):
+
+def write_aggregated_result(
+    clusters: int, aggregated_result: MonteCarloSimulationResult
+):
+    """Writes the final results for `clusters` clusters to the output directory."""
+    make_output_dir()
+    with open(get_output(f"monte_carlo_{clusters}.agg.txt"), "w+") as f:
+        f.write(aggregated_result.format_result())
+    with open(get_output(f"monte_carlo_{clusters}.agg.json"), "w+") as f:
+        f.write(aggregated_result.to_json())
+
+
+def write_aggregated_results(aggregated_results: List[MonteCarloSimulationResult]):
+    """Writes the final results for every cluster count to the output directory."""
+    for clusters, aggregated_result in zip(CLUSTER_COUNTS, aggregated_results):
+        write_aggregated_result(clusters, aggregated_result)
+
+
+def aggregate_trial_logs(
+    simulation_ids: List[str], alpha: Optional[float] = None
+) -> List[MonteCarloSimulationResult]:
     """
-    Divides the simulations to be done into `parallelism` chunks
-    and runs them as separate Python processes. In general, the
-    processes will be allocated uniformly to machine cores. This
-    then aggregates the chunked simulation results into one final
-    results file, `monte_carlo.agg.txt`. The `multiprocessing`
-    `Pool` was not used here because the work to be allocated was
-    too complicated to split into parts it can pickle.
+    Combines the trial logs of the simulations with the provided IDs,
+    complete or not, into one final results file per cluster count, and
+    returns the results. Only the simulations of a single run should be
+    combined, since the logs of other runs and backends hold trials of
+    their own. If `alpha` is provided, the results carry a confidence
+    interval and stopping reason, like those of the other backends.
     """
+    n_trials, n_successes = read_trial_logs(
+        [get_trial_log_path(simulation_id) for simulation_id in simulation_ids],
+        len(CLUSTER_COUNTS),
+    )
+    if n_trials == 0:
+        raise ValueError("the trial logs do not record any trials")
+
+    aggregated_results = make_results(n_successes, n_trials, True, alpha)
+    write_aggregated_results(aggregated_results)
+    return aggregated_results
+
 
-    if SIMULATION_COUNT % parallelism != 0:
-        print("Simulations cannot be divided evenly into requested instance count!")
-        exit(1)
+def run_subprocess_simulations(
+    parallelism: int,
+    alpha: Optional[float] = None,
+    resume: bool = False,
+    seed: Optional[int] = None,
+) -> List[MonteCarloSimulationResult]:
+    """
+    Divides the batches of simulations to be done into `parallelism`
+    chunks as evenly as possible and runs them as separate
+    `simulation.py` processes, which write their results to the output
+    directory. This then aggregates the trial logs of the chunks. If
+    `alpha` is provided, each process stops early on its own, and if
+    `resume` is set, each process resumes from its trial log.
+    """
+    batches = make_batches(SIMULATION_COUNT, SIMULATION_BATCH_SIZE)
+    chunks = []
+    for i in range(parallelism):
+        start = i * len(batches) // parallelism
+        end = (i + 1) * len(batches) // parallelism
+        if start != end:
+            chunks.append(batches[start:end])
 
     simulations = [
         Popen(
@@ -32,30 +103,149 @@ def orchestrate_simulations(parallelism: int = 1):
                 "--id",
                 str(i),
                 "--trials",
-                str(SIMULATION_COUNT // parallelism),
-            ],
+                str(sum(size for _, size in chunk)),
+                "--first-batch",
+                str(chunk[0][0]),
+            ]
+            + ([] if alpha is None else ["--alpha", str(alpha)])
+            + ([] if seed is None else ["--seed", str(seed)])
+            + (["--resume"] if resume else []),
             stdout=DEVNULL,  # Suppress all console output from the child processes
         )
-        for i in range(parallelism)
+        for i, chunk in enumerate(chunks)
     ]
 
-    for clusters in CLUSTER_COUNTS:
-        n_trials = 0
-        n_successes = 0
-        for i, simulation in enumerate(simulations):
-            simulation.wait()
-            with open(get_output(f"monte_carlo_{clusters}.{i}.json"), "r+") as f:
-                data = json.load(f)
-                n_trials += data["n_trials"]
-                n_successes += data["n_successes"]
+    for simulation in simulations:
+        simulation.wait()
 
-        p_value = n_successes / n_trials
+    return aggregate_trial_logs([str(i) for i in range(len(chunks))], alpha)
 
-        aggregated_result = MonteCarloSimulationResult(p_value, n_trials, n_successes)
-        with open(get_output(f"monte_carlo_{clusters}.agg.txt"), "w+") as f:
-            f.write(aggregated_result.format_result())
-        with open(get_output(f"monte_carlo_{clusters}.agg.json"), "w+") as f:
-            f.write(aggregated_result.to_json())
+
+def prepare_simulations(backend: str, resume: bool):
+    """
+    Reads the sequences and prepares the trial log for an in-process
+    simulation backend. Returns the simulation function, effect size
+    functions, observed effect sizes and trial log path.
+    """
+    make_output_dir()
+    log_path = get_trial_log_path(backend)
+    if not resume and os.path.exists(log_path):
+        os.remove(log_path)
+
+    cstsi_seq, csgsi_seq = read_sequences()
+    alignment_result = align_observed(cstsi_seq, csgsi_seq)
+
+    return (
+        get_clustering_batch_simulation_fn(cstsi_seq, csgsi_seq),
+        [get_effect_size_fn(cluster_count=clusters) for clusters in CLUSTER_COUNTS],
+        alignment_result.clustered_mismatch_variances(CLUSTER_COUNTS),
+        log_path,
+    )
+
+
+def run_pool_simulations(
+    parallelism: int,
+    alpha: Optional[float] = None,
+    resume: bool = False,
+    seed: Optional[int] = None,
+) -> List[MonteCarloSimulationResult]:
+    """
+    Runs the simulations on `parallelism` worker processes with
+    `monte_carlo_parallel`. The sequences are only read and sent
+    to the workers once, each simulated alignment is scored for every
+    cluster count, and the results are merged in memory. If `alpha` is
+    provided, the simulations stop once every p-value is confidently
+    above or below it. Completed trials are logged as they finish,
+    and if `resume` is set, the simulations resume from that log.
+    """
+    simulation_fn, effect_size_fns, observed_effect_sizes, log_path = (
+        prepare_simulations(BACKEND_POOL, resume)
+    )
+    aggregated_results = monte_carlo_parallel(
+        simulation_fn,
+        effect_size_fns,
+        observed_effect_size=observed_effect_sizes,
+        n_trials=SIMULATION_COUNT,
+        workers=parallelism,
+        batch_size=SIMULATION_BATCH_SIZE,
+        verbose=True,
+        alpha=alpha,
+        log_path=log_path,
+        seed=seed,
+        batched=True,
+    )
+    write_aggregated_results(aggregated_results)
+    return aggregated_results
+
+
+def run_distributed_simulations(
+    address: Tuple[str, int],
+    authkey: bytes,
+    alpha: Optional[float] = None,
+    resume: bool = False,
+    seed: Optional[int] = None,
+) -> List[MonteCarloSimulationResult]:
+    """
+    Serves the simulations at `address` with `monte_carlo_coordinator`,
+    for workers started with `distributed.py` on any number of hosts
+    to run. Otherwise, this behaves like `run_pool_simulations`.
+    """
+    simulation_fn, effect_size_fns, observed_effect_sizes, log_path = (
+        prepare_simulations(BACKEND_DISTRIBUTED, resume)
+    )
+    aggregated_results = monte_carlo_coordinator(
+        simulation_fn,
+        effect_size_fns,
+        observed_effect_size=observed_effect_sizes,
+        n_trials=SIMULATION_COUNT,
+        address=address,
+        authkey=authkey,
+        batch_size=SIMULATION_BATCH_SIZE,
+        verbose=True,
+        alpha=alpha,
+        log_path=log_path,
+        seed=seed,
+        batched=True,
+    )
+    write_aggregated_results(aggregated_results)
+    return aggregated_results
+
+
+def orchestrate_simulations(
+    parallelism: Optional[int] = None,
+    backend: str = BACKEND_POOL,
+    alpha: Optional[float] = None,
+    resume: bool = False,
+    seed: Optional[int] = None,
+    address: Tuple[str, int] = ("", DISTRIBUTED_PORT),
+    authkey: Optional[bytes] = None,
+) -> List[MonteCarloSimulationResult]:
+    """
+    Runs the simulations on `parallelism` processes, which defaults
+    to the number of CPUs, and aggregates the results into one final
+    results file per cluster count, `monte_carlo_{clusters}.agg.txt`,
+    along with a JSON copy. The results are also returned, in the
+    same form for every backend. The `"pool"` backend hands out small
+    batches of trials to worker processes as they become free, while
+    the `"subprocess"` backend runs `simulation.py` instances and
+    combines their output files. The `"distributed"` backend serves
+    the trials at `address` to workers on other hosts, authenticated
+    with `authkey`, and ignores `parallelism`.
+    `alpha` enables early stopping, with `SIMULATION_COUNT` trials
+    as the upper limit, and `resume` continues an interrupted run
+    from its trial logs. With a `seed`, every backend gives the same
+    result, unless the simulations stop early.
+    """
+    parallelism = parallelism or os.cpu_count()
+    if backend == BACKEND_POOL:
+        return run_pool_simulations(parallelism, alpha, resume, seed)
+    if backend == BACKEND_SUBPROCESS:
+        return run_subprocess_simulations(parallelism, alpha, resume, seed)
+    if backend == BACKEND_DISTRIBUTED:
+        if authkey is None:
+            raise ValueError("the distributed backend requires an authkey")
+        return run_distributed_simulations(address, authkey, alpha, resume, seed)
+    raise ValueError(f"unknown simulation backend: {backend}")
 
 
 if __name__ == "__main__":
@@ -64,11 +254,62 @@ if __name__ == "__main__":
         description="Run a Monte-Carlo simulation for CsTSI and CsGSI alignment."
     )
     parser.add_argument("--instances", "-i", dest="instances", type=int)
+    parser.add_argument(
+        "--backend",
+        "-b",
+        dest="backend",
+        choices=[BACKEND_POOL, BACKEND_SUBPROCESS, BACKEND_DISTRIBUTED],
+        default=BACKEND_POOL,
+    )
+    parser.add_argument(
+        "--alpha",
+        "-a",
+        dest="alpha",
+        type=float,
+        default=None,
+        help="Stop early once every p-value is confidently above or below this.",
+    )
+    parser.add_argument(
+        "--resume",
+        dest="resume",
+        action="store_true",
+        help="Resume an interrupted run from its trial logs.",
+    )
+    parser.add_argument("--seed", "-s", dest="seed", type=int, default=None)
+    parser.add_argument(
+        "--address",
+        dest="address",
+        default=f":{DISTRIBUTED_PORT}",
+        help="The host:port to serve the distributed backend at.",
+    )
+    parser.add_argument(
+        "--authkey",
+        "-k",
+        dest="authkey",
+        default=None,
+        help="The shared secret distributed workers must connect with.",
+    )
+    parser.add_argument(
+        "--aggregate-logs",
+        dest="aggregate_logs",
+        nargs="+",
+        metavar="ID",
+        default=None,
+        help="Only combine the trial logs of these simulations, such as one backend's, into the final results.",
+    )
     args = parser.parse_args()
 
     instances = args.instances
 
-    # multiprocessing.cpu_count() can also be used, but there
-    # are no guarantees that the CPU count will evenly divide
-    # the number of trials.
-    orchestrate_simulations(parallelism=instances)
+    if args.aggregate_logs is not None:
+        aggregate_trial_logs(args.aggregate_logs, alpha=args.alpha)
+    else:
+        orchestrate_simulations(
+            parallelism=instances,
+            backend=args.backend,
+            alpha=args.alpha,
+            resume=args.resume,
+            seed=args.seed,
+            address=parse_address(args.address),
+            authkey=None if args.authkey is None else args.authkey.encode(),
+        )
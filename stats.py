@@ -1,5 +1,8 @@
 """The `stats` module exposes statistical functions used in this project."""
 
+from statistics import NormalDist
+from typing import Tuple
+
 import numpy as np
 
 
@@ -12,3 +15,27 @@ def variance(data: np.ndarray, sample: bool = True) -> np.float64:
     numerator = np.sum(np.sum(np.square(data)) - np.square(np.sum(data)) / data.size)
     denominator = data.size - 1 if sample else data.size  # if population
     return numerator / denominator
+
+
+def wilson_interval(
+    successes: np.ndarray, trials: int, confidence: float = 0.95
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculates the Wilson score interval for the proportion of successes
+    out of `trials` Bernoulli trials, at the provided two-sided `confidence`
+    level. `successes` may be an array, in which case one interval is
+    calculated per element. Returns a tuple of the lower and upper bounds.
+    """
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+    proportion = np.asarray(successes) / trials
+    denominator = 1 + z**2 / trials
+    center = (proportion + z**2 / (2 * trials)) / denominator
+    margin = (
+        z
+        * np.sqrt(proportion * (1 - proportion) / trials + z**2 / (4 * trials**2))
+        / denominator
+    )
+    # The bounds are exact at the extremes, but rounding can move them slightly
+    lower = np.where(proportion == 0, 0.0, np.maximum(center - margin, 0))
+    upper = np.where(proportion == 1, 1.0, np.minimum(center + margin, 1))
+    return lower, upper
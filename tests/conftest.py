@@ -0,0 +1,27 @@
+"""
+Configures the tests. The modules under test live in the root of the repository,
+so it is put on the import path.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(params=[True, False], ids=["nucleotides", "protein"])
+def nucleotides(request) -> bool:
+    """Runs a test with both the nucleotide and the protein default schemes."""
+    return request.param
+
+
+@pytest.fixture
+def work_dir(tmp_path, monkeypatch):
+    """
+    Runs a test in an empty temporary directory, so that the `./data`, `./output`
+    and `./cache` directories it uses are its own.
+    """
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,96 @@
+"""
+The `helpers` module generates random inputs for the tests, and scores alignments
+independently of the alignment engines.
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+from scoring import NUCLEOTIDE_ALPHABET, SubstitutionScheme
+
+# Elements drawn for random protein sequences
+PROTEIN_ELEMENTS = "ACDEFGHIKLMNPQRSTVWY"
+
+
+def random_sequence(rng: np.random.Generator, length: int, nucleotides: bool) -> str:
+    """Returns a random sequence of `length` nucleotides or amino acids."""
+    elements = NUCLEOTIDE_ALPHABET if nucleotides else PROTEIN_ELEMENTS
+    return "".join(rng.choice(list(elements), size=length))
+
+
+def mutate(rng: np.random.Generator, seq: str, rate: float, nucleotides: bool) -> str:
+    """
+    Returns a copy of `seq` in which each element is substituted, deleted or
+    followed by an insertion with probability `rate`.
+    """
+    mutated = []
+    for c in seq:
+        event = rng.random()
+        if event < rate / 3:
+            mutated.append(random_sequence(rng, 1, nucleotides))
+        elif event < 2 * rate / 3:
+            continue
+        elif event < rate:
+            mutated.append(c + random_sequence(rng, 1, nucleotides))
+        else:
+            mutated.append(c)
+    return "".join(mutated)
+
+
+def random_pair(
+    rng: np.random.Generator, nucleotides: bool, max_length: int = 40
+) -> Tuple[str, str]:
+    """
+    Returns a pair of non-empty sequences of less than `max_length` elements, which
+    are either unrelated or the second is a mutated copy of the first.
+    """
+    top_seq = random_sequence(rng, int(rng.integers(1, max_length)), nucleotides)
+    if rng.random() < 0.3:
+        left_seq = random_sequence(rng, int(rng.integers(1, max_length)), nucleotides)
+    else:
+        left_seq = mutate(rng, top_seq, float(rng.uniform(0, 0.4)), nucleotides)
+    return top_seq, left_seq or random_sequence(rng, 1, nucleotides)
+
+
+def score_alignment(
+    alignment_1: str, alignment_2: str, scheme: SubstitutionScheme
+) -> int:
+    """
+    Scores a global alignment of a top sequence, `alignment_1`, against a left
+    sequence, `alignment_2`, column by column. As in the search matrix, an indel is
+    penalized according to the elements preceding it in both sequences, with the
+    gap row and column standing in before the first element.
+    """
+    border = len(scheme.alphabet)
+    top = np.insert(scheme.encode(alignment_1.replace("-", "")), 0, border)
+    left = np.insert(scheme.encode(alignment_2.replace("-", "")), 0, border)
+
+    score = x = y = 0
+    for top_char, left_char in zip(alignment_1, alignment_2):
+        y += top_char != "-"
+        x += left_char != "-"
+        if top_char != "-" and left_char != "-":
+            score += scheme.scores[top[y], left[x]]
+        else:
+            score -= scheme.gap_penalties[top[y], left[x]]
+    return int(score)
+
+
+def smith_waterman_scores(
+    top_seq: str, left_seq: str, scheme: SubstitutionScheme
+) -> np.ndarray:
+    """Fills the Smith-Waterman search matrix one cell at a time."""
+    top = scheme.encode(top_seq)
+    left = scheme.encode(left_seq)
+    search = np.zeros((len(left) + 1, len(top) + 1), dtype=np.int64)
+    for x in range(1, len(left) + 1):
+        for y in range(1, len(top) + 1):
+            gap_cost = scheme.gap_penalties[top[y - 1], left[x - 1]]
+            search[x, y] = max(
+                0,
+                search[x - 1, y - 1] + scheme.scores[top[y - 1], left[x - 1]],
+                search[x - 1, y] - gap_cost,
+                search[x, y - 1] - gap_cost,
+            )
+    return search
@@ -0,0 +1,210 @@
+"""Tests that every global alignment engine agrees with the reference engine."""
+
+import numpy as np
+import pytest
+
+from alignment import (
+    METHOD_BANDED,
+    METHOD_LINEAR,
+    METHOD_REFERENCE,
+    AlignmentResult,
+    align_banded,
+    align_linear,
+    align_many,
+    align_sequences,
+    alignment_score,
+    fill_reference,
+    unwind,
+)
+from helpers import mutate, random_pair, random_sequence, score_alignment
+from kmers import align_seeded
+from scoring import default_scheme
+
+N_PAIRS = 60
+
+
+def reference_alignment(top_seq: str, left_seq: str, nucleotides: bool):
+    """Aligns the sequences with the cell-by-cell reference engine."""
+    return unwind(fill_reference(top_seq, left_seq, nucleotides), top_seq, left_seq)
+
+
+def assert_same_alignment(result: AlignmentResult, expected: AlignmentResult):
+    """Asserts that two alignment results are identical."""
+    assert result.get_alignment_1() == expected.get_alignment_1()
+    assert result.get_alignment_2() == expected.get_alignment_2()
+
+
+def test_wavefront_matches_reference(nucleotides):
+    rng = np.random.default_rng(1)
+    for _ in range(N_PAIRS):
+        top_seq, left_seq = random_pair(rng, nucleotides)
+        assert_same_alignment(
+            align_sequences(top_seq, left_seq, nucleotides),
+            reference_alignment(top_seq, left_seq, nucleotides),
+        )
+
+
+def test_reference_method_matches_reference(nucleotides):
+    rng = np.random.default_rng(2)
+    for _ in range(10):
+        top_seq, left_seq = random_pair(rng, nucleotides)
+        assert_same_alignment(
+            align_sequences(top_seq, left_seq, nucleotides, method=METHOD_REFERENCE),
+            reference_alignment(top_seq, left_seq, nucleotides),
+        )
+
+
+def test_alignment_score_matches_reference(nucleotides):
+    rng = np.random.default_rng(3)
+    for _ in range(N_PAIRS):
+        top_seq, left_seq = random_pair(rng, nucleotides)
+        search = fill_reference(top_seq, left_seq, nucleotides)
+        assert alignment_score(top_seq, left_seq, nucleotides) == search[-1, -1]
+
+
+def test_linear_alignment_is_optimal(nucleotides):
+    rng = np.random.default_rng(4)
+    scheme = default_scheme(nucleotides)
+    for _ in range(N_PAIRS):
+        top_seq, left_seq = random_pair(rng, nucleotides)
+        result = align_linear(top_seq, left_seq, nucleotides)
+        assert result.get_alignment_1().replace("-", "") == top_seq
+        assert result.get_alignment_2().replace("-", "") == left_seq
+        assert score_alignment(
+            result.get_alignment_1(), result.get_alignment_2(), scheme
+        ) == alignment_score(top_seq, left_seq, nucleotides)
+
+
+def test_linear_alignment_of_long_sequences_is_optimal():
+    rng = np.random.default_rng(5)
+    scheme = default_scheme(nucleotides=True)
+    top_seq = random_sequence(rng, 400, nucleotides=True)
+    left_seq = mutate(rng, top_seq, 0.2, nucleotides=True)
+    result = align_sequences(top_seq, left_seq, method=METHOD_LINEAR)
+    assert score_alignment(
+        result.get_alignment_1(), result.get_alignment_2(), scheme
+    ) == alignment_score(top_seq, left_seq)
+
+
+@pytest.mark.parametrize("method", ["wavefront", "banded"])
+def test_align_many_matches_align_sequences(nucleotides, method):
+    rng = np.random.default_rng(10)
+    scheme = default_scheme(nucleotides)
+    query = random_sequence(rng, 30, nucleotides)
+    targets = [mutate(rng, query, 0.3, nucleotides)[:25] for _ in range(8)]
+    targets = [target.ljust(25, query[0]) for target in targets]
+
+    expected = [
+        align_sequences(target, query, nucleotides, method=method) for target in targets
+    ]
+    results = align_many(query, targets, nucleotides, method=method)
+    encoded_results = align_many(
+        scheme.encode(query),
+        np.stack([scheme.encode(target) for target in targets]),
+        nucleotides,
+        method=method,
+    )
+    for result, encoded_result, expected_result in zip(
+        results, encoded_results, expected
+    ):
+        assert_same_alignment(result, expected_result)
+        assert_same_alignment(encoded_result, expected_result)
+
+
+def test_align_many_rejects_differing_lengths():
+    with pytest.raises(ValueError):
+        align_many("ACGT", ["ACG", "ACGT"])
+
+
+@pytest.mark.parametrize("bandwidth", [0, 1, 2, 5, None])
+def test_banded_matches_full(nucleotides, bandwidth):
+    rng = np.random.default_rng(6)
+    for _ in range(N_PAIRS):
+        top_seq, left_seq = random_pair(rng, nucleotides)
+        assert_same_alignment(
+            align_banded(top_seq, left_seq, nucleotides, bandwidth=bandwidth),
+            align_sequences(top_seq, left_seq, nucleotides),
+        )
+
+
+def test_banded_with_diagonals_matches_full(nucleotides):
+    rng = np.random.default_rng(7)
+    for _ in range(N_PAIRS):
+        top_seq, left_seq = random_pair(rng, nucleotides)
+        corner = len(top_seq) - len(left_seq)
+        lo = min(0, corner) - int(rng.integers(0, 3))
+        hi = max(0, corner) + int(rng.integers(0, 3))
+        assert_same_alignment(
+            align_banded(top_seq, left_seq, nucleotides, diagonals=(lo, hi)),
+            align_sequences(top_seq, left_seq, nucleotides),
+        )
+
+
+def test_banded_rejects_band_without_corners():
+    with pytest.raises(ValueError):
+        align_banded("ACGTACGT", "ACGT", diagonals=(0, 2))
+
+
+def test_banded_method_matches_full_for_long_sequences():
+    rng = np.random.default_rng(8)
+    for rate in [0.05, 0.5]:
+        top_seq = random_sequence(rng, 300, nucleotides=False)
+        left_seq = mutate(rng, top_seq, rate, nucleotides=False)
+        assert_same_alignment(
+            align_sequences(top_seq, left_seq, False, method=METHOD_BANDED),
+            align_sequences(top_seq, left_seq, False),
+        )
+
+
+def test_seeded_matches_full(nucleotides):
+    rng = np.random.default_rng(9)
+    for _ in range(N_PAIRS):
+        top_seq, left_seq = random_pair(rng, nucleotides, max_length=80)
+        assert_same_alignment(
+            align_seeded(top_seq, left_seq, nucleotides, padding=1),
+            align_sequences(top_seq, left_seq, nucleotides),
+        )
+
+
+def test_x_drop_alignment_covers_both_sequences():
+    rng = np.random.default_rng(9)
+    for _ in range(N_PAIRS):
+        top_seq, left_seq = random_pair(rng, nucleotides=True)
+        result = align_banded(top_seq, left_seq, bandwidth=3, x_drop=5)
+        assert result.get_alignment_1().replace("-", "") == top_seq
+        assert result.get_alignment_2().replace("-", "") == left_seq
+
+
+def test_clustered_mismatch_variances_match_single_counts(nucleotides):
+    rng = np.random.default_rng(11)
+    for _ in range(20):
+        top_seq, left_seq = random_pair(rng, nucleotides, max_length=80)
+        result = align_sequences(top_seq, left_seq, nucleotides)
+        counts = list(range(1, result.get_alignment_length() + 1))
+        assert result.clustered_mismatch_variances(counts) == [
+            result.clustered_mismatch_variance(count) for count in counts
+        ]
+
+
+def test_clustered_mismatch_variances_reject_invalid_counts():
+    result = AlignmentResult("ACGT", "AGGT")
+    with pytest.raises(ValueError):
+        result.clustered_mismatch_variances([0])
+    with pytest.raises(ValueError):
+        result.clustered_mismatch_variances([5])
+
+
+def test_mismatch_density_matches_naive_windows():
+    result = AlignmentResult("ACGTACGTAC", "AGGTA-GTCC")
+    match_string = result.get_match_string()
+    for window_size, step in [(1, 1), (3, 2), (10, 1)]:
+        starts, density = result.mismatch_density(window_size, step)
+        expected = [
+            sum(c != "|" for c in match_string[start : start + window_size])
+            / window_size
+            for start in range(0, len(match_string) - window_size + 1, step)
+        ]
+        assert density.tolist() == pytest.approx(expected)
+        assert starts.tolist() == list(
+            range(0, len(match_string) - window_size + 1, step)
+        )
@@ -0,0 +1,149 @@
+"""Tests that alignments are cached in memory and on disk, and evicted in LRU order."""
+
+import os
+from collections import OrderedDict
+
+import pytest
+
+import alignment_cache
+from alignment import METHOD_LINEAR, METHOD_WAVEFRONT, AlignmentResult, align_sequences
+from alignment_cache import (
+    align_sequences_cached,
+    evict_alignments,
+    get_alignment_cache,
+    get_alignment_key,
+    read_cached_alignment,
+    remember_alignment,
+    write_cached_alignment,
+)
+from scoring import NUCLEOTIDE_SCHEME, SubstitutionScheme
+
+TOP_SEQ = "ACGTTGACCA"
+LEFT_SEQ = "ACGTGACGCA"
+
+
+@pytest.fixture
+def cache(work_dir, monkeypatch):
+    """
+    Runs a test with an empty in-memory cache, and counts the alignments computed
+    by `align_sequences_cached`.
+    """
+    monkeypatch.setattr(alignment_cache, "memory_cache", OrderedDict())
+    aligned = []
+
+    def counting_align(*args, **kwargs):
+        aligned.append(args[:2])
+        return align_sequences(*args, **kwargs)
+
+    monkeypatch.setattr(alignment_cache, "align_sequences", counting_align)
+    return aligned
+
+
+def make_entry(key: str, mtime: int):
+    """Writes an on-disk cache entry with the provided modification time."""
+    write_cached_alignment(key, AlignmentResult("ACGT", "AC-T"), max_bytes=1 << 20)
+    os.utime(get_alignment_cache(f"{key}.json"), (mtime, mtime))
+
+
+def test_cached_alignment_matches_uncached(cache):
+    expected = align_sequences(TOP_SEQ, LEFT_SEQ)
+    result = align_sequences_cached(TOP_SEQ, LEFT_SEQ)
+    assert result.get_alignment_1() == expected.get_alignment_1()
+    assert result.get_alignment_2() == expected.get_alignment_2()
+
+    assert align_sequences_cached(TOP_SEQ, LEFT_SEQ) is result
+    alignment_cache.memory_cache.clear()
+    from_disk = align_sequences_cached(TOP_SEQ, LEFT_SEQ)
+    assert from_disk.get_alignment_1() == expected.get_alignment_1()
+    assert cache == [(TOP_SEQ, LEFT_SEQ)]
+
+
+def test_memory_cache_forgets_least_recently_used(cache, monkeypatch):
+    monkeypatch.setattr(alignment_cache, "ALIGNMENT_CACHE_ENTRIES", 2)
+    results = {key: AlignmentResult(key, key) for key in "abc"}
+    remember_alignment("a", results["a"])
+    remember_alignment("b", results["b"])
+    remember_alignment("a", results["a"])
+    remember_alignment("c", results["c"])
+    assert list(alignment_cache.memory_cache) == ["a", "c"]
+
+
+def test_disk_cache_evicts_least_recently_used(cache):
+    os.makedirs(get_alignment_cache(""), exist_ok=True)
+    for i, key in enumerate(["old", "middle", "new"]):
+        make_entry(key, 1000 + i)
+    entry_bytes = os.path.getsize(get_alignment_cache("old.json"))
+
+    # Reading an entry makes it the most recently used
+    assert read_cached_alignment("old") is not None
+    evict_alignments(2 * entry_bytes)
+    assert read_cached_alignment("middle") is None
+    assert read_cached_alignment("old") is not None
+    assert read_cached_alignment("new") is not None
+
+    evict_alignments(0)
+    assert not [name for name in os.listdir(get_alignment_cache("")) if ".json" in name]
+
+
+def test_disk_cache_stays_within_max_bytes(cache):
+    align_sequences_cached(TOP_SEQ, LEFT_SEQ)
+    max_bytes = 2 * os.path.getsize(
+        get_alignment_cache(
+            f"{get_alignment_key(TOP_SEQ, LEFT_SEQ, True, METHOD_WAVEFRONT, None)}.json"
+        )
+    )
+    for i in range(1, 5):
+        left_seq = LEFT_SEQ[i:] + "A" * i
+        align_sequences_cached(TOP_SEQ, left_seq, max_bytes=max_bytes)
+
+    sizes = [
+        entry.stat().st_size
+        for entry in os.scandir(get_alignment_cache(""))
+        if entry.name.endswith(".json")
+    ]
+    assert 0 < len(sizes) < 5
+    assert sum(sizes) <= max_bytes
+    key = get_alignment_key(TOP_SEQ, left_seq, True, METHOD_WAVEFRONT, None)
+    assert read_cached_alignment(key) is not None
+
+
+def test_keys_separate_parameters():
+    scores = NUCLEOTIDE_SCHEME.scores.copy()
+    scores[0, 1] = 0
+    rescored = SubstitutionScheme(
+        NUCLEOTIDE_SCHEME.name,
+        NUCLEOTIDE_SCHEME.alphabet,
+        scores,
+        NUCLEOTIDE_SCHEME.gap_penalty,
+    )
+    uniform_gaps = SubstitutionScheme(
+        NUCLEOTIDE_SCHEME.name,
+        NUCLEOTIDE_SCHEME.alphabet,
+        NUCLEOTIDE_SCHEME.scores,
+        NUCLEOTIDE_SCHEME.gap_penalty,
+    )
+
+    keys = [
+        get_alignment_key(TOP_SEQ, LEFT_SEQ, True, METHOD_WAVEFRONT, None),
+        get_alignment_key(LEFT_SEQ, TOP_SEQ, True, METHOD_WAVEFRONT, None),
+        get_alignment_key(TOP_SEQ, LEFT_SEQ, False, METHOD_WAVEFRONT, None),
+        get_alignment_key(TOP_SEQ, LEFT_SEQ, True, METHOD_LINEAR, None),
+        get_alignment_key(TOP_SEQ, LEFT_SEQ, True, METHOD_WAVEFRONT, rescored),
+        get_alignment_key(TOP_SEQ, LEFT_SEQ, True, METHOD_WAVEFRONT, uniform_gaps),
+    ]
+    assert len(set(keys)) == len(keys)
+    assert keys[0] == get_alignment_key(
+        TOP_SEQ, LEFT_SEQ, True, METHOD_WAVEFRONT, NUCLEOTIDE_SCHEME
+    )
+
+
+def test_cache_works_without_fcntl(cache, monkeypatch):
+    monkeypatch.setattr(alignment_cache, "fcntl", None)
+    expected = align_sequences(TOP_SEQ, LEFT_SEQ)
+    result = align_sequences_cached(TOP_SEQ, LEFT_SEQ)
+    assert result.get_alignment_1() == expected.get_alignment_1()
+    assert os.path.exists(
+        get_alignment_cache(
+            f"{get_alignment_key(TOP_SEQ, LEFT_SEQ, True, METHOD_WAVEFRONT, None)}.json"
+        )
+    )
@@ -0,0 +1,151 @@
+"""Tests the distributed coordinator, its work queue, and local workers."""
+
+import socket
+import threading
+import time
+from typing import List
+
+import numpy as np
+import pytest
+
+from distributed import WorkQueue, monte_carlo_coordinator, run_workers
+from monte_carlo import monte_carlo
+
+AUTHKEY = b"test"
+
+
+def draw_uniform(n_trials: int, rng: np.random.Generator) -> List[float]:
+    """Simulates a batch of trials, each drawing a uniform random number."""
+    return rng.random(n_trials).tolist()
+
+
+def identity(value: float) -> float:
+    """Uses the drawn number itself as the effect size."""
+    return value
+
+
+def shifted(value: float) -> float:
+    """Uses the drawn number plus one as the effect size."""
+    return value + 1
+
+
+def free_port() -> int:
+    """Returns a port on localhost that nothing is listening on."""
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int):
+    """Waits until something listens on `port` on localhost."""
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(("localhost", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def test_work_queue_leases_batches():
+    work_queue = WorkQueue(("spec",), [(0, 5), (1, 5)], lease_time=60)
+    assert work_queue.get_spec() == ("spec",)
+    assert work_queue.claim("a") == (0, 5)
+    assert work_queue.claim("b") == (1, 5)
+
+    work_queue.complete("a", 0, [1])
+    work_queue.complete("b", 1, [2])
+    # A batch completed twice is only counted once
+    work_queue.complete("b", 1, [2])
+    assert work_queue.claim("a") is None
+    assert [work_queue.results.get_nowait() for _ in range(2)] == [
+        ("a", (0, 5), [1]),
+        ("b", (1, 5), [2]),
+    ]
+    assert work_queue.results.empty()
+
+
+def test_work_queue_hands_out_expired_leases_again():
+    work_queue = WorkQueue(("spec",), [(0, 5)], lease_time=0.1)
+    assert work_queue.claim("a") == (0, 5)
+    time.sleep(0.2)
+    assert work_queue.claim("b") == (0, 5)
+
+    work_queue.complete("b", 0, [3])
+    work_queue.complete("a", 0, [4])
+    assert work_queue.results.get_nowait() == ("b", (0, 5), [3])
+    assert work_queue.results.empty()
+
+
+def test_work_queue_stops_handing_out_batches():
+    work_queue = WorkQueue(("spec",), [(0, 5)], lease_time=60)
+    work_queue.stop()
+    assert work_queue.claim("a") is None
+
+
+def test_work_queue_is_idle_without_activity():
+    work_queue = WorkQueue(("spec",), [(0, 5)], lease_time=60)
+    assert not work_queue.is_idle(0.1)
+    time.sleep(0.2)
+    assert work_queue.is_idle(0.1)
+    work_queue.claim("a")
+    time.sleep(0.2)
+    # The batch is still leased, so its worker may still be running it
+    assert not work_queue.is_idle(0.1)
+
+
+def test_coordinator_gives_up_without_workers():
+    with pytest.raises(RuntimeError, match="no workers"):
+        monte_carlo_coordinator(
+            draw_uniform,
+            identity,
+            observed_effect_size=0.5,
+            n_trials=10,
+            address=("localhost", free_port()),
+            authkey=AUTHKEY,
+            batch_size=5,
+            idle_timeout=0.5,
+            batched=True,
+        )
+
+
+def test_coordinator_matches_single_node_run():
+    address = ("localhost", free_port())
+    workers = threading.Thread(
+        target=lambda: (
+            wait_for_port(address[1]),
+            run_workers(address, AUTHKEY, 3, "local"),
+        )
+    )
+    workers.start()
+
+    results = monte_carlo_coordinator(
+        draw_uniform,
+        [identity, shifted],
+        observed_effect_size=[0.5, 1.25],
+        n_trials=103,
+        address=address,
+        authkey=AUTHKEY,
+        batch_size=4,
+        seed=7,
+        idle_timeout=30,
+        batched=True,
+    )
+    # The workers must exit once the coordinator has stopped
+    workers.join(timeout=30)
+    assert not workers.is_alive()
+
+    expected = monte_carlo(
+        draw_uniform,
+        [identity, shifted],
+        observed_effect_size=[0.5, 1.25],
+        n_trials=103,
+        batch_size=4,
+        seed=7,
+        batched=True,
+    )
+    for result, expected_result in zip(results, expected):
+        assert result.get_trial_count() == expected_result.get_trial_count() == 103
+        assert result.get_success_count() == expected_result.get_success_count()
@@ -0,0 +1,87 @@
+"""Tests that the vectorized dN/dS engine agrees with the `dnds` package."""
+
+import numpy as np
+import pytest
+
+from dnds_engine import bootstrap_dnds_bands, sliding_window_dnds
+from helpers import random_sequence
+
+dnds = pytest.importorskip("dnds")
+
+
+def mutate_bases(rng: np.random.Generator, seq: str, n_mutations: int) -> str:
+    """Returns a copy of `seq` with `n_mutations` random positions substituted."""
+    mutated = list(seq)
+    for i in rng.choice(len(seq), size=n_mutations, replace=False):
+        mutated[i] = random_sequence(rng, 1, nucleotides=True)
+    return "".join(mutated)
+
+
+@pytest.mark.parametrize("window_size,step", [(30, 3), (60, 1), (90, 6)])
+def test_sliding_window_dnds_matches_dnds_package(window_size, step):
+    rng = np.random.default_rng(window_size + step)
+    seq_1 = random_sequence(rng, 300, nucleotides=True)
+    seq_2 = mutate_bases(rng, seq_1, 40)
+
+    starts, ratios = sliding_window_dnds(seq_1, seq_2, window_size, step)
+    assert starts.tolist() == list(range(0, len(seq_1) - window_size + 1, step))
+
+    n_defined = 0
+    for start, ratio in zip(starts, ratios):
+        try:
+            expected = dnds.dnds(
+                seq_1[start : start + window_size], seq_2[start : start + window_size]
+            )
+        except (ValueError, ZeroDivisionError):
+            assert np.isnan(ratio)
+            continue
+        if np.isnan(ratio):
+            continue
+        n_defined += 1
+        assert ratio == pytest.approx(expected)
+    assert n_defined > 0
+
+
+def test_sliding_window_dnds_rejects_invalid_windows():
+    with pytest.raises(ValueError):
+        sliding_window_dnds("ACGTAC", "ACGTA", 3)
+    with pytest.raises(ValueError):
+        sliding_window_dnds("ACGTAC", "ACGTAC", 4)
+
+
+def bootstrap_fixture():
+    """Returns a pair of coding sequences whose first windows are identical."""
+    rng = np.random.default_rng(11)
+    seq_1 = random_sequence(rng, 360, nucleotides=True)
+    seq_2 = seq_1[:90] + mutate_bases(rng, seq_1[90:], 50)
+    return seq_1, seq_2
+
+
+def test_bootstrap_bands_are_independent_of_workers():
+    seq_1, seq_2 = bootstrap_fixture()
+    bands = [
+        bootstrap_dnds_bands(
+            seq_1, seq_2, [60, 90], n_replicates=60, workers=workers, seed=4
+        )
+        for workers in [1, 3]
+    ]
+    for (lower_1, upper_1), (lower_3, upper_3) in zip(*bands):
+        np.testing.assert_array_equal(lower_1, lower_3)
+        np.testing.assert_array_equal(upper_1, upper_3)
+
+
+def test_bootstrap_bands_contain_defined_ratios():
+    seq_1, seq_2 = bootstrap_fixture()
+    window_sizes = [60, 90]
+    bands = bootstrap_dnds_bands(
+        seq_1, seq_2, window_sizes, n_replicates=200, workers=2, seed=5
+    )
+
+    for window_size, (lower, upper) in zip(window_sizes, bands):
+        ratios = sliding_window_dnds(seq_1, seq_2, window_size)[1]
+        defined = ~np.isnan(ratios)
+        assert defined.any() and not defined.all()
+        assert np.all(lower[defined] <= ratios[defined])
+        assert np.all(ratios[defined] <= upper[defined])
+        assert np.isnan(lower[~defined]).all()
+        assert np.isnan(upper[~defined]).all()
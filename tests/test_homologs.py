@@ -0,0 +1,84 @@
+"""Tests that every pair of a set of homologs is aligned once, like a single alignment."""
+
+import numpy as np
+
+from alignment import align_sequences
+from helpers import mutate, random_sequence
+from homologs import align_all_pairs, load_homolog_matrices, save_homolog_matrices
+
+CLUSTER_COUNTS = [2, 3]
+
+
+def homolog_sequences(rng: np.random.Generator, n: int):
+    """Returns `n` names and nucleotide sequences mutated from a common ancestor."""
+    ancestor = random_sequence(rng, 60, nucleotides=True)
+    sequences = [mutate(rng, ancestor, 0.15, nucleotides=True) for _ in range(n)]
+    return [f"seq{i}" for i in range(n)], sequences
+
+
+def test_align_all_pairs_matches_pairwise_alignments(work_dir, capsys):
+    names, sequences = homolog_sequences(np.random.default_rng(3), 5)
+    matrices = align_all_pairs(
+        names, sequences, cluster_counts=CLUSTER_COUNTS, workers=2, verbose=True
+    )
+
+    n = len(sequences)
+    aligned = capsys.readouterr().out.splitlines()
+    assert len(aligned) == n * (n - 1) // 2
+    assert all(line.endswith(f"/{len(aligned)}).") for line in aligned)
+
+    np.testing.assert_array_equal(matrices.identity, matrices.identity.T)
+    np.testing.assert_array_equal(matrices.hamming, matrices.hamming.T)
+    np.testing.assert_array_equal(
+        matrices.variances, matrices.variances.transpose(0, 2, 1)
+    )
+    assert (np.diag(matrices.identity) == 1).all()
+    assert (np.diag(matrices.hamming) == 0).all()
+
+    for i in range(n):
+        for j in range(i + 1, n):
+            expected = align_sequences(sequences[i], sequences[j])
+            assert matrices.identity[i, j] == (
+                expected.matches() / expected.get_alignment_length()
+            )
+            assert matrices.hamming[i, j] == expected.hamming_distance()
+            np.testing.assert_array_equal(
+                matrices.variances[:, i, j],
+                expected.clustered_mismatch_variances(CLUSTER_COUNTS),
+            )
+
+
+def test_homolog_matrices_round_trip(work_dir):
+    names, sequences = homolog_sequences(np.random.default_rng(4), 3)
+    matrices = align_all_pairs(names, sequences, cluster_counts=CLUSTER_COUNTS)
+    save_homolog_matrices(matrices, "homologs.npz")
+    loaded = load_homolog_matrices("homologs.npz")
+
+    assert loaded.names == names
+    assert loaded.cluster_counts == CLUSTER_COUNTS
+    np.testing.assert_array_equal(loaded.identity, matrices.identity)
+    np.testing.assert_array_equal(loaded.hamming, matrices.hamming)
+    np.testing.assert_array_equal(loaded.variances, matrices.variances)
+
+
+def test_dissimilar_pairs_are_skipped(work_dir):
+    rng = np.random.default_rng(5)
+    names, sequences = homolog_sequences(rng, 3)
+    names.append("unrelated")
+    sequences.append(random_sequence(rng, 60, nucleotides=True))
+    matrices = align_all_pairs(
+        names, sequences, cluster_counts=CLUSTER_COUNTS, min_similarity=0.05
+    )
+
+    for i in range(3):
+        assert np.isnan(matrices.identity[i, 3]) and np.isnan(matrices.identity[3, i])
+        assert matrices.hamming[i, 3] == matrices.hamming[3, i] == -1
+        assert np.isnan(matrices.variances[:, i, 3]).all()
+        for j in range(i + 1, 3):
+            expected = align_sequences(sequences[i], sequences[j])
+            assert (
+                matrices.identity[i, j]
+                == matrices.identity[j, i]
+                == (expected.matches() / expected.get_alignment_length())
+            )
+            assert matrices.hamming[i, j] == expected.hamming_distance()
@@ -0,0 +1,63 @@
+"""Tests that k-mer profiles and indexes find similar sequences and their shared diagonals."""
+
+import numpy as np
+import pytest
+
+from helpers import mutate, random_sequence
+from kmers import KmerIndex, KmerProfile, kmer_codes
+from scoring import default_scheme
+
+
+def test_kmer_codes_match_naive_codes():
+    rng = np.random.default_rng(1)
+    codes = rng.integers(0, 4, size=30)
+    expected = [
+        sum(int(code) * 4 ** (4 - 1 - i) for i, code in enumerate(codes[j : j + 4]))
+        for j in range(len(codes) - 4 + 1)
+    ]
+    assert kmer_codes(codes, 4, 4).tolist() == expected
+    assert len(kmer_codes(codes[:3], 4, 4)) == 0
+
+
+def test_kmer_index_matches_pairwise_similarities(nucleotides):
+    rng = np.random.default_rng(2)
+    ancestor = random_sequence(rng, 120, nucleotides)
+    sequences = [mutate(rng, ancestor, rate, nucleotides) for rate in [0, 0.05, 0.2]]
+    sequences += [random_sequence(rng, 100, nucleotides), ancestor[:5]]
+    index = KmerIndex(sequences, nucleotides)
+
+    similarities = np.array(
+        [[p.similarity(q) for q in index.profiles] for p in index.profiles]
+    )
+    for i, profile in enumerate(index.profiles):
+        np.testing.assert_allclose(index.similarities(profile), similarities[i])
+
+    for min_similarity in [0.1, 0.5, 0.9]:
+        expected = [
+            (i, j, pytest.approx(similarities[i, j]))
+            for i in range(len(sequences))
+            for j in range(i + 1, len(sequences))
+            if similarities[i, j] >= min_similarity
+        ]
+        assert index.similar_pairs(min_similarity) == expected
+    assert (0, 1) in [(i, j) for i, j, _ in index.similar_pairs(0.5)]
+    assert (0, 3) not in [(i, j) for i, j, _ in index.similar_pairs(0.5)]
+
+
+def test_anchor_diagonals_follow_shifts():
+    scheme = default_scheme(True)
+    rng = np.random.default_rng(3)
+    top_seq = random_sequence(rng, 100, nucleotides=True)
+    left_seq = random_sequence(rng, 10, nucleotides=True) + top_seq
+
+    top_profile = KmerProfile(top_seq, scheme, 8)
+    left_profile = KmerProfile(left_seq, scheme, 8)
+    assert top_profile.anchor_diagonals(left_profile).tolist() == [-10]
+    assert left_profile.anchor_diagonals(top_profile).tolist() == [10]
+    assert top_profile.anchor_diagonals(top_profile).tolist() == [0]
+
+
+def test_anchor_diagonals_ignore_repeats():
+    scheme = default_scheme(True)
+    profile = KmerProfile("A" * 60, scheme, 8)
+    assert len(profile.anchor_diagonals(profile)) == 0
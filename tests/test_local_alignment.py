@@ -0,0 +1,52 @@
+"""Tests that the striped Smith-Waterman engine agrees with a cell-by-cell one."""
+
+import numpy as np
+import pytest
+
+from helpers import random_pair, smith_waterman_scores
+from local_alignment import align_local, local_alignment_score
+from scoring import BLOSUM62, default_scheme
+
+N_PAIRS = 60
+
+
+@pytest.mark.parametrize("segment_length", [1, 3, 8])
+def test_local_alignment_score_matches_naive(nucleotides, segment_length):
+    rng = np.random.default_rng(1)
+    scheme = default_scheme(nucleotides)
+    for _ in range(N_PAIRS):
+        top_seq, left_seq = random_pair(rng, nucleotides)
+        assert (
+            local_alignment_score(
+                top_seq, left_seq, nucleotides, segment_length=segment_length
+            )
+            == smith_waterman_scores(top_seq, left_seq, scheme).max()
+        )
+
+
+def test_local_alignment_score_matches_naive_with_blosum62():
+    rng = np.random.default_rng(2)
+    for _ in range(N_PAIRS):
+        top_seq, left_seq = random_pair(rng, nucleotides=False)
+        assert (
+            local_alignment_score(top_seq, left_seq, scheme=BLOSUM62)
+            == smith_waterman_scores(top_seq, left_seq, BLOSUM62).max()
+        )
+
+
+def test_align_local_matches_naive(nucleotides):
+    rng = np.random.default_rng(3)
+    scheme = default_scheme(nucleotides)
+    for _ in range(N_PAIRS):
+        top_seq, left_seq = random_pair(rng, nucleotides)
+        search = smith_waterman_scores(top_seq, left_seq, scheme)
+        result = align_local(top_seq, left_seq, nucleotides, segment_length=4)
+
+        assert result.get_score() == search.max()
+        top_start, top_end = result.get_top_range()
+        left_start, left_end = result.get_left_range()
+        assert search[left_end, top_end] == search.max()
+        assert result.get_alignment_1().replace("-", "") == top_seq[top_start:top_end]
+        assert (
+            result.get_alignment_2().replace("-", "") == left_seq[left_start:left_end]
+        )
@@ -0,0 +1,274 @@
+"""Tests the serial and parallel Monte-Carlo simulation engines."""
+
+import os
+import uuid
+from typing import List
+
+import numpy as np
+import pytest
+
+from monte_carlo import (
+    STOP_ABOVE_ALPHA,
+    STOP_BELOW_ALPHA,
+    STOP_TRIAL_LIMIT,
+    MonteCarloSimulationResult,
+    make_batches,
+    monte_carlo,
+    monte_carlo_parallel,
+)
+from permutation import PermutationSource
+from scoring import default_scheme
+from simulation import ClusteringTrial
+from simulation import get_clustering_batch_simulation_fn, get_effect_size_fn
+
+CSTSI_FRAGMENT = "MSLLSDLINLNLSDSTEKIIAEYIWIGGSGMDMRSKARTLPGPVTDPSKLPKWNYDGSST"
+CSGSI_FRAGMENT = "MSLLTDLVNLNLSESTEKIIAEYIWIGGSGMDLRSKARTLPGPVSDPAKLPKWNYDGSST"
+
+
+def draw_uniform(n_trials: int, rng: np.random.Generator) -> List[float]:
+    """Simulates a batch of trials, each drawing a uniform random number."""
+    return rng.random(n_trials).tolist()
+
+
+def draw_one() -> float:
+    """Simulates a single trial, drawing a uniform random number."""
+    return float(np.random.default_rng().random())
+
+
+def identity(value: float) -> float:
+    """Uses the drawn number itself as the effect size."""
+    return value
+
+
+@pytest.mark.parametrize("n_trials,batch_size", [(5, 1), (9, 4), (1, 3)])
+def test_batched_simulation_with_any_batch_size(n_trials, batch_size):
+    result = monte_carlo(
+        draw_uniform,
+        identity,
+        observed_effect_size=0.5,
+        n_trials=n_trials,
+        batch_size=batch_size,
+        seed=1,
+        batched=True,
+    )
+    assert result.get_trial_count() == n_trials
+
+
+@pytest.mark.parametrize("batch_size", [1, 4])
+def test_single_trial_simulation_with_any_batch_size(batch_size):
+    result = monte_carlo(
+        draw_one, identity, observed_effect_size=0.5, n_trials=9, batch_size=batch_size
+    )
+    assert result.get_trial_count() == 9
+
+
+@pytest.mark.parametrize("n_trials,batch_size", [(4, 1), (5, 2)])
+def test_clustering_simulation_with_any_batch_size(n_trials, batch_size):
+    simulation_fn = get_clustering_batch_simulation_fn(CSTSI_FRAGMENT, CSGSI_FRAGMENT)
+    effect_size_fns = [get_effect_size_fn(clusters) for clusters in [2, 5]]
+    for run in [monte_carlo, monte_carlo_parallel]:
+        results = run(
+            simulation_fn,
+            effect_size_fns,
+            observed_effect_size=[0.0, 0.0],
+            n_trials=n_trials,
+            batch_size=batch_size,
+            seed=2,
+            batched=True,
+        )
+        assert [result.get_trial_count() for result in results] == [n_trials] * 2
+
+
+def test_parallel_single_statistic_returns_bare_result():
+    result = monte_carlo_parallel(
+        draw_uniform,
+        identity,
+        observed_effect_size=0.5,
+        n_trials=20,
+        workers=2,
+        batch_size=3,
+        seed=3,
+        batched=True,
+    )
+    assert isinstance(result, MonteCarloSimulationResult)
+    assert result.get_trial_count() == 20
+    assert result.p_value == result.get_success_count() / 20
+
+
+def shifted(value: float) -> float:
+    """Uses the drawn number plus one as the effect size."""
+    return value + 1
+
+
+@pytest.mark.parametrize("run", [monte_carlo, monte_carlo_parallel])
+def test_multiple_statistics_return_one_result_each(run):
+    observed = [0.5, 1.25, 2.0]
+    results = run(
+        draw_uniform,
+        [identity, shifted, identity],
+        observed_effect_size=observed,
+        n_trials=30,
+        batch_size=4,
+        seed=4,
+        batched=True,
+    )
+    assert len(results) == 3
+    for result, effect_size_fn, observed_effect_size in zip(
+        results, [identity, shifted, identity], observed
+    ):
+        # Each statistic is scored on the same trials as a simulation of it alone
+        expected = monte_carlo(
+            draw_uniform,
+            effect_size_fn,
+            observed_effect_size=observed_effect_size,
+            n_trials=30,
+            batch_size=4,
+            seed=4,
+            batched=True,
+        )
+        assert result.get_success_count() == expected.get_success_count()
+        assert result.get_trial_count() == 30
+    assert results[2].get_success_count() == 0
+
+
+def test_multiple_statistics_need_matching_observed_effect_sizes():
+    with pytest.raises(ValueError):
+        monte_carlo(
+            draw_uniform,
+            [identity, shifted],
+            observed_effect_size=[0.5],
+            n_trials=4,
+            batched=True,
+        )
+
+
+@pytest.mark.parametrize("run", [monte_carlo, monte_carlo_parallel])
+@pytest.mark.parametrize(
+    "observed_effect_size,n_expected,reason",
+    [
+        # Every trial succeeds, which is decided as soon as the minimum is reached
+        (-1.0, 20, STOP_ABOVE_ALPHA),
+        # No trial succeeds, and the upper bound first drops below alpha at 130 trials
+        (2.0, 130, STOP_BELOW_ALPHA),
+        # About half of the trials succeed, so only the trial limit stops them
+        (0.5, 300, STOP_TRIAL_LIMIT),
+    ],
+)
+def test_sequential_simulation_stops_once_decided(
+    run, observed_effect_size, n_expected, reason
+):
+    result = run(
+        draw_uniform,
+        identity,
+        observed_effect_size=observed_effect_size,
+        n_trials=300,
+        batch_size=5,
+        alpha=0.5 if reason == STOP_TRIAL_LIMIT else 0.05,
+        confidence=0.99,
+        min_trials=20,
+        seed=5,
+        batched=True,
+    )
+    assert result.get_trial_count() == n_expected
+    assert result.get_stop_reason() == reason
+    lower, upper = result.get_confidence_interval()
+    assert lower <= result.p_value <= upper
+
+
+def test_fixed_simulation_has_no_interval_or_reason():
+    result = monte_carlo(
+        draw_uniform, identity, 0.5, n_trials=10, batch_size=5, seed=6, batched=True
+    )
+    assert result.get_confidence_interval() is None
+    assert result.get_stop_reason() is None
+
+
+class RecordPermutations:
+    """
+    RecordPermutations simulates trials by shuffling CsGSI, and records each
+    shuffled sequence in a file of its own in `directory`, so that the shuffles
+    drawn by worker processes can be compared.
+    """
+
+    def __init__(self, directory: str):
+        """Produces a new RecordPermutations, which records shuffles in `directory`."""
+        self.directory = directory
+        self.trial = ClusteringTrial(CSTSI_FRAGMENT, CSGSI_FRAGMENT)
+
+    def record(self, permutations: List[str]) -> List[float]:
+        """Records the provided shuffles, and returns an effect size for each one."""
+        with open(os.path.join(self.directory, uuid.uuid4().hex), "w") as f:
+            f.write("\n".join(permutations))
+        return [0.0] * len(permutations)
+
+    def __call__(self) -> float:
+        return self.record([self.trial.shuffled_csgsi()])[0]
+
+    def run_batch(self, n_trials: int, rng: np.random.Generator) -> List[float]:
+        """Runs a batch of trials, drawing the shuffles from `rng`."""
+        permutations = self.trial.csgsi_permutations
+        return self.record(permutations.decode(permutations.batch(n_trials, rng)))
+
+
+def test_seeded_simulation_is_independent_of_parallelism():
+    simulation_fn = get_clustering_batch_simulation_fn(CSTSI_FRAGMENT, CSGSI_FRAGMENT)
+    effect_size_fns = [get_effect_size_fn(clusters) for clusters in [2, 5]]
+    observed = [0.5, 0.5]
+    expected = monte_carlo(
+        simulation_fn,
+        effect_size_fns,
+        observed,
+        n_trials=23,
+        batch_size=4,
+        seed=8,
+        batched=True,
+    )
+    for workers in [1, 3]:
+        results = monte_carlo_parallel(
+            simulation_fn,
+            effect_size_fns,
+            observed,
+            n_trials=23,
+            workers=workers,
+            batch_size=4,
+            seed=8,
+            batched=True,
+        )
+        assert [result.p_value for result in results] == [
+            result.p_value for result in expected
+        ]
+
+
+@pytest.mark.parametrize("batched", [True, False])
+def test_unseeded_workers_draw_different_permutations(tmp_path, batched):
+    simulation_fn = RecordPermutations(str(tmp_path))
+    monte_carlo_parallel(
+        simulation_fn.run_batch if batched else simulation_fn,
+        identity,
+        observed_effect_size=0.5,
+        n_trials=24,
+        workers=3,
+        batch_size=4,
+        batched=batched,
+    )
+    permutations = []
+    for filename in os.listdir(tmp_path):
+        with open(tmp_path / filename) as f:
+            permutations.extend(f.read().split("\n"))
+    assert len(permutations) == 24
+    assert len(set(permutations)) == 24
+
+
+def test_permutation_source_is_reproducible():
+    scheme = default_scheme(nucleotides=False)
+    source = PermutationSource(CSGSI_FRAGMENT, scheme)
+    batch = source.batch(5, np.random.default_rng(9))
+    assert (batch == source.batch(5, np.random.default_rng(9))).all()
+    for permutation in source.decode(batch):
+        assert sorted(permutation) == sorted(CSGSI_FRAGMENT)
+    assert len(set(source.decode(batch))) == 5
+
+
+def test_make_batches_skips_logged_batches():
+    assert make_batches(10, 3) == [(0, 3), (1, 3), (2, 3), (3, 1)]
+    assert make_batches(10, 3, {0, 2}) == [(1, 3), (3, 1)]
@@ -0,0 +1,95 @@
+"""Tests that FASTA files are parsed, indexed and fetched from, gzipped or not."""
+
+import gzip
+import os
+
+import pytest
+
+from parse_fasta import (
+    FastaIndexEntry,
+    build_fasta_index,
+    fetch_fasta,
+    get_index_path,
+    parse_fasta,
+    read_fasta_index,
+)
+
+RECORDS = {
+    "first": "ACGTACGTAC" "GTTTGACCAG" "TA",
+    "second": "",
+    "third": "GGGCCCAAAT" "TTACG",
+    "fourth": "ACGTACGTAC",
+}
+
+
+def write_fasta(path, records, line_bases: int = 10, gzipped: bool = False):
+    """Writes the provided records to a FASTA file, wrapping their sequences."""
+    lines = []
+    for name, sequence in records.items():
+        lines.append(f">{name} description of {name}")
+        for start in range(0, len(sequence), line_bases):
+            lines.append(sequence[start : start + line_bases].lower())
+    data = ("\n".join(lines) + "\n").encode()
+    with (gzip.open if gzipped else open)(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+@pytest.fixture(params=[False, True], ids=["plain", "gzipped"])
+def fasta_file(request, tmp_path) -> str:
+    """A small FASTA file of several wrapped records, plain and gzipped."""
+    suffix = ".fasta.gz" if request.param else ".fasta"
+    return write_fasta(tmp_path / f"records{suffix}", RECORDS, gzipped=request.param)
+
+
+def test_parse_fasta_reads_every_record(fasta_file):
+    assert dict(parse_fasta(fasta_file)) == RECORDS
+
+
+def test_build_fasta_index_records_line_layout(tmp_path):
+    filename = write_fasta(tmp_path / "records.fasta", RECORDS)
+    index = build_fasta_index(filename)
+
+    assert list(index) == list(RECORDS)
+    header = len(">first description of first\n")
+    assert index["first"] == FastaIndexEntry(22, header, 10, 11)
+    assert index["second"].length == 0
+    assert index["fourth"].length == 10
+
+
+def test_build_fasta_index_rejects_uneven_lines(tmp_path):
+    filename = tmp_path / "uneven.fasta"
+    filename.write_text(">uneven\nACGT\nAC\nACGT\n")
+    with pytest.raises(ValueError, match="differing lengths"):
+        build_fasta_index(str(filename))
+
+
+def test_read_fasta_index_writes_fai(fasta_file):
+    index = read_fasta_index(fasta_file)
+
+    assert os.path.exists(get_index_path(fasta_file))
+    with open(get_index_path(fasta_file)) as f:
+        lines = f.read().splitlines()
+    assert [line.split("\t")[0] for line in lines] == list(RECORDS)
+    assert read_fasta_index(fasta_file) == index
+
+
+def test_fetch_fasta_reads_wrapped_records(fasta_file):
+    for name, sequence in RECORDS.items():
+        assert fetch_fasta(fasta_file, name) == sequence
+    with pytest.raises(KeyError):
+        fetch_fasta(fasta_file, "missing")
+
+
+def test_stale_index_is_rebuilt(tmp_path):
+    filename = write_fasta(tmp_path / "records.fasta", RECORDS)
+    read_fasta_index(filename)
+
+    changed = {**RECORDS, "first": "TTTT"}
+    write_fasta(filename, changed, line_bases=4)
+    index_mtime = os.path.getmtime(get_index_path(filename))
+    os.utime(filename, (index_mtime + 10, index_mtime + 10))
+
+    assert read_fasta_index(filename)["first"].line_bases == 4
+    assert fetch_fasta(filename, "first") == "TTTT"
+    assert fetch_fasta(filename, "third") == RECORDS["third"]
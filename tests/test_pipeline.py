@@ -0,0 +1,91 @@
+"""Tests that pipelines run their stages in order, and re-run only the stale ones."""
+
+import pytest
+
+from pipeline import Stage, get_stage_key, run_pipeline
+
+
+def constant(value: int) -> int:
+    """Runs a stage that returns its configured value."""
+    return value
+
+
+def add(a: int, b: int, offset: int = 0) -> int:
+    """Runs a stage that adds its inputs and configured offset."""
+    return a + b + offset
+
+
+def double(a: int) -> int:
+    """Runs a stage that doubles its input."""
+    return 2 * a
+
+
+def make_stages(base: int = 1, offset: int = 0):
+    """Returns a small pipeline, in which only `sum` and `double` depend on `base`."""
+    return [
+        Stage("base", constant, config={"value": base}),
+        Stage("other", constant, config={"value": 10}),
+        Stage("sum", add, inputs=("base", "other"), config={"offset": offset}),
+        Stage("double", double, inputs=("sum",)),
+        Stage("unrelated", double, inputs=("other",)),
+    ]
+
+
+def run_stages(capsys, stages):
+    """Runs a pipeline, returning its results and the names of the stages it ran."""
+    results = run_pipeline(stages, workers=2, verbose=True)
+    ran = {
+        line[len("Running ") : -len("...")]
+        for line in capsys.readouterr().out.splitlines()
+        if line.startswith("Running ")
+    }
+    return results, ran
+
+
+def test_pipeline_results(work_dir, capsys):
+    results, ran = run_stages(capsys, make_stages())
+    assert results == {"base": 1, "other": 10, "sum": 11, "double": 22, "unrelated": 20}
+    assert ran == {"base", "other", "sum", "double", "unrelated"}
+
+
+def test_unchanged_pipeline_is_loaded_from_cache(work_dir, capsys):
+    first, _ = run_stages(capsys, make_stages())
+    second, ran = run_stages(capsys, make_stages())
+    assert second == first
+    assert ran == set()
+
+
+def test_config_change_reruns_only_dependent_stages(work_dir, capsys):
+    run_stages(capsys, make_stages())
+
+    results, ran = run_stages(capsys, make_stages(base=2))
+    assert results["double"] == 24
+    assert ran == {"base", "sum", "double"}
+
+    results, ran = run_stages(capsys, make_stages(base=2, offset=5))
+    assert results["double"] == 34
+    assert ran == {"sum", "double"}
+
+
+def test_stage_key_covers_function_source():
+    def renamed(a: int) -> int:
+        """Runs a stage with the same name as `double`, but different source."""
+        return 3 * a
+
+    renamed.__module__ = double.__module__
+    renamed.__qualname__ = double.__qualname__
+    assert get_stage_key(Stage("double", double), []) != get_stage_key(
+        Stage("double", renamed), []
+    )
+    assert get_stage_key(Stage("double", double), []) == get_stage_key(
+        Stage("double", double), []
+    )
+
+
+def test_pipeline_rejects_unknown_and_circular_stages(work_dir):
+    with pytest.raises(ValueError, match="unknown stage"):
+        run_pipeline([Stage("sum", add, inputs=("missing",))])
+    with pytest.raises(ValueError, match="circular"):
+        run_pipeline(
+            [Stage("a", double, inputs=("b",)), Stage("b", double, inputs=("a",))]
+        )
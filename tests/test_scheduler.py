@@ -0,0 +1,109 @@
+"""Tests that the scheduler survives crashed workers and reports failed batches."""
+
+import os
+from typing import List
+
+import numpy as np
+import pytest
+
+from monte_carlo import monte_carlo, monte_carlo_parallel
+from scheduler import BatchError, schedule_batches
+
+
+def square(value: int) -> int:
+    """Runs a batch that squares its value."""
+    return value * value
+
+
+def exit_worker(value: int) -> int:
+    """Runs a batch that kills its worker process."""
+    os._exit(1)
+
+
+class CrashOnce:
+    """
+    CrashOnce simulates batches of trials, each drawing a uniform random number,
+    but kills the worker process running the first batch it is called for.
+    """
+
+    def __init__(self, marker_path: str):
+        """Produces a new CrashOnce, which marks that it has crashed at `marker_path`."""
+        self.marker_path = marker_path
+
+    def __call__(self, n_trials: int, rng: np.random.Generator) -> List[float]:
+        if not os.path.exists(self.marker_path):
+            open(self.marker_path, "w").close()
+            os._exit(1)
+        return rng.random(n_trials).tolist()
+
+
+class RaiseOnBatch:
+    """RaiseOnBatch simulates batches of trials, but raises on batches of `n_failing` trials."""
+
+    def __init__(self, n_failing: int):
+        """Produces a new RaiseOnBatch, which fails on batches of `n_failing` trials."""
+        self.n_failing = n_failing
+
+    def __call__(self, n_trials: int, rng: np.random.Generator) -> List[float]:
+        if n_trials == self.n_failing:
+            raise ValueError("simulated failure")
+        return rng.random(n_trials).tolist()
+
+
+def identity(value: float) -> float:
+    """Uses the drawn number itself as the effect size."""
+    return value
+
+
+def test_schedule_batches_runs_every_batch():
+    results = {
+        index: result for _, index, result in schedule_batches(square, [1, 2, 3, 4], 2)
+    }
+    assert results == {0: 1, 1: 4, 2: 9, 3: 16}
+
+
+def test_crashed_batch_is_requeued(tmp_path):
+    simulation_fn = CrashOnce(str(tmp_path / "crashed"))
+    result = monte_carlo_parallel(
+        simulation_fn,
+        identity,
+        observed_effect_size=0.5,
+        n_trials=40,
+        workers=2,
+        batch_size=5,
+        seed=1,
+        batched=True,
+    )
+    assert os.path.exists(simulation_fn.marker_path)
+
+    expected = monte_carlo(
+        simulation_fn,
+        identity,
+        observed_effect_size=0.5,
+        n_trials=40,
+        batch_size=5,
+        seed=1,
+        batched=True,
+    )
+    assert result.get_trial_count() == expected.get_trial_count() == 40
+    assert result.get_success_count() == expected.get_success_count()
+
+
+def test_batch_crashing_every_time_raises_after_retries():
+    with pytest.raises(BatchError, match="crashed its worker 2 times"):
+        list(schedule_batches(exit_worker, [1], 1, max_retries=1))
+
+
+def test_failing_batch_raises_with_traceback():
+    with pytest.raises(BatchError) as error:
+        monte_carlo_parallel(
+            RaiseOnBatch(3),
+            identity,
+            observed_effect_size=0.5,
+            n_trials=13,
+            workers=2,
+            batch_size=5,
+            batched=True,
+        )
+    assert "ValueError: simulated failure" in error.value.formatted_traceback
+    assert "simulated failure" in str(error.value)
@@ -0,0 +1,94 @@
+"""Tests that database searches keep the best records, in a deterministic order."""
+
+import numpy as np
+import pytest
+
+import search as search_module
+from alignment import alignment_score
+from helpers import mutate, random_sequence
+from local_alignment import local_alignment_score
+from search import format_hits, search
+
+QUERY = random_sequence(np.random.default_rng(12), 50, nucleotides=True)
+
+
+def write_database(filename: str, records):
+    """Writes the provided records of names and sequences to a FASTA file."""
+    with open(filename, "w") as f:
+        for name, seq in records:
+            f.write(f">{name}\n{seq}\n")
+
+
+@pytest.fixture
+def database(work_dir):
+    """
+    A database of mutated copies of the query, unrelated records, a pair of records
+    tying with the query itself, and a record outside the nucleotide alphabet.
+    """
+    rng = np.random.default_rng(13)
+    records = [(f"mutant{i}", mutate(rng, QUERY, 0.05 * i, True)) for i in range(1, 9)]
+    records += [(f"random{i}", random_sequence(rng, 50, True)) for i in range(5)]
+    records.insert(3, ("copy_a", QUERY))
+    records.insert(9, ("copy_b", QUERY))
+    records.append(("invalid", QUERY[:20] + "XYZ" + QUERY[20:]))
+    write_database("database.fasta", records)
+    return records
+
+
+def expected_hits(records, top_k: int, local: bool):
+    """Returns the names and scores of the best `top_k` records, found one by one."""
+    score_fn = local_alignment_score if local else alignment_score
+    scored = [
+        (score_fn(seq, QUERY, nucleotides=True), -i, name)
+        for i, (name, seq) in enumerate(records)
+        if name != "invalid"
+    ]
+    return [(name, score) for score, _, name in sorted(scored, reverse=True)[:top_k]]
+
+
+@pytest.mark.parametrize("local", [False, True], ids=["global", "local"])
+@pytest.mark.parametrize("workers", [1, 3])
+def test_search_keeps_best_records_in_order(database, local, workers):
+    with pytest.warns(UserWarning, match="skipped 1 records"):
+        hits, statistics = search(
+            QUERY,
+            "database.fasta",
+            top_k=6,
+            batch_size=2,
+            workers=workers,
+            local=local,
+        )
+
+    assert [(hit.name, hit.score) for hit in hits] == expected_hits(database, 6, local)
+    assert [hit.name for hit in hits[:2]] == ["copy_a", "copy_b"]
+    assert hits[0].identity == 1.0
+    assert all(0 <= hit.identity <= 1 for hit in hits)
+    assert statistics.n_records == len(database)
+    assert statistics.n_aligned == len(database) - 1
+    assert statistics.n_invalid == 1
+
+
+def test_search_ties_are_broken_by_record_order(work_dir):
+    write_database(
+        "ties.fasta", [(f"copy{i}", QUERY) for i in range(7)] + [("short", QUERY[:5])]
+    )
+    hits, _ = search(QUERY, "ties.fasta", top_k=4, batch_size=1, workers=3)
+    assert [hit.name for hit in hits] == ["copy0", "copy1", "copy2", "copy3"]
+
+
+def test_search_skips_dissimilar_records(database):
+    with pytest.warns(UserWarning):
+        hits, statistics = search(
+            QUERY, "database.fasta", top_k=20, workers=2, min_similarity=0.5
+        )
+    assert statistics.n_aligned < len(database) - 1
+    assert not [hit for hit in hits if hit.name.startswith("random")]
+    assert "copy_a" in format_hits(hits)
+
+
+def test_long_local_hits_have_no_identity(database, monkeypatch):
+    monkeypatch.setattr(search_module, "SEARCH_MAX_LOCAL_CELLS", 10)
+    with pytest.warns(UserWarning):
+        hits, _ = search(QUERY, "database.fasta", top_k=3, workers=1, local=True)
+    assert [hit.name for hit in hits[:2]] == ["copy_a", "copy_b"]
+    assert all(np.isnan(hit.identity) for hit in hits)
@@ -0,0 +1,86 @@
+"""Tests that encoded FASTA files are cached, and rebuilt only when they need to be."""
+
+import os
+
+import numpy as np
+import pytest
+
+import sequence_cache
+from dir_utils import get_cache
+from scoring import NUCLEOTIDE_SCHEME
+from sequence_cache import get_cache_key, read_encoded_fasta, read_first_sequence
+
+
+def write_fasta(filename: str, records):
+    """Writes the provided records of names and sequences to a FASTA file."""
+    with open(filename, "w") as f:
+        for name, seq in records:
+            f.write(f">{name}\n{seq}\n")
+
+
+def decode(records):
+    """Decodes the sequences read from the cache."""
+    return [(name, NUCLEOTIDE_SCHEME.decode(codes)) for name, codes in records]
+
+
+@pytest.fixture
+def fasta_file(work_dir) -> str:
+    """A small nucleotide FASTA file in the test's working directory."""
+    write_fasta("records.fasta", [("first", "ACGTAC"), ("second", "GGTTA")])
+    return "records.fasta"
+
+
+@pytest.fixture
+def count_builds(monkeypatch):
+    """Counts the number of times a cache entry is built."""
+    builds = []
+    build_cache_entry = sequence_cache.build_cache_entry
+
+    def counting_build(*args):
+        builds.append(args[0])
+        build_cache_entry(*args)
+
+    monkeypatch.setattr(sequence_cache, "build_cache_entry", counting_build)
+    return builds
+
+
+def test_cached_records_match_file(fasta_file, count_builds):
+    expected = [("first", "ACGTAC"), ("second", "GGTTA")]
+    assert decode(read_encoded_fasta(fasta_file, NUCLEOTIDE_SCHEME)) == expected
+    assert decode(read_encoded_fasta(fasta_file, NUCLEOTIDE_SCHEME)) == expected
+    assert len(count_builds) == 1
+
+    name, codes = read_first_sequence(fasta_file, NUCLEOTIDE_SCHEME)
+    assert name == "first"
+    assert isinstance(codes, np.memmap)
+    assert not codes.flags.writeable
+
+
+def test_touched_unchanged_file_reuses_cache(fasta_file, count_builds):
+    read_encoded_fasta(fasta_file, NUCLEOTIDE_SCHEME)
+    stat = os.stat(fasta_file)
+    os.utime(fasta_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    records = decode(read_encoded_fasta(fasta_file, NUCLEOTIDE_SCHEME))
+    assert records == [("first", "ACGTAC"), ("second", "GGTTA")]
+    assert len(count_builds) == 1
+
+
+def test_changed_file_is_rebuilt(fasta_file, count_builds):
+    read_encoded_fasta(fasta_file, NUCLEOTIDE_SCHEME)
+    write_fasta(fasta_file, [("first", "TTTT"), ("third", "CCAAGG")])
+    stat = os.stat(fasta_file)
+    os.utime(fasta_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    records = decode(read_encoded_fasta(fasta_file, NUCLEOTIDE_SCHEME))
+    assert records == [("first", "TTTT"), ("third", "CCAAGG")]
+    assert len(count_builds) == 2
+
+
+def test_missing_encoded_sequences_are_rebuilt(fasta_file, count_builds):
+    read_encoded_fasta(fasta_file, NUCLEOTIDE_SCHEME)
+    os.remove(get_cache(f"{get_cache_key(fasta_file, NUCLEOTIDE_SCHEME)}.npy"))
+
+    records = decode(read_encoded_fasta(fasta_file, NUCLEOTIDE_SCHEME))
+    assert records == [("first", "ACGTAC"), ("second", "GGTTA")]
+    assert len(count_builds) == 2
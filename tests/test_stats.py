@@ -0,0 +1,39 @@
+"""Tests the statistical functions."""
+
+import numpy as np
+import pytest
+
+from stats import variance, wilson_interval
+
+
+def test_wilson_interval_is_pinned_at_the_extremes():
+    for trials in [1, 7, 100, 1000]:
+        lower, upper = wilson_interval(np.array([0, trials]), trials, 0.99)
+        assert lower[0] == 0.0 and upper[1] == 1.0
+        assert 0.0 < upper[0] < 1.0 and 0.0 < lower[1] < 1.0
+
+
+def test_wilson_interval_contains_the_proportion():
+    successes = np.arange(51)
+    lower, upper = wilson_interval(successes, 50, 0.95)
+    proportions = successes / 50
+    assert (lower <= proportions).all() and (proportions <= upper).all()
+    assert (np.diff(lower) > 0).all() and (np.diff(upper) > 0).all()
+
+
+def test_wilson_interval_narrows_with_confidence():
+    narrow = wilson_interval(np.array([10]), 40, 0.9)
+    wide = wilson_interval(np.array([10]), 40, 0.99)
+    assert wide[0][0] < narrow[0][0] and narrow[1][0] < wide[1][0]
+
+
+def test_wilson_interval_matches_closed_form():
+    lower, upper = wilson_interval(np.array([0]), 20, 0.99)
+    z_squared = 2.5758293035489**2
+    assert upper[0] == pytest.approx(z_squared / (20 + z_squared))
+
+
+def test_population_and_sample_variance():
+    data = np.array([1.0, 2.0, 4.0, 7.0])
+    assert variance(data, sample=False) == pytest.approx(np.var(data))
+    assert variance(data) == pytest.approx(np.var(data, ddof=1))
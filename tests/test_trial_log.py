@@ -0,0 +1,127 @@
+"""Tests that trial logs record batches, and that they can be combined."""
+
+import json
+from typing import List
+
+import numpy as np
+import pytest
+
+from monte_carlo import monte_carlo, monte_carlo_parallel
+from simulation import get_trial_log_path
+from simulation_orchestrator import aggregate_trial_logs
+from trial_log import TrialLog, parse_trial_log, read_trial_logs
+
+
+def encode_records(records) -> bytes:
+    """Encodes trial log records as the lines of a log."""
+    return "".join(json.dumps(record) + "\n" for record in records).encode()
+
+
+def test_parse_trial_log_ignores_duplicates_and_incomplete_records():
+    data = encode_records(
+        [
+            {"batch": 0, "trials": 5, "successes": [1]},
+            {"batch": 2, "trials": 5, "successes": [3]},
+            {"batch": 0, "trials": 5, "successes": [4]},
+        ]
+    )
+    batches, valid_length = parse_trial_log(data + b'{"batch": 3, "tri')
+
+    assert valid_length == len(data)
+    assert sorted(batches) == [0, 2]
+    assert batches[0][1].tolist() == [1]
+
+
+def test_trial_log_discards_incomplete_record_and_resumes(tmp_path):
+    path = str(tmp_path / "log.jsonl")
+    with TrialLog(path) as trial_log:
+        trial_log.append(0, 4, [1, 2])
+        trial_log.append(1, 4, [0, 3])
+    with open(path, "ab") as f:
+        f.write(b'{"batch": 2')
+
+    with TrialLog(path) as trial_log:
+        n_trials, n_successes, logged_batches = trial_log.resume(2)
+        trial_log.append(2, 3, [1, 1])
+    assert (n_trials, n_successes.tolist(), logged_batches) == (8, [1, 5], {0, 1})
+
+    with open(path, "rb") as f:
+        batches, valid_length = parse_trial_log(f.read())
+    assert sorted(batches) == [0, 1, 2]
+
+
+def test_trial_log_rejects_statistic_count_mismatch(tmp_path):
+    path = str(tmp_path / "log.jsonl")
+    with TrialLog(path) as trial_log:
+        trial_log.append(0, 4, [1, 2])
+    with TrialLog(path) as trial_log:
+        with pytest.raises(ValueError):
+            trial_log.resume(3)
+
+
+def test_read_trial_logs_sums_files(tmp_path):
+    paths = [str(tmp_path / f"{i}.jsonl") for i in range(2)]
+    for i, path in enumerate(paths):
+        with TrialLog(path) as trial_log:
+            trial_log.append(i, 5, [i, 1])
+    n_trials, n_successes = read_trial_logs(paths, 2)
+    assert n_trials == 10 and n_successes.tolist() == [1, 2]
+
+
+def test_aggregate_trial_logs_only_reads_selected_simulations(work_dir):
+    (work_dir / "output").mkdir()
+    for simulation_id, successes in [("0", 2), ("1", 3), ("pool", 50)]:
+        with TrialLog(get_trial_log_path(simulation_id)) as trial_log:
+            trial_log.append(0, 10, [successes] * 5)
+
+    results = aggregate_trial_logs(["0", "1"], alpha=0.05)
+    assert [result.get_trial_count() for result in results] == [20] * 5
+    assert [result.get_success_count() for result in results] == [5] * 5
+    assert all(result.get_stop_reason() is not None for result in results)
+    assert (work_dir / "output" / "monte_carlo_5.agg.json").exists()
+
+    TrialLog(get_trial_log_path("empty")).close()
+    with pytest.raises(ValueError):
+        aggregate_trial_logs(["empty"])
+
+
+def draw_uniform(n_trials: int, rng: np.random.Generator) -> List[float]:
+    """Simulates a batch of trials, each drawing a uniform random number."""
+    return rng.random(n_trials).tolist()
+
+
+def identity(value: float) -> float:
+    """Uses the drawn number itself as the effect size."""
+    return value
+
+
+@pytest.mark.parametrize("run", [monte_carlo, monte_carlo_parallel])
+def test_resumed_simulation_matches_uninterrupted(tmp_path, run):
+    def run_seeded(log_path: str):
+        return run(
+            draw_uniform,
+            identity,
+            observed_effect_size=0.5,
+            n_trials=50,
+            batch_size=7,
+            log_path=log_path,
+            seed=1,
+            batched=True,
+        )
+
+    full_path = str(tmp_path / "full.jsonl")
+    expected = run_seeded(full_path)
+
+    # Keep a scattered subset of the batches, as if the run had been killed
+    with open(full_path, "rb") as f:
+        lines = f.read().splitlines(keepends=True)
+    kept = [line for line in lines if json.loads(line)["batch"] in {0, 3, 5}]
+    resumed_path = str(tmp_path / "resumed.jsonl")
+    with open(resumed_path, "wb") as f:
+        f.write(b"".join(kept))
+
+    result = run_seeded(resumed_path)
+    assert result.get_trial_count() == expected.get_trial_count() == 50
+    assert result.get_success_count() == expected.get_success_count()
+    with TrialLog(resumed_path) as trial_log:
+        assert trial_log.resume(1)[2] == set(range(8))
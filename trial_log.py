@@ -0,0 +1,136 @@
+"""The `trial_log` module records the progress of Monte-Carlo simulations so that they can be resumed."""
+
+import json
+import os
+from time import perf_counter
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+
+from options import TRIAL_LOG_FLUSH_INTERVAL
+
+
+def parse_trial_log(data: bytes) -> Tuple[Dict[int, Tuple[int, np.ndarray]], int]:
+    """
+    Parses the contents of a trial log. Returns the number of trials and success
+    counts of each logged batch, by batch index, and the length of the data that
+    could be parsed. A run that was killed part of the way through writing a record
+    leaves an incomplete line at the end of the log, which is ignored. If a batch
+    was logged more than once, only its first record is counted.
+    """
+    batches = {}
+    valid_length = 0
+    for line in data.splitlines(keepends=True):
+        if not line.endswith(b"\n"):
+            break
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            break
+        batches.setdefault(
+            record["batch"],
+            (record["trials"], np.array(record["successes"], dtype=np.int64)),
+        )
+        valid_length += len(line)
+    return batches, valid_length
+
+
+def sum_batches(
+    batches: Dict[int, Tuple[int, np.ndarray]], n_statistics: int
+) -> Tuple[int, np.ndarray]:
+    """
+    Sums the trials and success counts of the provided batches, which must all have
+    `n_statistics` statistics.
+    """
+    n_trials = 0
+    n_successes = np.zeros(n_statistics, dtype=np.int64)
+    for batch_trials, batch_successes in batches.values():
+        if len(batch_successes) != n_statistics:
+            raise ValueError(
+                f"trial log has {len(batch_successes)} statistics, but {n_statistics} were expected"
+            )
+        n_trials += batch_trials
+        n_successes += batch_successes
+    return n_trials, n_successes
+
+
+def read_trial_logs(filenames: List[str], n_statistics: int) -> Tuple[int, np.ndarray]:
+    """
+    Combines the trial logs of any number of simulations, which may be incomplete,
+    returning the total number of trials and successes for each statistic.
+    """
+    n_trials = 0
+    n_successes = np.zeros(n_statistics, dtype=np.int64)
+    for filename in filenames:
+        with open(filename, "rb") as f:
+            batches, _ = parse_trial_log(f.read())
+        log_trials, log_successes = sum_batches(batches, n_statistics)
+        n_trials += log_trials
+        n_successes += log_successes
+    return n_trials, n_successes
+
+
+class TrialLog:
+    """
+    TrialLog is an append-only log of the outcomes of a Monte-Carlo simulation. Each
+    line is a JSON record of a batch of trials, with the index of the batch, its
+    number of trials and the number of successes for each statistic. Batches can
+    complete in any order, so a resumed simulation runs exactly the batches whose
+    indices aren't logged. Records are flushed to disk at most every `flush_interval`
+    seconds, so a killed simulation loses at most that much work.
+    """
+
+    def __init__(self, filename: str, flush_interval: float = TRIAL_LOG_FLUSH_INTERVAL):
+        """
+        Opens the trial log at `filename` for appending, creating it if it doesn't
+        exist. Any incomplete record at the end of an existing log is discarded.
+        """
+        self.filename = filename
+        self.flush_interval = flush_interval
+
+        self.file = open(filename, "ab+")
+        self.file.seek(0)
+        self.batches, valid_length = parse_trial_log(self.file.read())
+        self.file.truncate(valid_length)
+        self.last_flush = perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def resume(self, n_statistics: int) -> Tuple[int, np.ndarray, Set[int]]:
+        """
+        Returns the number of trials and successes for each of `n_statistics`
+        statistics that were logged before the log was opened, along with the
+        indices of the batches they came from.
+        """
+        n_trials, n_successes = sum_batches(self.batches, n_statistics)
+        return n_trials, n_successes, set(self.batches)
+
+    def append(self, batch_index: int, n_trials: int, n_successes: np.ndarray):
+        """
+        Logs the batch at `batch_index`, which ran `n_trials` trials with `n_successes`
+        successes for each statistic.
+        """
+        record = {
+            "batch": int(batch_index),
+            "trials": int(n_trials),
+            "successes": [int(s) for s in n_successes],
+        }
+        self.file.write((json.dumps(record) + "\n").encode())
+        if perf_counter() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Writes any buffered records to disk."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_flush = perf_counter()
+
+    def close(self):
+        """Flushes and closes the log."""
+        if not self.file.closed:
+            self.flush()
+            self.file.close()